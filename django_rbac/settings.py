@@ -135,6 +135,8 @@ REST_FRAMEWORK = {
     # 1. 认证配置：指定默认的认证类
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',  # 使用JWT认证
+        # 开启 RBAC_TOKEN_CLAIMS 后可改用 'rbac.authentication.RBACJWTAuthentication'，
+        # 由令牌声明构造用户，鉴权阶段不再查询用户表
     ),
     
     # 2. 权限配置：默认所有接口都需要认证
@@ -168,6 +170,14 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',        # token中用户ID的声明名称
 }
 
+# 异步认证视图：使用 ASGI 部署时开启，登录、刷新、注册改用异步视图，
+# 密码哈希在大小为 AUTH_HASH_POOL_SIZE 的线程池中计算，不阻塞事件循环
+AUTH_ASYNC_VIEWS = False
+AUTH_HASH_POOL_SIZE = 4
+# 注册快速路径：不在插入前查询用户名和手机号是否已存在，只执行一次 INSERT，
+# 由数据库唯一约束保证唯一性，冲突时返回与原来相同的字段错误
+AUTH_REGISTER_FAST_PATH = False
+
 # 缓存配置
 CACHES = {
     'default': {
@@ -181,11 +191,44 @@ CACHES = {
 
 # 权限缓存配置
 PERMISSION_CACHE_TIMEOUT = 3600  # 权限缓存过期时间（单位：秒），默认1小时
+PERMISSION_CACHE_CONNECT_TIMEOUT = 0.1  # 连接 Redis 的超时时间（单位：秒）
+PERMISSION_CACHE_READ_TIMEOUT = 0.2  # 读写 Redis 的超时时间（单位：秒），Redis 无响应时鉴权最多等待这么久
+PERMISSION_CACHE_BREAKER_THRESHOLD = 5  # 缓存连续失败多少次后熔断，熔断期间不再访问 Redis
+PERMISSION_CACHE_BREAKER_PROBE_INTERVAL = 5  # 熔断后后台探测 Redis 是否恢复的间隔（单位：秒）
+PERMISSION_FALLBACK_CACHE = None  # 熔断期间使用的降级缓存别名（如文件缓存），None表示使用进程内缓存
+PERMISSION_FALLBACK_MAX_ENTRIES = 10000  # 进程内降级缓存的最大条目数
+PERMISSION_FALLBACK_TIMEOUT = 30  # 降级缓存条目的最长过期时间（单位：秒），即熔断期间权限变更在其他进程生效的最大延迟
+PERMISSION_CACHE_TIMEOUT_JITTER = 0.1  # 过期时间随机缩短的最大比例，避免同一批缓存同时过期
+PERMISSION_CACHE_EARLY_REFRESH_BETA = 1.0  # 临近过期时按概率提前刷新的系数，越大越早刷新，0表示关闭
+PERMISSION_SNAPSHOT_LOCK_TIMEOUT = 5  # 编译RBAC快照时跨进程锁的过期时间（单位：秒）
+PERMISSION_SNAPSHOT_LOCK_WAIT = 1  # 其他进程等待快照编译完成的最长时间（单位：秒），超时后自行编译
+PERMISSION_LOCAL_CACHE_SIZE = 0  # 进程内一级缓存最多保存的用户数，0表示关闭一级缓存
+PERMISSION_LOCAL_CACHE_TIMEOUT = 5  # 一级缓存过期时间（单位：秒），即权限变更在其他进程生效的最大延迟
+PERMISSION_VERSION_CHECK_INTERVAL = 1  # 进程内缓存RBAC版本号的时间（单位：秒），0表示每次鉴权都读取
+PERMISSION_ASYNC_REDIS_MAX_CONNECTIONS = 50  # 异步鉴权接口（ASGI）使用的 Redis 连接池大小，每个事件循环一个连接池
+# 维护用户有效权限物化表（rbac.UserPermission），缓存不可用时按索引查询物化表，而不是连接关联表后去重；
+# 开启前先执行 python manage.py rebuild_user_permissions 生成初始数据
+PERMISSION_MATERIALIZED = False
+
+# Redis 无响应时快速失败，而不是阻塞在系统默认的套接字超时上
+CACHES['default']['OPTIONS'].update(
+    SOCKET_CONNECT_TIMEOUT=PERMISSION_CACHE_CONNECT_TIMEOUT,
+    SOCKET_TIMEOUT=PERMISSION_CACHE_READ_TIMEOUT,
+)
+
+# 令牌内嵌RBAC声明：开启后登录和刷新签发的令牌携带角色ID、超级管理员标记和RBAC代数，
+# 代数未过期时直接根据令牌鉴权，不查询用户权限缓存
+RBAC_TOKEN_CLAIMS = False
+# 角色分配版本的分桶数：用户角色变更只使同一分桶内用户的令牌声明过期，分桶越多影响范围越小，
+# 每次读取版本号的键越多；批量分配角色时最多使所有分桶过期
+RBAC_ASSIGNMENT_VERSION_BUCKETS = 64
 
 # 权限白名单配置
 PERMISSION_WHITELIST = [
     '/api/auth/login/',
     '/api/auth/register/',
     '/api/auth/refresh/',
+    '/api/rbac/metrics/',
+    '/api/rbac/menus/',  # 只需登录，由视图的 IsAuthenticated 校验
 ]
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RbacConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rbac'
+
+    def ready(self):
+        # 注册权限缓存失效信号
+        from . import signals  # noqa: F401
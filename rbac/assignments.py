@@ -0,0 +1,83 @@
+from django.db import transaction
+from . import materialized
+from .signals import invalidate_snapshot, invalidate_users
+from .snapshot import RolePermissions
+from .utils import UserRoles
+
+# 每批写入或删除的关系数量
+BATCH_SIZE = 1000
+
+
+def _bulk_sync(through, left_field, right_field, pairs, mode):
+    """
+    在一个事务内批量改写多对多关联表
+    新增的关系用 bulk_create 写入，需要删除的关系按右侧ID分组删除，不触发 m2m_changed 信号
+    
+    Args:
+        through: 关联表模型
+        left_field / right_field: 关联表两侧的外键字段名（如 user_id / role_id）
+        pairs: {(左侧ID, 右侧ID)}
+        mode: add / remove / replace，replace 只替换 pairs 中出现的左侧对象的关系
+        
+    Returns:
+        tuple: (新增的关系集合, 删除的关系集合)
+    """
+    pairs = set(pairs)
+    left_ids = {left for left, _ in pairs}
+    with transaction.atomic():
+        existing = set(
+            through.objects.filter(**{f'{left_field}__in': left_ids})
+            .values_list(left_field, right_field)
+        )
+        added = pairs - existing if mode != 'remove' else set()
+        if mode == 'add':
+            removed = set()
+        elif mode == 'remove':
+            removed = pairs & existing
+        else:
+            removed = existing - pairs
+
+        by_right = {}
+        for left, right in removed:
+            by_right.setdefault(right, []).append(left)
+        for right, lefts in by_right.items():
+            for start in range(0, len(lefts), BATCH_SIZE):
+                through.objects.filter(**{
+                    right_field: right,
+                    f'{left_field}__in': lefts[start:start + BATCH_SIZE],
+                }).delete()
+        through.objects.bulk_create(
+            [through(**{left_field: left, right_field: right}) for left, right in added],
+            batch_size=BATCH_SIZE,
+        )
+    return added, removed
+
+
+def bulk_assign_user_roles(pairs, mode='add'):
+    """
+    批量分配用户角色
+    完成后只清除关系发生变化的用户的缓存（一次批量删除）
+    
+    Returns:
+        tuple: (新增数量, 删除数量)
+    """
+    added, removed = _bulk_sync(UserRoles, 'user_id', 'role_id', pairs, mode)
+    user_ids = {user_id for user_id, _ in added | removed}
+    materialized.refresh_users(user_ids)
+    invalidate_users(user_ids)
+    return len(added), len(removed)
+
+
+def bulk_assign_role_permissions(pairs, mode='add'):
+    """
+    批量分配角色权限
+    角色-权限关系只编译在快照中，完成后重新编译一次快照即可
+    
+    Returns:
+        tuple: (新增数量, 删除数量)
+    """
+    added, removed = _bulk_sync(RolePermissions, 'role_id', 'permission_id', pairs, mode)
+    if added or removed:
+        materialized.refresh_roles({role_id for role_id, _ in added | removed})
+        invalidate_snapshot()
+    return len(added), len(removed)
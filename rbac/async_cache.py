@@ -0,0 +1,105 @@
+import asyncio
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# 异步 Redis 客户端每个事件循环的最大连接数
+DEFAULT_MAX_CONNECTIONS = 50
+
+
+class AsyncRedisCache:
+    """
+    与 django_redis 共享键格式和序列化方式的异步 Redis 客户端
+    基于 redis.asyncio 的连接池，每个事件循环各自持有连接池（异步连接不能跨事件循环使用）
+    """
+
+    def __init__(self, location, options):
+        self.location = location
+        self.options = options
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            from redis import asyncio as aioredis
+            client = self._clients[loop] = aioredis.Redis.from_url(
+                self.location,
+                password=self.options.get('PASSWORD'),
+                max_connections=getattr(settings, 'PERMISSION_ASYNC_REDIS_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS),
+                socket_connect_timeout=self.options.get('SOCKET_CONNECT_TIMEOUT'),
+                socket_timeout=self.options.get('SOCKET_TIMEOUT'),
+            )
+        return client
+
+    @property
+    def _codec(self):
+        # django_redis 客户端的 make_key/encode/decode 不涉及网络，可以在事件循环中直接调用
+        return caches['default'].client
+
+    async def get(self, key):
+        codec = self._codec
+        value = await self._client().get(codec.make_key(key))
+        return None if value is None else codec.decode(value)
+
+    async def get_many(self, keys):
+        codec = self._codec
+        keys = list(keys)
+        values = await self._client().mget([codec.make_key(key) for key in keys])
+        return {key: codec.decode(value) for key, value in zip(keys, values) if value is not None}
+
+    async def set(self, key, value, timeout):
+        codec = self._codec
+        await self._client().set(codec.make_key(key), codec.encode(value), ex=timeout)
+
+    async def add(self, key, value, timeout):
+        codec = self._codec
+        return bool(await self._client().set(codec.make_key(key), codec.encode(value), ex=timeout, nx=True))
+
+
+class AsyncDjangoCache:
+    """其他缓存后端使用 Django 自带的异步缓存接口（后端未原生实现时由 Django 转到线程中执行）"""
+
+    async def get(self, key):
+        return await caches['default'].aget(key)
+
+    async def get_many(self, keys):
+        return await caches['default'].aget_many(list(keys))
+
+    async def set(self, key, value, timeout):
+        await caches['default'].aset(key, value, timeout)
+
+    async def add(self, key, value, timeout):
+        return await caches['default'].aadd(key, value, timeout)
+
+
+_async_cache = None
+
+
+def get_async_cache():
+    """
+    获取默认缓存的异步客户端
+    默认缓存为 django_redis 时使用原生异步 Redis 客户端，否则使用 Django 的异步缓存接口
+    """
+    global _async_cache
+    if _async_cache is None:
+        config = settings.CACHES['default']
+        if config['BACKEND'].startswith('django_redis.'):
+            location = config['LOCATION']
+            if isinstance(location, str):
+                location = location.split(',')
+            # 第一个地址为主节点，与同步客户端的写入节点一致
+            _async_cache = AsyncRedisCache(location[0], config.get('OPTIONS', {}))
+        else:
+            _async_cache = AsyncDjangoCache()
+    return _async_cache
+
+
+@receiver(setting_changed)
+def reset_async_cache(setting, **kwargs):
+    global _async_cache
+    if setting == 'CACHES':
+        _async_cache = None
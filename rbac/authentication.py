@@ -0,0 +1,115 @@
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from .tokens import ROLES_CLAIM, SUPERUSER_CLAIM
+
+User = get_user_model()
+
+
+class RBACTokenUser(TokenUser):
+    """
+    由令牌声明构造的轻量用户对象
+    id、is_superuser、角色ID直接取自令牌，访问令牌中没有的字段时才从数据库加载用户，
+    每个请求最多加载一次
+    """
+
+    @cached_property
+    def id(self):
+        # 令牌中的用户ID可能是字符串，转换为模型字段的类型，与缓存中以主键为键的条目一致
+        return User._meta.get_field(api_settings.USER_ID_FIELD).to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def is_superuser(self):
+        if SUPERUSER_CLAIM in self.token:
+            return self.token[SUPERUSER_CLAIM]
+        return self.get_user().is_superuser
+
+    @cached_property
+    def username(self):
+        if 'username' in self.token:
+            return self.token['username']
+        return self.get_user().username
+
+    @cached_property
+    def is_staff(self):
+        if 'is_staff' in self.token:
+            return self.token['is_staff']
+        return self.get_user().is_staff
+
+    @cached_property
+    def role_ids(self):
+        """令牌中的角色ID，令牌没有角色声明时从数据库查询"""
+        if ROLES_CLAIM in self.token:
+            return tuple(self.token[ROLES_CLAIM])
+        return tuple(self.get_user().roles.values_list('id', flat=True))
+
+    def get_user(self):
+        """加载对应的用户模型实例，用户不存在或已停用时认证失败"""
+        try:
+            return self.__dict__['_user']
+        except KeyError:
+            pass
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: self.id}).first()
+        if user is None:
+            raise AuthenticationFailed('用户不存在', code='user_not_found')
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed('用户已停用', code='user_inactive')
+        self.__dict__['_user'] = user
+        return user
+
+    async def aget_user(self):
+        """get_user 的异步版本，加载后 is_superuser 等字段直接读取已加载的用户"""
+        try:
+            return self.__dict__['_user']
+        except KeyError:
+            pass
+        user = await User.objects.filter(**{api_settings.USER_ID_FIELD: self.id}).afirst()
+        if user is None:
+            raise AuthenticationFailed('用户不存在', code='user_not_found')
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed('用户已停用', code='user_inactive')
+        self.__dict__['_user'] = user
+        return user
+
+    def __getattr__(self, name):
+        # 只有类和实例上都不存在的属性才会进入这里，转交给数据库中的用户对象
+        if name.startswith('__') or name in ('token', '_user'):
+            raise AttributeError(name)
+        return getattr(self.get_user(), name)
+
+    def save(self, *args, **kwargs):
+        return self.get_user().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.get_user().delete(*args, **kwargs)
+
+    def set_password(self, raw_password):
+        return self.get_user().set_password(raw_password)
+
+    def check_password(self, raw_password):
+        return self.get_user().check_password(raw_password)
+
+    @property
+    def groups(self):
+        return self.get_user().groups
+
+    @property
+    def user_permissions(self):
+        return self.get_user().user_permissions
+
+
+class RBACJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    无状态JWT认证
+    按 SIMPLE_JWT 配置校验令牌，但不查询用户表，而是返回由令牌声明构造的 RBACTokenUser；
+    与 RBAC_TOKEN_CLAIMS 配合使用时，只需鉴权的请求不产生任何SQL查询
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('令牌中没有可识别的用户标识')
+        return RBACTokenUser(validated_token)
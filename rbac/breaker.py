@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from . import metrics
+from .async_cache import get_async_cache
+
+logger = logging.getLogger(__name__)
+
+# 熔断期间会使其他进程的数据过期的操作
+INVALIDATION_OPERATIONS = ('incr', 'delete', 'delete_many')
+# 后台探测读取的键
+PROBE_KEY = 'rbac_cache_probe'
+
+
+class CircuitBreaker:
+    """
+    缓存熔断器
+    连续失败 PERMISSION_CACHE_BREAKER_THRESHOLD 次后打开，打开期间不再访问 Redis；
+    由后台线程每隔 PERMISSION_CACHE_BREAKER_PROBE_INTERVAL 秒探测一次，探测成功后关闭
+    """
+
+    def __init__(self, probe, on_close=None):
+        self.probe = probe
+        self.on_close = on_close
+        self.is_open = False
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否可以访问 Redis"""
+        return not self.is_open
+
+    def record_success(self):
+        if self.failures:
+            self.failures = 0
+
+    def record_failure(self):
+        threshold = getattr(settings, 'PERMISSION_CACHE_BREAKER_THRESHOLD', 5)
+        with self._lock:
+            self.failures += 1
+            if self.is_open or self.failures < threshold:
+                return
+            self.is_open = True
+        logger.error('权限缓存连续 %s 次访问失败，熔断并改用本地降级缓存', self.failures)
+        metrics.breaker_trips.inc()
+        threading.Thread(target=self._probe_loop, name='rbac-cache-probe', daemon=True).start()
+
+    def _probe_loop(self):
+        interval = getattr(settings, 'PERMISSION_CACHE_BREAKER_PROBE_INTERVAL', 5)
+        while self.is_open:
+            time.sleep(interval)
+            try:
+                self.probe()
+            except Exception:
+                continue
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if not self.is_open:
+                return
+            self.is_open = False
+            self.failures = 0
+        logger.warning('权限缓存已恢复，关闭熔断')
+        if self.on_close is not None:
+            try:
+                self.on_close()
+            except Exception:
+                logger.warning('熔断恢复回调执行失败', exc_info=True)
+
+
+class BreakerCache:
+    """
+    带熔断的权限缓存，接口与 Django 缓存一致（只包含权限缓存用到的操作）
+    熔断关闭时访问默认缓存并记录成败；熔断打开时立即改用本地降级缓存，不等待 Redis 超时。
+    降级缓存只在本进程内有效，条目的过期时间不超过 PERMISSION_FALLBACK_TIMEOUT 秒，
+    其他进程上的权限变更最迟在该时间后生效
+    """
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(self._probe, self._recovered)
+        self.on_recover = None
+        # 熔断期间本进程是否发生过失效操作
+        self.pending_invalidation = False
+        self._fallback = None
+
+    @property
+    def fallback(self):
+        """
+        本地降级缓存
+        PERMISSION_FALLBACK_CACHE 指定 CACHES 中的别名（如文件缓存），未指定时使用有容量上限的进程内缓存
+        """
+        alias = getattr(settings, 'PERMISSION_FALLBACK_CACHE', None)
+        if alias:
+            return caches[alias]
+        if self._fallback is None:
+            self._fallback = LocMemCache('rbac-fallback', {
+                'OPTIONS': {'MAX_ENTRIES': getattr(settings, 'PERMISSION_FALLBACK_MAX_ENTRIES', 10000)},
+            })
+        return self._fallback
+
+    def _probe(self):
+        caches['default'].get(PROBE_KEY)
+
+    def _recovered(self):
+        if self.pending_invalidation and self.on_recover is not None:
+            self.pending_invalidation = False
+            try:
+                self.on_recover()
+            except Exception:
+                self.pending_invalidation = True
+                raise
+
+    def _call(self, name, *args):
+        if self.breaker.allow():
+            try:
+                result = getattr(caches['default'], name)(*args)
+            except ValueError:
+                # incr 的键不存在等，不属于连接故障
+                self.breaker.record_success()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                if name in INVALIDATION_OPERATIONS:
+                    self.pending_invalidation = True
+                raise
+            self.breaker.record_success()
+            return result
+
+        metrics.fallback_operations.inc(name)
+        if name in INVALIDATION_OPERATIONS:
+            self.pending_invalidation = True
+        if name in ('set', 'set_many', 'add'):
+            # 最后一个参数为过期时间
+            limit = getattr(settings, 'PERMISSION_FALLBACK_TIMEOUT', 30)
+            timeout = args[-1]
+            args = (*args[:-1], limit if timeout is None else min(timeout, limit))
+        return getattr(self.fallback, name)(*args)
+
+    async def _acall(self, name, *args):
+        if not self.breaker.allow():
+            # 本地降级缓存在进程内，直接同步调用
+            return self._call(name, *args)
+        try:
+            result = await getattr(get_async_cache(), name)(*args)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def async_client(self):
+        """异步接口使用的缓存客户端，与同步接口共用熔断状态"""
+        return AsyncBreakerCache(self)
+
+    def get(self, key):
+        return self._call('get', key)
+
+    def get_many(self, keys):
+        return self._call('get_many', keys)
+
+    def set(self, key, value, timeout):
+        return self._call('set', key, value, timeout)
+
+    def set_many(self, data, timeout):
+        return self._call('set_many', data, timeout)
+
+    def add(self, key, value, timeout):
+        return self._call('add', key, value, timeout)
+
+    def incr(self, key):
+        return self._call('incr', key)
+
+    def delete(self, key):
+        return self._call('delete', key)
+
+    def delete_many(self, keys):
+        return self._call('delete_many', keys)
+
+
+class AsyncBreakerCache:
+    """BreakerCache 的异步接口，只包含异步鉴权用到的操作"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def get(self, key):
+        return await self.cache._acall('get', key)
+
+    async def get_many(self, keys):
+        return await self.cache._acall('get_many', keys)
+
+    async def set(self, key, value, timeout):
+        return await self.cache._acall('set', key, value, timeout)
+
+    async def add(self, key, value, timeout):
+        return await self.cache._acall('add', key, value, timeout)
+
+
+permission_cache = BreakerCache()
+
+metrics.CallbackGauge(
+    'rbac_cache_breaker_open', 'Whether the permission cache circuit breaker is open',
+    lambda: {(): int(permission_cache.breaker.is_open)},
+)
+
+
+@receiver(setting_changed)
+def reset_fallback_cache(setting, **kwargs):
+    if setting in ('PERMISSION_FALLBACK_CACHE', 'PERMISSION_FALLBACK_MAX_ENTRIES'):
+        permission_cache._fallback = None
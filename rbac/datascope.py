@@ -0,0 +1,104 @@
+import logging
+
+from django.db.models import Q
+from .models import DataScope, RoleClosure
+from .snapshot import EffectivePermissions, get_local_snapshot
+from .utils import PermissionCache, UserRoles
+
+logger = logging.getLogger(__name__)
+
+
+def resource_of(model):
+    """模型对应的数据权限资源标识，如 rbac.role"""
+    return model._meta.label_lower
+
+
+def get_scope_rules(user_id, resource, permissions=None):
+    """
+    获取用户在资源上的数据权限规则，None 表示不受限制
+    规则编译在RBAC快照中，与用户权限共用缓存和失效机制；缓存不可用时直接查询数据库
+
+    Args:
+        permissions: 本次请求鉴权时已得到的用户有效权限（见 RBACPermission），传入时不再查询用户权限
+    """
+    if permissions is None:
+        if not _has_scopes(resource):
+            return None
+        permissions = PermissionCache.get_permission_set(user_id)
+    if isinstance(permissions, EffectivePermissions):
+        return permissions.snapshot.scope_rules(resource, permissions.role_ids)
+    return _get_scope_rules_from_db(user_id, resource)
+
+
+def _has_scopes(resource):
+    """
+    资源是否可能配置了数据权限
+    进程内快照是当前版本且其中没有该资源时返回 False，无需查询用户权限；无法确定时返回 True
+    """
+    snapshot = get_local_snapshot()
+    if snapshot is None or resource in snapshot.data_scopes:
+        return True
+    try:
+        return snapshot.version != PermissionCache.get_versions().policy_version
+    except Exception:
+        logger.warning('读取RBAC版本失败', exc_info=True)
+        return True
+
+
+def _get_scope_rules_from_db(user_id, resource):
+    scopes = DataScope.objects.filter(resource=resource)
+    if not scopes.exists():
+        return None
+    role_ids = UserRoles.objects.filter(user_id=user_id).values('role_id')
+    ancestor_ids = RoleClosure.objects.filter(descendant_id__in=role_ids).values('ancestor_id')
+    rules = {
+        (scope, field, user_field, tuple(ids or ()))
+        for scope, field, user_field, ids in (
+            scopes.filter(Q(role__in=role_ids) | Q(role__in=ancestor_ids))
+            .values_list('scope', 'field', 'user_field', 'ids')
+        )
+    }
+    if any(rule[0] == DataScope.SCOPE_ALL for rule in rules):
+        return None
+    return rules
+
+
+def compile_rules(rules, user):
+    """
+    将数据权限规则编译为 Q 过滤条件，规则之间取并集
+    没有任何可用规则时返回 None，表示没有可访问的记录
+    """
+    conditions = []
+    for scope, field, user_field, ids in sorted(rules):
+        if scope == DataScope.SCOPE_SELF:
+            conditions.append(Q(**{field or 'pk': user.pk}))
+        elif scope == DataScope.SCOPE_FIELD:
+            value = getattr(user, user_field, None)
+            if value is not None:
+                conditions.append(Q(**{field: value}))
+        elif scope == DataScope.SCOPE_IDS and ids:
+            conditions.append(Q(pk__in=ids))
+    if not conditions:
+        return None
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition |= other
+    return condition
+
+
+def filter_queryset(queryset, user, permissions=None):
+    """
+    按用户的数据权限过滤查询，过滤条件由数据库执行，超级管理员不受限制
+    permissions 为本次请求鉴权时已得到的用户有效权限，可省略
+    """
+    if not user or not user.is_authenticated:
+        return queryset.none()
+    if user.is_superuser:
+        return queryset
+    rules = get_scope_rules(user.pk, resource_of(queryset.model), permissions)
+    if rules is None:
+        return queryset
+    condition = compile_rules(rules, user)
+    if condition is None:
+        return queryset.none()
+    return queryset.filter(condition)
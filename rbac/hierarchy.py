@@ -0,0 +1,83 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .models import Role, RoleClosure
+
+# 角色继承关系表：from_role 为子角色，to_role 为父角色
+RoleParents = Role.parents.through
+
+
+def descendants_of(role_ids):
+    """查询指定角色的所有后代角色ID（不含自身）"""
+    return set(
+        RoleClosure.objects.filter(ancestor_id__in=role_ids)
+        .values_list('descendant_id', flat=True)
+    )
+
+
+def ancestors_of(role_ids):
+    """查询指定角色的所有祖先角色ID（不含自身）"""
+    return set(
+        RoleClosure.objects.filter(descendant_id__in=role_ids)
+        .values_list('ancestor_id', flat=True)
+    )
+
+
+def check_parents(role_id, parent_ids):
+    """
+    检查为角色添加父角色后是否会形成循环继承
+    父角色是该角色自身或其后代时抛出 ValidationError
+    """
+    parent_ids = set(parent_ids)
+    if role_id in parent_ids or RoleClosure.objects.filter(
+        ancestor_id=role_id, descendant_id__in=parent_ids,
+    ).exists():
+        raise ValidationError('角色继承关系不能形成循环', code='cycle')
+
+
+def refresh_closure(role_ids):
+    """
+    重新计算指定角色的闭包行
+    继承关系变更时传入变更的子角色及其全部后代，只改写这些角色的祖先行；
+    其余父角色的闭包行保持不变，直接用于推导，不需要递归查询
+    """
+    affected = set(role_ids)
+    if not affected:
+        return
+    parents = {}
+    for child_id, parent_id in RoleParents.objects.filter(from_role_id__in=affected).values_list('from_role_id', 'to_role_id'):
+        parents.setdefault(child_id, []).append(parent_id)
+
+    # 不受影响的父角色：闭包行仍然正确，一次查询取回
+    known = {
+        role_id: {}
+        for role_id in {parent_id for ids in parents.values() for parent_id in ids} - affected
+    }
+    rows = RoleClosure.objects.filter(descendant_id__in=list(known)).values_list('descendant_id', 'ancestor_id', 'depth')
+    for descendant_id, ancestor_id, depth in rows:
+        known[descendant_id][ancestor_id] = depth
+
+    def ancestors(role_id):
+        """{祖先角色ID: 最短继承层数}，受影响的角色按继承顺序依次计算"""
+        result = known.get(role_id)
+        if result is None:
+            result = {}
+            for parent_id in parents.get(role_id, ()):
+                for ancestor_id, depth in [(parent_id, 0), *ancestors(parent_id).items()]:
+                    if depth + 1 < result.get(ancestor_id, depth + 2):
+                        result[ancestor_id] = depth + 1
+            known[role_id] = result
+        return result
+
+    closure = [
+        RoleClosure(ancestor_id=ancestor_id, descendant_id=role_id, depth=depth)
+        for role_id in affected
+        for ancestor_id, depth in ancestors(role_id).items()
+    ]
+    with transaction.atomic():
+        RoleClosure.objects.filter(descendant_id__in=affected).delete()
+        RoleClosure.objects.bulk_create(closure)
+
+
+def rebuild_closure():
+    """重建整张闭包表，用于导入数据或修复不一致"""
+    refresh_closure(Role.objects.values_list('id', flat=True))
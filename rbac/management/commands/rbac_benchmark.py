@@ -0,0 +1,248 @@
+import json
+import platform
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.request import Request
+from rbac.models import Permission, Role
+from rbac.permissions import RBACPermission
+from rbac.snapshot import set_local_snapshot
+from rbac.utils import PermissionCache, UserRoles
+
+User = get_user_model()
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'rbac-benchmark',
+        # 默认300条上限会在压测中淘汰条目，造成虚假的未命中
+        'OPTIONS': {'MAX_ENTRIES': 10 ** 7},
+    }
+}
+
+# 统计调用次数的缓存方法
+CACHE_OPERATIONS = ('get', 'get_many', 'set', 'set_many', 'add', 'incr', 'delete', 'delete_many')
+
+
+class _Rollback(Exception):
+    """用于在压测结束后回滚生成的数据"""
+
+
+class CacheCounter:
+    """
+    在缓存后端实例上包装常用方法，统计调用次数
+    只统计最外层调用（如 get_many 内部调用的 get 不重复计数），对应实际的网络往返次数
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.counts = dict.fromkeys(CACHE_OPERATIONS, 0)
+        self._depth = 0
+
+    def __enter__(self):
+        for name in CACHE_OPERATIONS:
+            original = getattr(self.backend, name)
+            setattr(self.backend, name, self._wrap(name, original))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name in CACHE_OPERATIONS:
+            self.backend.__dict__.pop(name, None)
+
+    def _wrap(self, name, original):
+        def wrapper(*args, **kwargs):
+            if not self._depth:
+                self.counts[name] += 1
+            self._depth += 1
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self._depth -= 1
+        return wrapper
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+class Command(BaseCommand):
+    help = '生成合成RBAC数据，测量权限检查在冷缓存、热缓存和失效后的耗时、SQL查询数和缓存操作数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='用户数')
+        parser.add_argument('--roles', type=int, default=50, help='角色数')
+        parser.add_argument('--permissions', type=int, default=500, help='权限数')
+        parser.add_argument('--roles-per-user', type=int, default=3, help='每个用户的角色数')
+        parser.add_argument('--permissions-per-role', type=int, default=50, help='每个角色的权限数')
+        parser.add_argument('--checks', type=int, default=2000, help='热缓存阶段的检查次数')
+        parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+        parser.add_argument(
+            '--cache', choices=['locmem', 'default'], default='locmem',
+            help='locmem：使用进程内缓存离线运行（默认）；default：使用 settings.CACHES',
+        )
+        parser.add_argument('--local-cache-size', type=int, default=0, help='一级缓存容量，0 表示关闭')
+        parser.add_argument('--output', help='结果写入的JSON文件，默认输出到标准输出')
+
+    def handle(self, *args, **options):
+        overrides = {'PERMISSION_LOCAL_CACHE_SIZE': options['local_cache_size']}
+        if options['cache'] == 'locmem':
+            overrides['CACHES'] = LOCMEM_CACHES
+
+        with override_settings(**overrides):
+            results = {}
+            try:
+                with transaction.atomic():
+                    self.rng = random.Random(options['seed'])
+                    graph = self._build_graph(options)
+                    results = self._run(graph, options)
+                    raise _Rollback
+            except _Rollback:
+                pass
+            finally:
+                # 压测数据已回滚，丢弃据此编译的快照和缓存版本
+                set_local_snapshot(None)
+                PermissionCache.clear_user_permissions()
+
+        report = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'cache': options['cache'],
+            },
+            'parameters': {
+                key: options[key] for key in (
+                    'users', 'roles', 'permissions', 'roles_per_user',
+                    'permissions_per_role', 'checks', 'seed', 'local_cache_size',
+                )
+            },
+            'results': results,
+        }
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(content)
+        else:
+            self.stdout.write(content)
+
+    def _build_graph(self, options):
+        """批量生成用户、角色、权限及其关联"""
+        rng = self.rng
+        prefix = f"bench{int(time.time())}"
+        Permission.objects.bulk_create([
+            Permission(codename=f"get:/api/{prefix}/resource{i}/", desc='benchmark')
+            for i in range(options['permissions'])
+        ])
+        Role.objects.bulk_create([
+            Role(name=f"{prefix}_role{i}") for i in range(options['roles'])
+        ])
+        User.objects.bulk_create([
+            User(username=f"{prefix}_user{i}", mobile=f"{i:011d}", password='!')
+            for i in range(options['users'])
+        ])
+        # 部分数据库的 bulk_create 不回填主键，重新查询
+        permission_ids = list(Permission.objects.filter(codename__contains=prefix).values_list('id', flat=True))
+        role_ids = list(Role.objects.filter(name__startswith=prefix).values_list('id', flat=True))
+        user_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+        Role.permissions.through.objects.bulk_create([
+            Role.permissions.through(role_id=role_id, permission_id=permission_id)
+            for role_id in role_ids
+            for permission_id in rng.sample(permission_ids, min(options['permissions_per_role'], len(permission_ids)))
+        ])
+        UserRoles.objects.bulk_create([
+            UserRoles(user_id=user_id, role_id=role_id)
+            for user_id in user_ids
+            for role_id in rng.sample(role_ids, min(options['roles_per_user'], len(role_ids)))
+        ])
+        codenames = dict(Permission.objects.filter(id__in=permission_ids).values_list('id', 'codename'))
+        users = {user.id: user for user in User.objects.filter(id__in=user_ids)}
+        return {'users': users, 'role_ids': role_ids, 'codenames': list(codenames.values())}
+
+    def _request(self, user, codename):
+        """构造已完成认证的DRF请求，模拟经过 JWTAuthentication 后的状态"""
+        method, _, path = codename.partition(':')
+        # 合成权限不对应真实路由，请求不带 resolver_match，走按路径鉴权的分支
+        request = APIRequestFactory().generic(method.upper(), path)
+        force_authenticate(request, user=user)
+        return Request(request)
+
+    def _measure(self, name, checks):
+        """
+        执行一组检查，返回耗时分位数以及平均每次检查的SQL查询数和缓存操作数
+        checks: [(user, codename)]
+        """
+        permission = RBACPermission()
+        requests = [(self._request(user, codename), user) for user, codename in checks]
+        for request, user in requests:
+            request.user  # 预先完成认证，只测量鉴权本身
+
+        latencies = []
+        with CaptureQueriesContext(connection) as queries, CacheCounter(caches['default']) as counter:
+            for request, _ in requests:
+                start = time.perf_counter()
+                permission.has_permission(request, None)
+                latencies.append((time.perf_counter() - start) * 1e6)
+
+        latencies.sort()
+        count = len(latencies)
+
+        def percentile(p):
+            return round(latencies[min(count - 1, int(count * p))], 2)
+
+        return {
+            'scenario': name,
+            'checks': count,
+            'latency_us': {
+                'mean': round(statistics.mean(latencies), 2),
+                'p50': percentile(0.50),
+                'p90': percentile(0.90),
+                'p99': percentile(0.99),
+                'max': round(latencies[-1], 2),
+            },
+            'sql_queries_per_check': round(len(queries) / count, 4),
+            'cache_ops_per_check': round(counter.total / count, 4),
+            'cache_ops': counter.counts,
+        }
+
+    def _run(self, graph, options):
+        rng = self.rng
+        users = list(graph['users'].values())
+        codenames = graph['codenames']
+
+        def sample(count):
+            return [(rng.choice(users), rng.choice(codenames)) for _ in range(count)]
+
+        results = []
+        # 1. 冷缓存：全局失效并丢弃进程内快照后，每个用户检查一次
+        PermissionCache.clear_user_permissions()
+        set_local_snapshot(None)
+        results.append(self._measure('cold', [(user, rng.choice(codenames)) for user in users]))
+
+        # 2. 热缓存
+        results.append(self._measure('warm', sample(options['checks'])))
+
+        # 3. 角色权限变更后：只有快照需要重新编译
+        role = Role.objects.get(id=rng.choice(graph['role_ids']))
+        role.permissions.remove(*role.permissions.all()[:1])
+        results.append(self._measure('after_role_change', sample(options['checks'])))
+
+        # 4. 用户角色变更后：只有该用户的缓存失效
+        user = rng.choice(users)
+        user.roles.add(rng.choice(graph['role_ids']))
+        results.append(self._measure('after_user_role_change', sample(options['checks'])))
+
+        # 5. 全局失效后
+        PermissionCache.clear_user_permissions()
+        results.append(self._measure('after_global_clear', sample(options['checks'])))
+        return results
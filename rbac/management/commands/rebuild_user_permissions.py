@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from rbac import materialized
+
+
+class Command(BaseCommand):
+    help = '重建用户有效权限物化表，或校验物化表与角色、权限关联表是否一致'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='只校验，不修改物化表；不一致时以非零状态退出')
+        parser.add_argument('--chunk-size', type=int, default=materialized.BATCH_SIZE, help='每批处理的用户数')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            missing, extra = materialized.verify(chunk_size=options['chunk_size'])
+            if missing or extra:
+                raise CommandError(f"物化表不一致：缺失 {missing} 行，多余 {extra} 行")
+            self.stdout.write(self.style.SUCCESS('物化表与关联表一致'))
+            return
+
+        count = materialized.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"重建完成：写入 {count} 行"))
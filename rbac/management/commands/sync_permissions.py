@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from rbac.models import Permission
+from rbac.routes import route_permissions
+from rbac.utils import PermissionCache
+
+
+class Command(BaseCommand):
+    help = '遍历 URLconf，为每个路由和请求方法批量创建对应的权限记录'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefix', action='append', dest='prefixes',
+            help='只同步以该前缀开头的路由，可重复指定，默认 /api/',
+        )
+        parser.add_argument(
+            '--update-desc', action='store_true',
+            help='同时用路由名称覆盖已存在权限的描述',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='只列出将要同步的权限，不写入数据库',
+        )
+
+    def handle(self, *args, **options):
+        permissions = route_permissions(options['prefixes'] or ['/api/'])
+        existing = set(
+            Permission.objects.filter(codename__in=permissions)
+            .values_list('codename', flat=True)
+        )
+        for codename in sorted(permissions):
+            marker = ' ' if codename in existing else '+'
+            self.stdout.write(f"{marker} {codename}  {permissions[codename]}")
+
+        if options['dry_run']:
+            return
+
+        objs = [Permission(codename=codename, desc=desc) for codename, desc in permissions.items()]
+        if options['update_desc']:
+            Permission.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=['codename'],
+                update_fields=['desc'],
+            )
+        else:
+            Permission.objects.bulk_create(objs, ignore_conflicts=True)
+        # bulk_create 不会触发信号，手动使快照失效
+        PermissionCache.clear_snapshot()
+
+        created = len(permissions) - len(existing)
+        self.stdout.write(self.style.SUCCESS(
+            f"同步完成：共 {len(permissions)} 条权限，新增 {created} 条"
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from rbac.utils import warm_permission_cache
+
+
+class Command(BaseCommand):
+    help = '预热活跃用户的权限缓存，分块批量查询角色并批量写入缓存'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--active-within', type=int,
+            help='只预热最近N天内登录过的用户（依据 last_login），默认全部活跃用户',
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每批处理的用户数')
+        parser.add_argument('--workers', type=int, default=1, help='并发写入的线程数')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(warmed, elapsed):
+            if verbosity > 1:
+                rate = warmed / elapsed if elapsed else 0
+                self.stdout.write(f"已预热 {warmed} 个用户，{rate:.0f} 个/秒")
+
+        result = warm_permission_cache(
+            active_within=options['active_within'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"预热完成：{result['users']} 个用户，{result['chunks']} 批，"
+            f"耗时 {result['seconds']} 秒，{result['users_per_second']} 个/秒"
+        ))
@@ -0,0 +1,80 @@
+def is_pattern(codename):
+    """codename 是否为路由模板或通配符形式"""
+    return '*' in codename or '{' in codename
+
+
+def _segments(codename):
+    """将 {method}:{path} 拆分为段：第一段为请求方法，其余为路径段（忽略首尾斜杠）"""
+    method, _, path = codename.partition(':')
+    path = path.strip('/')
+    return [method, *path.split('/')] if path else [method]
+
+
+class _Node:
+    __slots__ = ('children', 'wildcard', 'glob', 'is_glob', 'terminal')
+
+    def __init__(self, is_glob=False):
+        self.children = {}     # 字面量段 -> 子节点
+        self.wildcard = None   # 匹配任意一段的子节点（{name} 或 *）
+        self.glob = None       # 匹配任意多段的子节点（**）
+        self.is_glob = is_glob
+        self.terminal = False
+
+
+class CodenameMatcher:
+    """
+    权限模板匹配器
+    将一组带通配符的权限编译成按段组织的前缀树，匹配时逐段推进，
+    耗时与路径段数成正比，与模板数量无关
+
+    支持的写法（方法段和路径段均可使用）：
+        {name}  匹配任意一段，如 get:/api/rbac/permissions/{id}/
+        *       匹配任意一段，如 *:/api/rbac/roles/
+        **      匹配任意多段（含零段），如 *:/api/rbac/roles/**
+    """
+
+    def __init__(self, patterns):
+        self._root = _Node()
+        for pattern in patterns:
+            self._add(pattern)
+
+    def _add(self, pattern):
+        node = self._root
+        for segment in _segments(pattern):
+            if segment == '**':
+                if node.glob is None:
+                    node.glob = _Node(is_glob=True)
+                node = node.glob
+            elif segment == '*' or (segment.startswith('{') and segment.endswith('}')):
+                if node.wildcard is None:
+                    node.wildcard = _Node()
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(segment, _Node())
+        node.terminal = True
+
+    @staticmethod
+    def _enter(states, node):
+        # 进入节点时同时进入其 ** 子节点（** 可以匹配零段）
+        while node is not None and node not in states:
+            states.add(node)
+            node = node.glob
+
+    def match(self, codename):
+        """检查 codename（如 get:/api/rbac/permissions/42/）是否匹配任一模板"""
+        states = set()
+        self._enter(states, self._root)
+        for segment in _segments(codename):
+            next_states = set()
+            for node in states:
+                child = node.children.get(segment)
+                if child is not None:
+                    self._enter(next_states, child)
+                if node.wildcard is not None:
+                    self._enter(next_states, node.wildcard)
+                if node.is_glob:
+                    next_states.add(node)
+            if not next_states:
+                return False
+            states = next_states
+        return any(node.terminal for node in states)
@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from .matcher import CodenameMatcher, is_pattern
+from .models import Permission, RoleClosure, UserPermission
+
+User = get_user_model()
+UserRoles = User.roles.through
+
+# 每批重新计算的用户数和写入的行数
+BATCH_SIZE = 1000
+
+
+def is_enabled():
+    """是否维护用户有效权限物化表"""
+    return getattr(settings, 'PERMISSION_MATERIALIZED', False)
+
+
+def expected_rows(user_ids):
+    """
+    根据关联表计算用户应有的物化行 {(用户ID, 权限ID, codename)}
+    直接分配的角色和继承的祖先角色各一条连接查询
+    """
+    direct = (
+        Permission.objects.filter(role__user__in=user_ids)
+        .values_list('role__user', 'id', 'codename')
+        .distinct()
+    )
+    inherited = (
+        RoleClosure.objects.filter(descendant__user__in=user_ids, ancestor__permissions__isnull=False)
+        .values_list('descendant__user', 'ancestor__permissions', 'ancestor__permissions__codename')
+        .distinct()
+    )
+    return {*direct, *inherited}
+
+
+def actual_rows(user_ids):
+    """物化表中用户现有的行 {(用户ID, 权限ID, codename)}"""
+    return set(
+        UserPermission.objects.filter(user_id__in=user_ids)
+        .values_list('user_id', 'permission_id', 'codename')
+    )
+
+
+def diff_users(user_ids):
+    """
+    比较用户的物化行与关联表
+
+    Returns:
+        tuple: (缺失的行集合, 多余的行集合)
+    """
+    expected = expected_rows(user_ids)
+    actual = actual_rows(user_ids)
+    return expected - actual, actual - expected
+
+
+def _write(missing, extra):
+    by_user = {}
+    for user_id, permission_id, _ in extra:
+        by_user.setdefault(user_id, []).append(permission_id)
+    for user_id, permission_ids in by_user.items():
+        UserPermission.objects.filter(user_id=user_id, permission_id__in=permission_ids).delete()
+    UserPermission.objects.bulk_create(
+        [
+            UserPermission(
+                user_id=user_id, permission_id=permission_id,
+                codename=codename, is_pattern=is_pattern(codename),
+            )
+            for user_id, permission_id, codename in missing
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def refresh_users(user_ids):
+    """
+    重新计算指定用户的物化行，只写入差异部分
+    未开启物化表时不执行任何操作
+    """
+    if not is_enabled():
+        return
+    user_ids = list(set(user_ids))
+    with transaction.atomic():
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            _write(*diff_users(user_ids[start:start + BATCH_SIZE]))
+
+
+def refresh_roles(role_ids):
+    """角色的权限或继承关系变更后，重新计算拥有这些角色或其后代角色的用户"""
+    if not is_enabled():
+        return
+    role_ids = set(role_ids)
+    role_ids |= set(
+        RoleClosure.objects.filter(ancestor_id__in=role_ids)
+        .values_list('descendant_id', flat=True)
+    )
+    refresh_users(
+        UserRoles.objects.filter(role_id__in=role_ids)
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+
+
+def rename_permission(permission):
+    """权限的 codename 修改后同步冗余列"""
+    if not is_enabled():
+        return
+    UserPermission.objects.filter(permission_id=permission.pk).exclude(codename=permission.codename).update(
+        codename=permission.codename, is_pattern=is_pattern(permission.codename),
+    )
+
+
+def _user_id_chunks(chunk_size):
+    """按主键分块遍历拥有角色的用户ID"""
+    user_ids = UserRoles.objects.values_list('user_id', flat=True).distinct().order_by('user_id')
+    last_id = 0
+    while True:
+        chunk = list(user_ids.filter(user_id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+def rebuild(chunk_size=BATCH_SIZE):
+    """
+    清空并重建物化表
+
+    Returns:
+        int: 写入的行数
+    """
+    count = 0
+    with transaction.atomic():
+        UserPermission.objects.all().delete()
+        for chunk in _user_id_chunks(chunk_size):
+            missing = expected_rows(chunk)
+            _write(missing, ())
+            count += len(missing)
+    return count
+
+
+def verify(chunk_size=BATCH_SIZE):
+    """
+    校验物化表与关联表是否一致，不做修改
+
+    Returns:
+        tuple: (缺失的行数, 多余的行数)
+    """
+    missing_count = extra_count = 0
+    for chunk in _user_id_chunks(chunk_size):
+        missing, extra = diff_users(chunk)
+        missing_count += len(missing)
+        extra_count += len(extra)
+    # 已没有角色但仍残留物化行的用户
+    extra_count += UserPermission.objects.exclude(user_id__in=UserRoles.objects.values('user_id')).count()
+    return missing_count, extra_count
+
+
+class MaterializedPermissions:
+    """
+    从物化表读取的用户有效权限（缓存不可用时使用），接口与 PermissionSet 一致
+    权限检查是一条按 (user, codename) 索引的查询，只在迭代时才加载全部权限
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._codenames = None
+
+    def _load(self):
+        if self._codenames is None:
+            self._codenames = frozenset(
+                UserPermission.objects.filter(user_id=self.user_id).values_list('codename', flat=True)
+            )
+        return self._codenames
+
+    def __contains__(self, codename):
+        if self._codenames is not None:
+            return codename in self._codenames
+        return UserPermission.objects.filter(user_id=self.user_id, codename=codename).exists()
+
+    def __iter__(self):
+        return iter(sorted(self._load()))
+
+    def __len__(self):
+        return len(self._load())
+
+    def allows(self, codename):
+        """精确匹配或匹配任一模板权限：一条查询取回该codename与用户的模板权限"""
+        if self._codenames is not None:
+            codenames = self._codenames
+        else:
+            codenames = set(
+                UserPermission.objects.filter(user_id=self.user_id)
+                .filter(Q(codename=codename) | Q(is_pattern=True))
+                .values_list('codename', flat=True)
+            )
+        if codename in codenames:
+            return True
+        patterns = [permission for permission in codenames if is_pattern(permission)]
+        return bool(patterns) and CodenameMatcher(patterns).match(codename)
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from .breaker import permission_cache as cache
+from .models import Permission
+from .snapshot import EffectivePermissions
+from .utils import PermissionCache
+
+logger = logging.getLogger(__name__)
+
+# Permission.menu 中表示层级的分隔符，如 "系统管理/角色管理"
+MENU_SEPARATOR = '/'
+# 超级管理员拥有全部菜单，单独作为一种角色组合
+SUPERUSER_KEY = 'superuser'
+
+
+def build_menu_tree(permissions):
+    """
+    按 menu 字段将权限组织为菜单树
+    permissions: 按主键排序的 [(id, codename, desc, menu)]，菜单和权限按首次出现的顺序排列
+    每个节点为 {'name': 菜单名, 'children': [子菜单], 'permissions': [{'id', 'codename', 'desc'}]}
+    """
+    roots = []
+    nodes = {}
+    for permission_id, codename, desc, menu in permissions:
+        path = [name.strip() for name in menu.split(MENU_SEPARATOR) if name.strip()]
+        siblings, node = roots, None
+        for depth in range(len(path)):
+            key = tuple(path[:depth + 1])
+            node = nodes.get(key)
+            if node is None:
+                node = nodes[key] = {'name': path[depth], 'children': [], 'permissions': []}
+                siblings.append(node)
+            siblings = node['children']
+        if node is not None:
+            node['permissions'].append({'id': permission_id, 'codename': codename, 'desc': desc})
+    return roots
+
+
+def _menu_permissions(permission_ids=None):
+    """查询设置了菜单的权限，可限定权限主键"""
+    queryset = Permission.objects.exclude(menu__isnull=True).exclude(menu='')
+    if permission_ids is not None:
+        queryset = queryset.filter(id__in=permission_ids)
+    return queryset.order_by('id').values_list('id', 'codename', 'desc', 'menu')
+
+
+def _permission_ids(snapshot, mask):
+    """权限位图对应的权限主键，mask 为 None 表示全部权限"""
+    if mask is None:
+        return None
+    return snapshot.permission_ids_for_mask(mask)
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode()).hexdigest()[:20]
+
+
+def get_user_menu(user):
+    """
+    获取用户的菜单树，返回 (ETag, 获取菜单树的函数)
+    菜单树按RBAC快照版本和角色组合缓存，角色相同的用户共享同一份；
+    ETag 只由快照版本和角色组合决定，客户端重新验证时无需生成菜单树
+    """
+    if user.is_superuser:
+        snapshot = PermissionCache.get_snapshot()
+        combination = SUPERUSER_KEY
+        mask = None
+    else:
+        permissions = PermissionCache.get_permission_set(user.pk)
+        if not isinstance(permissions, EffectivePermissions):
+            # 缓存不可用时按用户权限直接生成，以内容作为 ETag
+            codenames = set(permissions)
+            tree = build_menu_tree(row for row in _menu_permissions() if row[1] in codenames)
+            return _digest(json.dumps(tree, sort_keys=True)), lambda: tree
+        snapshot = permissions.snapshot
+        combination = ','.join(map(str, sorted(permissions.role_ids)))
+        mask = permissions.mask
+
+    if snapshot.version is None:
+        # 缓存不可用时编译的快照没有版本号，以内容作为 ETag
+        tree = build_menu_tree(_menu_permissions(_permission_ids(snapshot, mask)))
+        return _digest(json.dumps(tree, sort_keys=True)), lambda: tree
+    etag = _digest(f"{snapshot.version}:{combination}")
+
+    def load():
+        key = f"rbac_menu_{etag}"
+        try:
+            tree = cache.get(key)
+        except Exception:
+            logger.warning('读取菜单缓存失败', exc_info=True)
+            tree = None
+        if tree is None:
+            tree = build_menu_tree(_menu_permissions(_permission_ids(snapshot, mask)))
+            try:
+                cache.set(key, tree, settings.PERMISSION_CACHE_TIMEOUT)
+            except Exception:
+                logger.warning('写入菜单缓存失败', exc_info=True)
+        return tree
+
+    return etag, load
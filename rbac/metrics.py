@@ -0,0 +1,143 @@
+import threading
+from bisect import bisect_left
+
+# 鉴权耗时通常在微秒到毫秒级，默认分桶偏向低延迟
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """计数器，按标签值分别累计"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """直方图，记录观测值的分桶计数、总和与次数"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # 标签值 -> [各分桶计数..., 总和, 次数]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def count(self, *labels):
+        data = self._values.get(labels)
+        return data[-1] if data else 0
+
+    def collect(self):
+        with self._lock:
+            values = sorted((labels, list(data)) for labels, data in self._values.items())
+        for labels, data in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                extra = (('le', repr(float(bound))),)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, extra)} {cumulative}"
+            extra = (('le', '+Inf'),)
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, extra)} {data[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {data[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {data[-1]}"
+
+
+class CallbackGauge:
+    """抓取时才调用回调函数取值的仪表，回调返回 {标签值元组: 数值}"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        _registry.append(self)
+
+    def collect(self):
+        for labels, value in sorted(self.callback().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+def render():
+    """按 Prometheus 文本格式输出所有指标，只在被抓取时执行"""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+# RBACPermission.has_permission 的鉴权耗时，outcome 为 whitelist/superuser/allowed/denied
+decision_seconds = Histogram(
+    'rbac_decision_seconds', 'RBAC authorization decision latency', ['outcome'],
+)
+# 用户权限缓存的读取结果，result 为 hit/miss/error
+cache_requests = Counter(
+    'rbac_permission_cache_requests_total', 'Permission cache lookups by result', ['result'],
+)
+# RBAC快照的加载来源，source 为 local/cache/db
+snapshot_loads = Counter(
+    'rbac_snapshot_loads_total', 'RBAC snapshot loads by source', ['source'],
+)
+# 缓存不可用时直接查询数据库解析权限的次数
+db_fallbacks = Counter(
+    'rbac_db_fallbacks_total', 'Permission lookups served directly from the database',
+)
+# 缓存失效操作，scope 为 user/users/global/snapshot
+invalidations = Counter(
+    'rbac_invalidations_total', 'Permission cache invalidations', ['scope'],
+)
+invalidation_seconds = Histogram(
+    'rbac_invalidation_seconds', 'Permission cache invalidation latency', ['scope'],
+)
+# 权限缓存熔断次数，以及熔断期间改用本地降级缓存的操作，operation 为缓存操作名
+breaker_trips = Counter(
+    'rbac_cache_breaker_trips_total', 'Times the permission cache circuit breaker opened',
+)
+fallback_operations = Counter(
+    'rbac_cache_fallback_operations_total', 'Cache operations served by the local fallback', ['operation'],
+)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 class Permission(models.Model):
@@ -15,10 +16,85 @@ class Permission(models.Model):
 class Role(models.Model):
     name = models.CharField("角色名称", max_length=128, unique=True)
     permissions = models.ManyToManyField(Permission, verbose_name="权限集合", blank=True)
+    # 角色继承其所有父角色（含间接父角色）的权限
+    parents = models.ManyToManyField(
+        'self', verbose_name="父角色", symmetrical=False, related_name='children', blank=True,
+    )
 
     class Meta:
         verbose_name = "角色"
         verbose_name_plural = verbose_name
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class RoleClosure(models.Model):
+    """
+    角色继承关系的传递闭包
+    每行表示 ancestor 是 descendant 的直接或间接父角色，depth 为最短继承层数；
+    由 rbac.hierarchy 在继承关系变更时增量维护，解析权限时无需递归查询
+    """
+    ancestor = models.ForeignKey(Role, verbose_name="祖先角色", on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Role, verbose_name="后代角色", on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField("继承层数")
+
+    class Meta:
+        verbose_name = "角色继承关系"
+        verbose_name_plural = verbose_name
+        unique_together = ('ancestor', 'descendant')
+        indexes = [models.Index(fields=['descendant', 'ancestor'])]
+
+
+class DataScope(models.Model):
+    """
+    角色的数据权限（行级权限）
+    限定角色在某类资源上可以访问的记录范围，resource 为模型标识（app_label.model_name，如 rbac.role）；
+    某资源配置了任意一条数据权限后，用户只能访问其角色（含继承的父角色）规则并集内的记录，
+    未配置数据权限的资源不受限制
+    """
+    SCOPE_ALL = 'all'
+    SCOPE_SELF = 'self'
+    SCOPE_FIELD = 'field'
+    SCOPE_IDS = 'ids'
+    SCOPE_CHOICES = [
+        (SCOPE_ALL, '全部数据'),
+        (SCOPE_SELF, '本人数据'),
+        (SCOPE_FIELD, '与本人同属的数据'),
+        (SCOPE_IDS, '指定数据'),
+    ]
+
+    role = models.ForeignKey(Role, verbose_name="角色", on_delete=models.CASCADE, related_name='data_scopes')
+    resource = models.CharField("资源", max_length=100)
+    scope = models.CharField("数据范围", max_length=16, choices=SCOPE_CHOICES)
+    # 本人数据：记录中指向用户的字段（如 created_by，默认为主键）；与本人同属：记录中比较的字段（如 department）
+    field = models.CharField("记录字段", max_length=100, blank=True)
+    # 与本人同属：用户上对应的属性（如 department_id）
+    user_field = models.CharField("用户字段", max_length=100, blank=True)
+    ids = models.JSONField("记录ID列表", default=list, blank=True)
+
+    class Meta:
+        verbose_name = "数据权限"
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.role_id} - {self.resource} - {self.scope}"
+
+
+class UserPermission(models.Model):
+    """
+    用户有效权限的物化表（PERMISSION_MATERIALIZED 开启时维护）
+    每行表示用户经直接分配或继承的角色拥有某个权限，codename 冗余存储，
+    数据库鉴权只需按 (user, codename) 索引查询，无需连接关联表后去重；
+    由 rbac.materialized 在角色、权限及继承关系变更时增量维护
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name="用户", on_delete=models.CASCADE, related_name='+')
+    permission = models.ForeignKey(Permission, verbose_name="权限", on_delete=models.CASCADE, related_name='+')
+    codename = models.CharField("权限别名", max_length=128)
+    is_pattern = models.BooleanField("是否为模板权限", default=False)
+
+    class Meta:
+        verbose_name = "用户有效权限"
+        verbose_name_plural = verbose_name
+        unique_together = ('user', 'permission')
+        indexes = [models.Index(fields=['user', 'codename'])]
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    按主键的游标分页
+    翻页只需 WHERE id > 游标 的索引扫描，不随页码增大而变慢，也不需要 COUNT 查询
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
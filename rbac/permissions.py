@@ -1,27 +1,139 @@
+import time
+
 from rest_framework.permissions import BasePermission
 from django.conf import settings
+from . import metrics
+from .routes import get_route_policy
 from .utils import PermissionCache
+from .authentication import RBACTokenUser
+from .tokens import (
+    GENERATION_CLAIM, SUPERUSER_CLAIM, SUPERUSER_PERMISSIONS, aget_token_permissions, get_token_permissions,
+)
 
 class RBACPermission(BasePermission):
     """
     RBAC权限控制类
     实现基于角色的访问控制，检查用户是否有访问资源的权限
+    请求匹配到已编译的路由策略时，白名单判断和所需权限都只需一次字典查找
     """
     def has_permission(self, request, view):
+        start = time.perf_counter()
+        allowed, outcome = self._decide(request)
+        metrics.decision_seconds.observe(time.perf_counter() - start, outcome)
+        return allowed
+
+    async def ahas_permission(self, request, view=None):
+        """
+        has_permission 的异步版本，供 ASGI 下的异步视图直接调用
+        request.user（及 request.auth，如有）需已完成认证；
+        版本号、快照和用户权限都通过异步接口获取，不经过线程切换
+        """
+        start = time.perf_counter()
+        policy, decision, permissions = await self._aprecheck(request)
+        if decision is None:
+            if permissions is None:
+                permissions = await PermissionCache.aget_permission_set(request.user.id)
+            request._rbac_permissions = permissions
+            decision = self._check(request, policy, permissions)
+        allowed, outcome = decision
+        metrics.decision_seconds.observe(time.perf_counter() - start, outcome)
+        return allowed
+
+    def _decide(self, request):
+        """
+        鉴权并返回 (是否允许, 结果类别)
+        结果类别为 whitelist/superuser/allowed/denied，用于统计鉴权耗时
+        """
+        policy, decision, permissions = self._precheck(request)
+        if decision is not None:
+            return decision
+        if permissions is None:
+            # 4. 获取用户权限
+            permissions = PermissionCache.get_permission_set(request.user.id)
+        # 保存在请求上，数据权限过滤等后续步骤直接复用
+        request._rbac_permissions = permissions
+        return self._check(request, policy, permissions)
+
+    def _precheck(self, request):
+        """
+        不需要查询用户权限的判断
+        返回 (路由策略, 已确定的鉴权结果或 None, 令牌中的权限或 None)
+        """
+        policy = get_route_policy(request)
+
         # 1. 检查白名单
-        if self._is_whitelist_path(request.path_info):
-            return True
-        
-        # 2. 检查超级管理员
-        if request.user.is_superuser:
-            return True
-
-        # 3. 获取权限标识
-        permission_codename = self._get_permission_codename(request)
+        if self._is_whitelisted(request, policy):
+            return policy, (True, 'whitelist'), None
 
-        # 4. 获取用户权限并检查
-        user_permissions = PermissionCache.get_user_permissions(request.user.id)
-        return permission_codename in user_permissions
+        # 2. 令牌携带未过期的RBAC声明时，直接使用令牌中的角色
+        permissions = None
+        token = self._get_token(request)
+        if token is not None:
+            permissions = get_token_permissions(token)
+            if permissions is SUPERUSER_PERMISSIONS:
+                return policy, (True, 'superuser'), None
+            if permissions is None and GENERATION_CLAIM in token and isinstance(request.user, RBACTokenUser):
+                # 令牌声明已过期（如用户被停用）时加载用户，已停用的用户认证失败
+                request.user.get_user()
+
+        # 3. 检查超级管理员
+        if permissions is None and request.user.is_superuser:
+            return policy, (True, 'superuser'), None
+        return policy, None, permissions
+
+    async def _aprecheck(self, request):
+        """
+        _precheck 的异步版本
+        版本号和快照通过异步接口读取；需要从数据库加载的用户字段使用异步ORM，
+        不在事件循环中触发同步查询
+        """
+        policy = get_route_policy(request)
+        if self._is_whitelisted(request, policy):
+            return policy, (True, 'whitelist'), None
+
+        permissions = None
+        user = request.user
+        token = self._get_token(request)
+        if token is not None:
+            permissions = await aget_token_permissions(token)
+            if permissions is SUPERUSER_PERMISSIONS:
+                return policy, (True, 'superuser'), None
+            if permissions is None and GENERATION_CLAIM in token and isinstance(user, RBACTokenUser):
+                await user.aget_user()
+
+        if permissions is None:
+            if isinstance(user, RBACTokenUser) and SUPERUSER_CLAIM not in user.token:
+                # 令牌中没有超级管理员标记，先异步加载用户
+                await user.aget_user()
+            if user.is_superuser:
+                return policy, (True, 'superuser'), None
+        return policy, None, permissions
+
+    def _is_whitelisted(self, request, policy):
+        if policy is not None:
+            return policy.whitelisted
+        return self._is_whitelist_path(request.path_info)
+
+    def _get_token(self, request):
+        """请求中可读取声明的令牌，没有时返回 None"""
+        token = getattr(request, 'auth', None)
+        if token is not None and hasattr(token, 'get'):
+            return token
+        return None
+
+    def _check(self, request, policy, permissions):
+        """
+        按用户权限判断并返回 (是否允许, 结果类别)
+        """
+        # 5. 检查路由所需权限，未命中时再按具体路径检查
+        #    （兼容为具体对象路径单独配置的权限）
+        required = policy.codenames.get(request.method) if policy is not None else None
+        if required is not None and permissions.allows(required):
+            return True, 'allowed'
+        permission_codename = self._get_permission_codename(request)
+        if permission_codename != required and permissions.allows(permission_codename):
+            return True, 'allowed'
+        return False, 'denied'
     
     def _is_whitelist_path(self, path):
         """检查路径是否在白名单中"""
@@ -31,7 +143,8 @@ class RBACPermission(BasePermission):
         """
         生成权限标识
         格式为：{method}:{path}，例如：get:/api/rbac/permissions/
+        权限可以写成路由模板或通配符，例如 get:/api/rbac/permissions/{id}/、*:/api/rbac/roles/**
         """
         method = request.method.lower()
         path = request.path_info
-        return f"{method}:{path}"
\ No newline at end of file
+        return f"{method}:{path}"
@@ -0,0 +1,135 @@
+import re
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.urls.resolvers import RegexPattern
+
+# 路由策略：视图名、路径模板、是否在白名单中、{请求方法(大写): 所需权限}、{请求方法(小写): 视图动作}
+RoutePolicy = namedtuple('RoutePolicy', ['view_name', 'template', 'whitelisted', 'codenames', 'actions'])
+
+_FORMAT_SUFFIX_REGEX = re.compile(r'\\\.\(\?P<format>[^)]*\)/\?')
+_FORMAT_SUFFIX_ROUTE = re.compile(r'<drf_format_suffix:format>')
+_NAMED_GROUP = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+_ROUTE_PARAM = re.compile(r'<(?:\w+:)?(\w+)>')
+_ESCAPED = re.compile(r'\\(.)')
+
+_route_policies = None
+_route_policies_lock = threading.Lock()
+
+
+def _join_route(route1, route2):
+    """与 URLResolver 拼接 resolver_match.route 的方式一致"""
+    if not route1:
+        return route2
+    if route2.startswith('^'):
+        route2 = route2[1:]
+    return route1 + route2
+
+
+def _to_template(pattern):
+    """
+    将 URL 模式转换为路径模板，参数统一写成 {name}
+    DRF 的格式后缀路由（如 permissions.json）映射为对应的无后缀模板
+    """
+    text = str(pattern)
+    if isinstance(pattern, RegexPattern):
+        text, suffixes = _FORMAT_SUFFIX_REGEX.subn('', text)
+        text = _NAMED_GROUP.sub(r'{\1}', text.lstrip('^').rstrip('$'))
+        text = _ESCAPED.sub(r'\1', text)
+    else:
+        text, suffixes = _FORMAT_SUFFIX_ROUTE.subn('', text)
+        text = _ROUTE_PARAM.sub(r'{\1}', text)
+    if suffixes and text and not text.endswith('/'):
+        text += '/'
+    return text
+
+
+def _view_methods(callback):
+    """返回 {请求方法(小写): 视图动作}，无法判断请求方法的函数视图返回空字典"""
+    actions = getattr(callback, 'actions', None)
+    if actions:
+        return dict(actions)
+    view_class = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None)
+    if view_class is None:
+        return {}
+    return {
+        method: method
+        for method in view_class.http_method_names
+        if method != 'options' and hasattr(view_class, method)
+    }
+
+
+def _walk(patterns, route_prefix, template_prefix, namespaces):
+    for pattern in patterns:
+        route = _join_route(route_prefix, str(pattern.pattern))
+        template = template_prefix + _to_template(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            names = namespaces + [pattern.namespace] if pattern.namespace else namespaces
+            yield from _walk(pattern.url_patterns, route, template, names)
+        elif isinstance(pattern, URLPattern):
+            view_name = ':'.join(namespaces + [pattern.name]) if pattern.name else None
+            yield route, view_name, template, _view_methods(pattern.callback)
+
+
+def build_route_policies(urlconf=None):
+    """
+    遍历 URLconf，预先编译 {resolver_match.route: RoutePolicy}
+    每个路由所需的权限为 {method}:{路径模板}，如 get:/api/rbac/permissions/{pk}/
+    """
+    whitelist = tuple(settings.PERMISSION_WHITELIST)
+    policies = {}
+    for route, view_name, template, actions in _walk(get_resolver(urlconf).url_patterns, '', '/', []):
+        policies[route] = RoutePolicy(
+            view_name=view_name,
+            template=template,
+            whitelisted=template.startswith(whitelist),
+            codenames={method.upper(): f"{method}:{template}" for method in actions},
+            actions=actions,
+        )
+    return policies
+
+
+def get_route_policies():
+    """获取编译好的路由策略表，首次调用时编译，之后每次鉴权只做一次字典查找"""
+    global _route_policies
+    policies = _route_policies
+    if policies is None:
+        with _route_policies_lock:
+            policies = _route_policies
+            if policies is None:
+                policies = _route_policies = build_route_policies()
+    return policies
+
+
+def get_route_policy(request):
+    """根据请求的 resolver_match 查找路由策略，没有匹配的路由时返回 None"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    return get_route_policies().get(match.route)
+
+
+def route_permissions(prefixes=('/api/',)):
+    """
+    根据路由策略生成应存在的权限 {codename: 描述}
+    白名单路由不需要权限，只包含路径模板以 prefixes 开头的路由
+    """
+    permissions = {}
+    for policy in get_route_policies().values():
+        if policy.whitelisted or not policy.template.startswith(tuple(prefixes)):
+            continue
+        for method, codename in policy.codenames.items():
+            action = policy.actions[method.lower()]
+            permissions.setdefault(codename, f"{policy.view_name or policy.template} {action}")
+    return permissions
+
+
+@receiver(setting_changed)
+def reset_route_policies(setting, **kwargs):
+    global _route_policies
+    if setting in ('ROOT_URLCONF', 'PERMISSION_WHITELIST'):
+        _route_policies = None
@@ -0,0 +1,130 @@
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from rest_framework import serializers
+from .hierarchy import check_parents
+from .models import DataScope, Permission, Role
+
+User = get_user_model()
+
+
+def get_requested_fields(request):
+    """
+    解析查询参数 ?fields=id,name 指定的字段
+    未指定或不是读取请求时返回 None，表示返回全部字段
+    """
+    if request is None or request.method != 'GET':
+        return None
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return {field.strip() for field in fields.split(',') if field.strip()}
+
+
+class SparseFieldsetMixin:
+    """按 ?fields= 参数只输出部分字段，未知的字段名忽略"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = get_requested_fields(self.context.get('request'))
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+class PermissionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """权限序列化器"""
+
+    class Meta:
+        model = Permission
+        fields = '__all__'
+
+
+class RoleSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """角色序列化器"""
+
+    class Meta:
+        model = Role
+        fields = '__all__'
+
+    def validate_parents(self, parents):
+        """修改父角色时检查循环继承"""
+        if self.instance is not None:
+            try:
+                check_parents(self.instance.pk, [parent.pk for parent in parents])
+            except ValidationError as e:
+                raise serializers.ValidationError(e.messages)
+        return parents
+
+
+class DataScopeSerializer(serializers.ModelSerializer):
+    """数据权限序列化器，校验资源是否为已安装的模型，以及各类范围所需的字段"""
+
+    class Meta:
+        model = DataScope
+        fields = '__all__'
+
+    def validate(self, attrs):
+        resource = attrs.get('resource', getattr(self.instance, 'resource', None))
+        scope = attrs.get('scope', getattr(self.instance, 'scope', None))
+        field = attrs.get('field', getattr(self.instance, 'field', ''))
+        user_field = attrs.get('user_field', getattr(self.instance, 'user_field', ''))
+        ids = attrs.get('ids', getattr(self.instance, 'ids', []))
+        try:
+            model = apps.get_model(resource)
+        except (LookupError, ValueError):
+            raise serializers.ValidationError({'resource': f"资源不存在：{resource}"})
+
+        if scope == DataScope.SCOPE_FIELD and not (field and user_field):
+            raise serializers.ValidationError({'field': '与本人同属的数据需要指定记录字段和用户字段'})
+        if field and field.split('__')[0] != 'pk':
+            try:
+                model._meta.get_field(field.split('__')[0])
+            except FieldDoesNotExist:
+                raise serializers.ValidationError({'field': f"{resource} 没有字段：{field}"})
+        if scope == DataScope.SCOPE_IDS and (
+            not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids)
+        ):
+            raise serializers.ValidationError({'ids': '指定数据需要提供记录ID列表'})
+        return attrs
+
+
+class BulkAssignmentSerializer(serializers.Serializer):
+    """
+    批量分配请求
+    mode: add 添加、remove 移除、replace 以请求中的关系替换所涉及左侧对象的全部关系
+    pairs: [[左侧ID, 右侧ID], ...]
+    """
+    # 关系两侧的模型，由子类指定
+    left_model = None
+    right_model = None
+
+    mode = serializers.ChoiceField(choices=['add', 'remove', 'replace'], default='add')
+    pairs = serializers.ListField(
+        child=serializers.ListField(child=serializers.IntegerField(), min_length=2, max_length=2),
+        allow_empty=False,
+    )
+
+    def validate_pairs(self, pairs):
+        """去重，并用每侧一次查询检查ID是否都存在"""
+        pairs = {tuple(pair) for pair in pairs}
+        for index, model in enumerate((self.left_model, self.right_model)):
+            ids = {pair[index] for pair in pairs}
+            missing = ids - set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            if missing:
+                raise serializers.ValidationError(
+                    f"{model._meta.verbose_name}不存在：{', '.join(map(str, sorted(missing)))}"
+                )
+        return pairs
+
+
+class UserRoleAssignmentSerializer(BulkAssignmentSerializer):
+    """批量分配用户角色，pairs 为 [[用户ID, 角色ID], ...]"""
+    left_model = User
+    right_model = Role
+
+
+class RolePermissionAssignmentSerializer(BulkAssignmentSerializer):
+    """批量分配角色权限，pairs 为 [[角色ID, 权限ID], ...]"""
+    left_model = Role
+    right_model = Permission
@@ -0,0 +1,183 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from . import materialized
+from .hierarchy import RoleParents, check_parents, descendants_of, refresh_closure
+from .models import DataScope, Permission, Role
+from .snapshot import RolePermissions
+from .utils import PermissionCache, UserRoles
+
+User = get_user_model()
+
+
+def users_with_roles(role_ids):
+    """查询拥有指定角色的用户ID"""
+    return set(
+        UserRoles.objects.filter(role_id__in=role_ids)
+        .values_list('user_id', flat=True)
+    )
+
+
+def invalidate_users(user_ids):
+    """
+    清除受影响用户的权限缓存
+    处于事务中时立即清除一次，并在事务提交后再清除一次，
+    避免提交前有请求读到旧数据并写回缓存
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    PermissionCache.clear_users_permissions(user_ids)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: PermissionCache.clear_users_permissions(user_ids))
+
+
+def invalidate_snapshot():
+    """
+    使RBAC快照失效
+    角色-权限关系只编译在共享快照中，变更时只需提升快照版本，不影响任何用户的缓存条目；
+    处于事务中时同样在提交后再执行一次
+    """
+    PermissionCache.clear_snapshot()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(PermissionCache.clear_snapshot)
+
+
+@receiver(m2m_changed, sender=UserRoles)
+def user_roles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """用户与角色的关系变更：只影响关系两端涉及的用户"""
+    if not reverse:
+        # user.roles.add/remove/clear/set
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            materialized.refresh_users([instance.pk])
+            invalidate_users([instance.pk])
+    elif action == 'pre_clear':
+        # role.user_set.clear()，清除前记录受影响的用户
+        instance._rbac_affected_users = users_with_roles([instance.pk])
+    elif action == 'post_clear':
+        user_ids = getattr(instance, '_rbac_affected_users', ())
+        materialized.refresh_users(user_ids)
+        invalidate_users(user_ids)
+    elif action in ('post_add', 'post_remove'):
+        materialized.refresh_users(pk_set)
+        invalidate_users(pk_set)
+
+
+@receiver(m2m_changed, sender=RolePermissions)
+def role_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """角色与权限的关系变更：重新编译快照，并更新拥有这些角色的用户的物化权限"""
+    if action == 'pre_clear' and reverse:
+        # permission.role_set.clear()，清除前记录受影响的角色
+        instance._rbac_affected_roles = set(
+            RolePermissions.objects.filter(permission_id=instance.pk).values_list('role_id', flat=True)
+        )
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            role_ids = [instance.pk]
+        elif action == 'post_clear':
+            role_ids = getattr(instance, '_rbac_affected_roles', ())
+        else:
+            role_ids = pk_set
+        materialized.refresh_roles(role_ids)
+        invalidate_snapshot()
+
+
+@receiver(m2m_changed, sender=RoleParents)
+def role_parents_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    角色继承关系变更：写入前检查循环继承，写入后刷新受影响角色的闭包并重新编译快照
+    用户缓存只保存直接分配的角色，继承得到的权限编译在快照中，因此无需清除用户缓存
+    """
+    if action == 'pre_add':
+        if not reverse:
+            # role.parents.add(...)
+            check_parents(instance.pk, pk_set)
+        else:
+            # role.children.add(...)
+            for child_id in pk_set:
+                check_parents(child_id, [instance.pk])
+    elif action == 'pre_clear' and reverse:
+        # role.children.clear()，清除前记录受影响的子角色
+        instance._rbac_affected_roles = set(
+            RoleParents.objects.filter(to_role_id=instance.pk).values_list('from_role_id', flat=True)
+        )
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            roots = {instance.pk}
+        elif action == 'post_clear':
+            roots = getattr(instance, '_rbac_affected_roles', set())
+        else:
+            roots = set(pk_set)
+        refresh_closure(roots | descendants_of(roots))
+        materialized.refresh_roles(roots)
+        invalidate_snapshot()
+
+
+@receiver(post_save, sender=Permission)
+def permission_saved(sender, instance, created, **kwargs):
+    """
+    权限修改后重新编译快照；新建的权限尚未分配给任何角色，
+    只有设置了菜单时才需要重新编译（超级管理员的菜单包含全部权限）
+    """
+    if created and instance.menu:
+        invalidate_snapshot()
+    elif not created:
+        materialized.rename_permission(instance)
+        invalidate_snapshot()
+
+
+@receiver(post_delete, sender=Permission)
+def permission_deleted(sender, instance, **kwargs):
+    invalidate_snapshot()
+
+
+@receiver(post_save, sender=DataScope)
+@receiver(post_delete, sender=DataScope)
+def data_scope_changed(sender, **kwargs):
+    """数据权限规则编译在快照中，变更后重新编译快照"""
+    invalidate_snapshot()
+
+
+@receiver(pre_delete, sender=Role)
+def role_pre_delete(sender, instance, **kwargs):
+    # 删除会级联清理关联表，需要在删除前记录受影响的用户和后代角色
+    instance._rbac_affected_users = users_with_roles([instance.pk])
+    instance._rbac_affected_roles = descendants_of([instance.pk])
+
+
+@receiver(post_delete, sender=Role)
+def role_deleted(sender, instance, **kwargs):
+    user_ids = getattr(instance, '_rbac_affected_users', set())
+    invalidate_users(user_ids)
+    # 后代角色不再经由被删除的角色继承权限
+    descendant_ids = getattr(instance, '_rbac_affected_roles', ())
+    refresh_closure(descendant_ids)
+    if materialized.is_enabled():
+        materialized.refresh_users(user_ids | users_with_roles(descendant_ids))
+    invalidate_snapshot()
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_users([instance.pk])
+
+
+@receiver(pre_save, sender=User)
+def user_pre_save(sender, instance, update_fields=None, **kwargs):
+    # 超级管理员标记会写入令牌声明，停用用户时令牌声明也必须过期（无状态认证不查询用户表），
+    # 两者变更时都需要使该用户的令牌声明失效
+    fields = ('is_superuser', 'is_active')
+    if instance.pk is None or (update_fields is not None and not set(fields) & set(update_fields)):
+        return
+    previous = User.objects.filter(pk=instance.pk).values_list(*fields).first()
+    instance._rbac_claims_changed = (
+        previous is not None and previous != tuple(getattr(instance, field) for field in fields)
+    )
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if getattr(instance, '_rbac_claims_changed', False):
+        instance._rbac_claims_changed = False
+        invalidate_users([instance.pk])
@@ -0,0 +1,196 @@
+import pickle
+import zlib
+
+from .matcher import CodenameMatcher, is_pattern
+from .models import DataScope, Permission, Role, RoleClosure
+
+RolePermissions = Role.permissions.through
+
+# 每个快照最多缓存的已编译匹配器数量（按角色组合区分）
+MATCHER_CACHE_SIZE = 1024
+# 缓存中快照数据的格式标记，格式变更时修改，其他格式的数据（如旧版本进程写入的）视为未命中
+CACHE_FORMAT = 'rbac-snapshot/4'
+
+
+class RBACSnapshot:
+    """
+    编译后的RBAC快照
+    每个权限按主键排序后的序号作为位序号（位图长度只与权限数量有关，与主键大小无关），
+    每个角色编译为一个位图（int），
+    角色位图已合并其所有祖先角色的权限，
+    用户的有效权限即其所有角色位图按位或的结果，权限检查只需一次位测试；
+    角色的数据权限规则同样合并祖先角色后编译在快照中
+    """
+
+    def __init__(self, version, permissions, role_masks, data_scopes=None):
+        self.version = version
+        self.permissions = permissions      # 按位序号排列的 ((权限ID, codename), ...)
+        self.role_masks = role_masks        # {角色ID: 权限位图}
+        # {资源: {角色ID: 数据权限规则集合}}，规则为 (scope, field, user_field, ids)
+        self.data_scopes = data_scopes or {}
+        self.permission_ids = tuple(permission_id for permission_id, _ in permissions)  # 位序号 -> 权限ID
+        self.codename_bits = {codename: bit for bit, (_, codename) in enumerate(permissions)}  # {权限codename: 位序号}
+        self._codenames = {bit: codename for codename, bit in self.codename_bits.items()}
+        # 所有模板权限的位图，及按模板位图缓存的已编译匹配器（同一角色组合的用户共享）
+        self.pattern_mask = 0
+        for codename, bit in self.codename_bits.items():
+            if is_pattern(codename):
+                self.pattern_mask |= 1 << bit
+        self._matchers = {}
+
+    @classmethod
+    def build(cls, version):
+        """从数据库编译快照，共四条查询"""
+        permissions = tuple(Permission.objects.order_by('id').values_list('id', 'codename'))
+        bits = {permission_id: bit for bit, (permission_id, _) in enumerate(permissions)}
+        own_masks = {}
+        for role_id, permission_id in RolePermissions.objects.values_list('role_id', 'permission_id'):
+            own_masks[role_id] = own_masks.get(role_id, 0) | (1 << bits[permission_id])
+        own_scopes = {}
+        for role_id, resource, scope, field, user_field, ids in DataScope.objects.values_list(
+            'role_id', 'resource', 'scope', 'field', 'user_field', 'ids',
+        ):
+            rule = (scope, field, user_field, tuple(ids or ()))
+            own_scopes.setdefault(resource, {}).setdefault(role_id, set()).add(rule)
+        # 按闭包表合并祖先角色的权限和数据权限规则
+        role_masks = dict(own_masks)
+        data_scopes = {resource: {role_id: set(rules) for role_id, rules in roles.items()}
+                       for resource, roles in own_scopes.items()}
+        for role_id, ancestor_id in RoleClosure.objects.values_list('descendant_id', 'ancestor_id'):
+            ancestor_mask = own_masks.get(ancestor_id, 0)
+            if ancestor_mask:
+                role_masks[role_id] = role_masks.get(role_id, 0) | ancestor_mask
+            for resource, roles in own_scopes.items():
+                if ancestor_id in roles:
+                    data_scopes[resource].setdefault(role_id, set()).update(roles[ancestor_id])
+        return cls(version, permissions, role_masks, data_scopes)
+
+    def to_cache(self):
+        """
+        转换为写入缓存的数据：(格式标记, 快照版本, 压缩后的权限和角色位图)
+        codename 大多共享前缀，压缩后快照的体积通常只有原来的几分之一
+        """
+        payload = pickle.dumps((self.permissions, self.role_masks, self.data_scopes), pickle.HIGHEST_PROTOCOL)
+        return (CACHE_FORMAT, self.version, zlib.compress(payload))
+
+    @classmethod
+    def from_cache(cls, data, version):
+        """从缓存数据还原指定版本的快照，格式或版本不匹配时返回 None"""
+        if not isinstance(data, tuple) or len(data) != 3 or data[0] != CACHE_FORMAT or data[1] != version:
+            return None
+        return cls(version, *pickle.loads(zlib.decompress(data[2])))
+
+    def mask_for_roles(self, role_ids):
+        """计算一组角色的权限位图"""
+        mask = 0
+        role_masks = self.role_masks
+        for role_id in role_ids:
+            mask |= role_masks.get(role_id, 0)
+        return mask
+
+    def permissions_for_roles(self, role_ids):
+        """一组角色的有效权限"""
+        return EffectivePermissions(self, self.mask_for_roles(role_ids), tuple(role_ids))
+
+    def scope_rules(self, resource, role_ids):
+        """
+        一组角色在资源上的数据权限规则（各角色规则的并集）
+        资源未配置数据权限或任一规则为全部数据时返回 None，表示不受限制
+        """
+        roles = self.data_scopes.get(resource)
+        if roles is None:
+            return None
+        rules = set()
+        for role_id in role_ids:
+            rules.update(roles.get(role_id, ()))
+        if any(rule[0] == DataScope.SCOPE_ALL for rule in rules):
+            return None
+        return rules
+
+    def matcher_for_mask(self, mask):
+        """获取权限位图中模板权限编译出的匹配器，没有模板权限时返回 None"""
+        pattern_mask = mask & self.pattern_mask
+        if not pattern_mask:
+            return None
+        matcher = self._matchers.get(pattern_mask)
+        if matcher is None:
+            if len(self._matchers) >= MATCHER_CACHE_SIZE:
+                self._matchers.clear()
+            matcher = self._matchers[pattern_mask] = CodenameMatcher(self.codenames(pattern_mask))
+        return matcher
+
+    def permission_ids_for_mask(self, mask):
+        """将权限位图还原为权限ID列表"""
+        permission_ids = []
+        while mask:
+            lowest = mask & -mask
+            bit = lowest.bit_length() - 1
+            if bit < len(self.permission_ids):
+                permission_ids.append(self.permission_ids[bit])
+            mask ^= lowest
+        return permission_ids
+
+    def codenames(self, mask):
+        """将权限位图还原为codename列表"""
+        codenames = []
+        while mask:
+            lowest = mask & -mask
+            codename = self._codenames.get(lowest.bit_length() - 1)
+            if codename is not None:
+                codenames.append(codename)
+            mask ^= lowest
+        return codenames
+
+
+class EffectivePermissions:
+    """
+    用户的有效权限
+    持有快照和权限位图，支持 in 判断和迭代，用法与权限集合一致
+    """
+    __slots__ = ('snapshot', 'mask', 'role_ids')
+
+    def __init__(self, snapshot, mask, role_ids=()):
+        self.snapshot = snapshot
+        self.mask = mask
+        self.role_ids = role_ids
+
+    def __contains__(self, codename):
+        bit = self.snapshot.codename_bits.get(codename)
+        return bit is not None and (self.mask >> bit) & 1 == 1
+
+    def __iter__(self):
+        return iter(self.snapshot.codenames(self.mask))
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    def allows(self, codename):
+        """检查是否允许访问：精确匹配或匹配任一模板权限"""
+        if codename in self:
+            return True
+        matcher = self.snapshot.matcher_for_mask(self.mask)
+        return matcher is not None and matcher.match(codename)
+
+
+class PermissionSet(frozenset):
+    """直接由codename构成的权限集合（缓存不可用时使用），接口与 EffectivePermissions 一致"""
+
+    def allows(self, codename):
+        if codename in self:
+            return True
+        patterns = [permission for permission in self if is_pattern(permission)]
+        return bool(patterns) and CodenameMatcher(patterns).match(codename)
+
+
+_local_snapshot = None
+
+
+def get_local_snapshot():
+    """获取当前进程持有的快照，可能为 None"""
+    return _local_snapshot
+
+
+def set_local_snapshot(snapshot):
+    """替换当前进程持有的快照"""
+    global _local_snapshot
+    _local_snapshot = snapshot
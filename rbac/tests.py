@@ -1,9 +1,9 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from django.conf import settings
 from .models import Role, Permission
-from .utils import PermissionCache
+from .utils import PermissionCache, LocalPermissionCache, get_local_cache
 
 User = get_user_model()
 print("测试文件已加载")
@@ -327,9 +327,1134 @@ class RBACPermissionTest(TestCase):
         # 生成权限标识符
         permission_codename = permission_check._get_permission_codename(request)
         self.assertEqual(permission_codename, 'get:/api/rbac/permissions/')
-        
-        
 
 
-        
+class LocalPermissionCacheTest(TestCase):
+    def test_lru_and_ttl(self):
+        """
+        测试一级缓存：
+        1. 超出容量时淘汰最久未使用的条目
+        2. 条目过期后视为未命中
+        3. 命中率统计正确
+        """
+        local = LocalPermissionCache(max_size=2, timeout=60)
+        local.set(1, frozenset({'a'}))
+        local.set(2, frozenset({'b'}))
+        self.assertEqual(local.get(1), frozenset({'a'}))
+        local.set(3, frozenset({'c'}))  # 用户2最久未使用，被淘汰
+        self.assertIsNone(local.get(2))
+        self.assertEqual(local.get(3), frozenset({'c'}))
+
+        expired = LocalPermissionCache(max_size=2, timeout=0)
+        expired.set(1, frozenset({'a'}))
+        self.assertIsNone(expired.get(1))
+
+        stats = local.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+    @override_settings(PERMISSION_LOCAL_CACHE_SIZE=100)
+    def test_local_cache_invalidation(self):
+        """测试清除用户权限缓存时一级缓存同步清除"""
+        user = User.objects.create_user(username='l1_user', password='test123456', mobile='13800000011')
+        role = Role.objects.create(name='l1_role')
+        permission = Permission.objects.create(codename='get:/api/l1/')
+        user.roles.add(role)
+        PermissionCache.clear_user_permissions(user.id)
+
+        self.assertFalse(PermissionCache.has_permission(user.id, 'get:/api/l1/'))
+        role.permissions.add(permission)
+        PermissionCache.clear_user_permissions(user.id)
+        self.assertTrue(PermissionCache.has_permission(user.id, 'get:/api/l1/'))
+        self.assertGreater(get_local_cache().stats()['misses'], 0)
+
+
+class PermissionGenerationTest(TestCase):
+    def test_global_invalidation_by_generation(self):
+        """
+        测试全局代数失效：
+        1. 全局清除后旧缓存条目不再被采用
+        2. 失效前读库、失效后写回的旧数据不会被后续请求采用
+        """
+        user = User.objects.create_user(username='gen_user', password='test123456', mobile='13800000021')
+        role = Role.objects.create(name='gen_role')
+        permission = Permission.objects.create(codename='get:/api/gen/')
+        user.roles.add(role)
+        PermissionCache.clear_user_permissions()
+        self.assertEqual(PermissionCache.get_user_permissions(user.id), [])
+
+        role.permissions.add(permission)
+        PermissionCache.clear_user_permissions()
+        self.assertEqual(PermissionCache.get_user_permissions(user.id), ['get:/api/gen/'])
+
+        # 模拟失效前读到的旧代数写回缓存
+        from django.core.cache import cache
+        stale_generation = cache.get(PermissionCache.GENERATION_KEY) - 1
+        cache.set(f"user_roles_{user.id}", (stale_generation, ()))
+        self.assertEqual(PermissionCache.get_user_permissions(user.id), ['get:/api/gen/'])
+
+
+class PermissionSignalTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sig_user', password='test123456', mobile='13800000031')
+        self.other = User.objects.create_user(username='sig_other', password='test123456', mobile='13800000032')
+        self.role = Role.objects.create(name='sig_role')
+        self.other_role = Role.objects.create(name='sig_other_role')
+        self.permission = Permission.objects.create(codename='get:/api/sig/')
+        self.user.roles.add(self.role)
+        self.other.roles.add(self.other_role)
+
+    def _is_cached(self, user_id):
+        from django.core.cache import cache
+        return cache.get(f"user_roles_{user_id}") is not None
+
+    def test_role_permission_change_keeps_user_entries(self):
+        """测试角色权限变更只重新编译快照，不清除任何用户的角色缓存"""
+        PermissionCache.get_user_permissions(self.user.id)
+        PermissionCache.get_user_permissions(self.other.id)
+
+        self.role.permissions.add(self.permission)
+        self.assertTrue(self._is_cached(self.user.id))
+        self.assertTrue(self._is_cached(self.other.id))
+        self.assertEqual(PermissionCache.get_user_permissions(self.user.id), ['get:/api/sig/'])
+        self.assertEqual(PermissionCache.get_user_permissions(self.other.id), [])
+
+        self.permission.delete()
+        self.assertEqual(PermissionCache.get_user_permissions(self.user.id), [])
+
+    def test_role_delete_invalidates_role_users(self):
+        """测试删除角色只清除拥有该角色的用户缓存"""
+        PermissionCache.get_user_permissions(self.user.id)
+        PermissionCache.get_user_permissions(self.other.id)
+
+        self.role.delete()
+        self.assertFalse(self._is_cached(self.user.id))
+        self.assertTrue(self._is_cached(self.other.id))
+
+    def test_user_role_change_invalidates_user(self):
+        """测试用户角色变更（正向和反向）清除对应用户缓存"""
+        self.other_role.permissions.add(self.permission)
+        PermissionCache.get_user_permissions(self.user.id)
+
+        self.user.roles.add(self.other_role)
+        self.assertEqual(PermissionCache.get_user_permissions(self.user.id), ['get:/api/sig/'])
+
+        self.other_role.user_set.remove(self.user)
+        self.assertEqual(PermissionCache.get_user_permissions(self.user.id), [])
+
+    def test_late_fill_rejected_after_invalidation(self):
+        """测试失效前开始的回填在失效后写回旧角色，不会被后续请求采用"""
+        from django.core.cache import cache
+        self.role.permissions.add(self.permission)
+        user_key = PermissionCache._user_key(self.user.id)
+        # 回填开始时读到的标记和角色
+        PermissionCache.get_user_permissions(self.user.id)
+        stale_entry = cache.get(user_key)
+
+        self.user.roles.remove(self.role)
+        # 回填在失效之后才写入缓存
+        cache.set(user_key, stale_entry)
+        self.assertEqual(PermissionCache.get_user_permissions(self.user.id), [])
+
+
+class PermissionResolutionTest(TestCase):
+    def setUp(self):
+        self.role = Role.objects.create(name='bulk_role')
+        self.role.permissions.add(
+            Permission.objects.create(codename='get:/api/b/'),
+            Permission.objects.create(codename='get:/api/a/'),
+        )
+        self.users = []
+        for i in range(3):
+            user = User.objects.create_user(username=f'bulk_user{i}', password='test123456', mobile=f'1380000004{i}')
+            self.users.append(user)
+        self.users[0].roles.add(self.role)
+        self.users[1].roles.add(self.role)
+        PermissionCache.clear_user_permissions()
+
+    def test_single_query(self):
+        """测试单用户权限用一条查询解析，不存在的用户返回空列表"""
+        with self.assertNumQueries(1):
+            permissions = PermissionCache._get_permissions_from_db(self.users[0].id)
+        self.assertEqual(permissions, ['get:/api/a/', 'get:/api/b/'])
+        self.assertEqual(PermissionCache._get_permissions_from_db(99999), [])
+
+    def test_get_permissions_for_users(self):
+        """测试批量解析：一条查询解析所有未命中用户并写入缓存"""
+        user_ids = [user.id for user in self.users]
+        PermissionCache.get_snapshot()
+        with self.assertNumQueries(1):
+            result = PermissionCache.get_permissions_for_users(user_ids)
+        self.assertEqual(result, {
+            self.users[0].id: ['get:/api/a/', 'get:/api/b/'],
+            self.users[1].id: ['get:/api/a/', 'get:/api/b/'],
+            self.users[2].id: [],
+        })
+        # 再次获取全部命中缓存
+        with self.assertNumQueries(0):
+            self.assertEqual(PermissionCache.get_permissions_for_users(user_ids), result)
+            self.assertEqual(PermissionCache.get_user_permissions(self.users[2].id), [])
+
+
+class StampedeProtectionTest(TestCase):
+    def test_single_flight(self):
+        """测试并发的相同计算只执行一次，其他线程共享结果"""
+        import threading
+        from .utils import SingleFlight
+
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'roles'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['roles'] * 4)
+        # 计算完成后同一键可以再次执行
+        self.assertEqual(flight.do('key', lambda: 'again'), 'again')
+
+    def test_early_refresh(self):
+        """测试临近过期的条目按概率提前刷新，代数不一致时必须刷新"""
+        import time
+        from django.core.cache import cache
+        now = time.time()
+        self.assertTrue(PermissionCache._needs_refresh(None, 1))
+        self.assertTrue(PermissionCache._needs_refresh((0, (), now + 3600, 0.001), 1))
+        self.assertFalse(PermissionCache._needs_refresh((1, (), now + 3600, 0.001), 1))
+        self.assertTrue(PermissionCache._needs_refresh((1, (), now - 1, 0.001), 1))
+        with override_settings(PERMISSION_CACHE_EARLY_REFRESH_BETA=0):
+            self.assertFalse(PermissionCache._needs_refresh((1, (), now - 1, 0.001), 1))
+
+        user = User.objects.create_user(username='stampede_user', password='test123456', mobile='13800000051')
+        PermissionCache.get_user_permissions(user.id)
+        entry = cache.get(PermissionCache._user_key(user.id))
+        self.assertEqual(len(entry), 4)
+        self.assertLessEqual(entry[2], time.time() + settings.PERMISSION_CACHE_TIMEOUT)
+
+    @override_settings(PERMISSION_SNAPSHOT_LOCK_WAIT=0.05)
+    def test_snapshot_lock(self):
+        """测试快照锁被占用时等待超时后自行编译，持有锁的进程编译后释放锁"""
+        from django.core.cache import cache
+        from .snapshot import set_local_snapshot
+        Permission.objects.create(codename='get:/api/locked/')
+        PermissionCache.clear_user_permissions()
+        set_local_snapshot(None)
+        cache.set(PermissionCache.SNAPSHOT_LOCK_KEY, 'other', 5)
+        snapshot = PermissionCache.get_snapshot()
+        self.assertIn('get:/api/locked/', snapshot.codename_bits)
+        self.assertEqual(cache.get(PermissionCache.SNAPSHOT_LOCK_KEY), 'other')
+
+        cache.delete(PermissionCache.SNAPSHOT_LOCK_KEY)
+        PermissionCache.clear_snapshot()
+        set_local_snapshot(None)
+        PermissionCache.get_snapshot()
+        self.assertIsNone(cache.get(PermissionCache.SNAPSHOT_LOCK_KEY))
+
+
+class CacheCircuitBreakerTest(TestCase):
+    def setUp(self):
+        from .breaker import permission_cache
+        self.breaker = permission_cache.breaker
+        self.addCleanup(self._reset, permission_cache)
+
+    def _reset(self, permission_cache):
+        self.breaker.close()
+        permission_cache.pending_invalidation = False
+        permission_cache.fallback.clear()
+
+    @override_settings(PERMISSION_CACHE_BREAKER_THRESHOLD=2, PERMISSION_CACHE_BREAKER_PROBE_INTERVAL=60)
+    def test_fallback_during_outage(self):
+        """测试缓存连续失败后熔断，熔断期间不再访问 Redis，由降级缓存提供服务，恢复后全局失效"""
+        from unittest import mock
+        from django.core.cache import cache, caches
+        role = Role.objects.create(name='breaker_role')
+        role.permissions.add(Permission.objects.create(codename='get:/api/breaker/'))
+        user = User.objects.create_user(username='breaker_user', password='test123456', mobile='13800000061')
+        user.roles.add(role)
+
+        with mock.patch.object(caches['default'], 'get_many', side_effect=ConnectionError) as get_many:
+            # 熔断前直接查询数据库
+            for _ in range(2):
+                self.assertTrue(PermissionCache.has_permission(user.id, 'get:/api/breaker/'))
+            self.assertTrue(self.breaker.is_open)
+            calls = get_many.call_count
+            self.assertTrue(PermissionCache.has_permission(user.id, 'get:/api/breaker/'))
+            self.assertEqual(get_many.call_count, calls)
+            # 熔断期间本进程的权限变更立即生效
+            user.roles.clear()
+            self.assertFalse(PermissionCache.has_permission(user.id, 'get:/api/breaker/'))
+
+        generation = cache.get(PermissionCache.GENERATION_KEY)
+        self.breaker.close()
+        self.assertFalse(self.breaker.is_open)
+        self.assertNotEqual(cache.get(PermissionCache.GENERATION_KEY), generation)
+        self.assertFalse(PermissionCache.has_permission(user.id, 'get:/api/breaker/'))
+
+    @override_settings(PERMISSION_CACHE_BREAKER_THRESHOLD=1, PERMISSION_CACHE_BREAKER_PROBE_INTERVAL=0.01)
+    def test_background_probe(self):
+        """测试熔断后由后台线程探测，探测成功后自动关闭"""
+        import threading
+        from .breaker import CircuitBreaker
+        healthy = threading.Event()
+        closed = threading.Event()
+
+        def probe():
+            if not healthy.is_set():
+                raise ConnectionError
+
+        breaker = CircuitBreaker(probe, closed.set)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        healthy.set()
+        self.assertTrue(closed.wait(5))
+        self.assertTrue(breaker.allow())
+
+
+class RBACSnapshotTest(TestCase):
+    def test_role_bitmaps(self):
+        """
+        测试RBAC快照：
+        1. 用户权限为其角色位图的按位或
+        2. 快照构建后，命中用户角色缓存的权限检查不再查询数据库
+        """
+        from .snapshot import RBACSnapshot
+        view = Permission.objects.create(codename='get:/api/snap/')
+        edit = Permission.objects.create(codename='put:/api/snap/')
+        reader = Role.objects.create(name='snap_reader')
+        editor = Role.objects.create(name='snap_editor')
+        reader.permissions.add(view)
+        editor.permissions.add(view, edit)
+
+        snapshot = RBACSnapshot.build(1)
+        self.assertEqual(snapshot.mask_for_roles([reader.id]), 1 << snapshot.codename_bits['get:/api/snap/'])
+        self.assertEqual(snapshot.permission_ids_for_mask(snapshot.mask_for_roles([editor.id])), [view.id, edit.id])
+        self.assertEqual(
+            sorted(snapshot.codenames(snapshot.mask_for_roles([reader.id, editor.id]))),
+            ['get:/api/snap/', 'put:/api/snap/'],
+        )
+
+        user = User.objects.create_user(username='snap_user', password='test123456', mobile='13800000051')
+        user.roles.add(reader)
+        self.assertTrue(PermissionCache.has_permission(user.id, 'get:/api/snap/'))
+        with self.assertNumQueries(0):
+            self.assertFalse(PermissionCache.has_permission(user.id, 'put:/api/snap/'))
+
+    def test_cache_format(self):
+        """测试快照以压缩的版本化格式写入缓存，其他格式或版本的数据视为未命中"""
+        import pickle
+        from .snapshot import RBACSnapshot
+        role = Role.objects.create(name='format_role')
+        role.permissions.add(*Permission.objects.bulk_create([
+            Permission(codename=f'get:/api/format/resource{i}/') for i in range(200)
+        ]))
+        snapshot = RBACSnapshot.build(7)
+        data = snapshot.to_cache()
+        restored = RBACSnapshot.from_cache(data, 7)
+        self.assertEqual(restored.codename_bits, snapshot.codename_bits)
+        self.assertEqual(restored.permission_ids, snapshot.permission_ids)
+        self.assertEqual(restored.role_masks, snapshot.role_masks)
+        plain = pickle.dumps((snapshot.permissions, snapshot.role_masks), pickle.HIGHEST_PROTOCOL)
+        self.assertLess(len(data[2]) * 3, len(plain))
+
+        self.assertIsNone(RBACSnapshot.from_cache(data, 8))
+        self.assertIsNone(RBACSnapshot.from_cache((7, snapshot.permissions, snapshot.role_masks), 7))
+        self.assertIsNone(RBACSnapshot.from_cache(None, 7))
+
+    def test_has_permissions(self):
+        """测试批量检查多个权限只需一次缓存往返"""
+        from unittest import mock
+        from django.core.cache import caches
+        role = Role.objects.create(name='batch_role')
+        role.permissions.add(
+            Permission.objects.create(codename='get:/api/batch/'),
+            Permission.objects.create(codename='get:/api/batch/{id}/'),
+        )
+        user = User.objects.create_user(username='batch_user', password='test123456', mobile='13800000052')
+        user.roles.add(role)
+        PermissionCache.has_permission(user.id, 'get:/api/batch/')
+
+        backend = caches['default']
+        with mock.patch.object(backend, 'get_many', wraps=backend.get_many) as get_many:
+            result = PermissionCache.has_permissions(
+                user.id, ['get:/api/batch/', 'get:/api/batch/3/', 'delete:/api/batch/3/'],
+            )
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(result, {
+            'get:/api/batch/': True, 'get:/api/batch/3/': True, 'delete:/api/batch/3/': False,
+        })
+
+
+class BulkAssignmentTest(TestCase):
+    def setUp(self):
+        self.roles = [Role.objects.create(name=f'bulk_assign_role{i}') for i in range(2)]
+        self.permissions = [Permission.objects.create(codename=f'get:/api/bulk{i}/') for i in range(2)]
+        self.users = [
+            User.objects.create_user(username=f'bulk_assign_user{i}', password='test123456', mobile=f'1380000009{i}')
+            for i in range(3)
+        ]
+        admin = User.objects.create_user(username='bulk_admin', password='test123456', mobile='13800000099', is_superuser=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+
+    def _post(self, action, mode, pairs):
+        return self.client.post(f'/api/rbac/roles/{action}/', {'mode': mode, 'pairs': pairs}, format='json')
+
+    def test_bulk_assign_users(self):
+        """测试批量分配用户角色的添加、替换和移除，只清除关系变化的用户缓存"""
+        from django.core.cache import cache
+        user0, user1, user2 = (user.id for user in self.users)
+        role0, role1 = (role.id for role in self.roles)
+        self.roles[0].permissions.add(self.permissions[0])
+        self.roles[1].permissions.add(self.permissions[1])
+
+        response = self._post('bulk_assign_users', 'add', [[user0, role0], [user1, role0], [user1, role0]])
+        self.assertEqual((response.data['added'], response.data['removed']), (2, 0))
+        self.assertTrue(PermissionCache.has_permission(user0, 'get:/api/bulk0/'))
+        PermissionCache.get_user_permissions(user2)
+
+        # 替换 user1 的角色，user0 和 user2 不受影响
+        response = self._post('bulk_assign_users', 'replace', [[user1, role1]])
+        self.assertEqual((response.data['added'], response.data['removed']), (1, 1))
+        self.assertEqual(set(self.users[1].roles.values_list('id', flat=True)), {role1})
+        self.assertEqual(PermissionCache.get_user_permissions(user1), ['get:/api/bulk1/'])
+        self.assertIsNotNone(cache.get(PermissionCache._user_key(user2)))
+
+        response = self._post('bulk_assign_users', 'remove', [[user0, role0], [user0, role1]])
+        self.assertEqual((response.data['added'], response.data['removed']), (0, 1))
+        self.assertEqual(PermissionCache.get_user_permissions(user0), [])
+
+        response = self._post('bulk_assign_users', 'add', [[user0, 99999]])
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_assign_permissions(self):
+        """测试批量分配角色权限后重新编译快照"""
+        self.users[0].roles.add(self.roles[0])
+        role0 = self.roles[0].id
+        perm0, perm1 = (permission.id for permission in self.permissions)
+
+        self._post('bulk_assign_permissions', 'add', [[role0, perm0]])
+        self.assertEqual(PermissionCache.get_user_permissions(self.users[0].id), ['get:/api/bulk0/'])
+        response = self._post('bulk_assign_permissions', 'replace', [[role0, perm1]])
+        self.assertEqual((response.data['added'], response.data['removed']), (1, 1))
+        self.assertEqual(PermissionCache.get_user_permissions(self.users[0].id), ['get:/api/bulk1/'])
+
+
+class AsyncPermissionTest(TestCase):
+    def setUp(self):
+        self.role = Role.objects.create(name='async_role')
+        self.role.permissions.add(Permission.objects.create(codename='get:/api/rbac/permissions/'))
+        self.user = User.objects.create_user(username='async_perm_user', password='test123456', mobile='13800000081')
+        self.user.roles.add(self.role)
+        PermissionCache.clear_user_permissions()
+
+    def test_async_permission_cache(self):
+        """测试异步接口与同步接口结果一致，并与同步接口共享缓存条目"""
+        from asgiref.sync import async_to_sync
+        from django.core.cache import cache
+        self.assertTrue(async_to_sync(PermissionCache.ahas_permission)(self.user.id, 'get:/api/rbac/permissions/'))
+        self.assertFalse(async_to_sync(PermissionCache.ahas_permission)(self.user.id, 'post:/api/rbac/permissions/'))
+        self.assertEqual(cache.get(PermissionCache._user_key(self.user.id))[1], (self.role.id,))
+        with self.assertNumQueries(0):
+            self.assertTrue(PermissionCache.has_permission(self.user.id, 'get:/api/rbac/permissions/'))
+        self.assertEqual(
+            async_to_sync(PermissionCache._aget_permissions_from_db)(self.user.id),
+            PermissionCache._get_permissions_from_db(self.user.id),
+        )
+
+    def test_async_rbac_permission(self):
+        """测试异步视图直接调用 RBACPermission.ahas_permission 鉴权"""
+        from asgiref.sync import async_to_sync
+        from django.test import RequestFactory
+        from .permissions import RBACPermission
+
+        def build_request(method, user):
+            request = getattr(RequestFactory(), method)('/api/rbac/permissions/')
+            request.user = user
+            return request
+
+        permission = RBACPermission()
+        self.assertTrue(async_to_sync(permission.ahas_permission)(build_request('get', self.user)))
+        self.assertFalse(async_to_sync(permission.ahas_permission)(build_request('post', self.user)))
+        admin = User(username='async_admin', is_superuser=True)
+        self.assertTrue(async_to_sync(permission.ahas_permission)(build_request('post', admin)))
+
+
+class ListEndpointTest(TestCase):
+    def setUp(self):
+        permissions = [Permission.objects.create(codename=f'get:/api/list{i}/') for i in range(3)]
+        for i in range(5):
+            role = Role.objects.create(name=f'list_role{i}')
+            role.permissions.add(*permissions)
+        admin = User.objects.create_user(username='list_admin', password='test123456', mobile='13800000098', is_superuser=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+
+    def test_role_list(self):
+        """测试角色列表预取关联字段，查询数不随角色数增长，并按游标分页"""
+        # 角色、权限、父角色各一条查询
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/rbac/roles/')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(len(response.data['results'][0]['permissions']), 3)
+
+        response = self.client.get('/api/rbac/roles/', {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(response.data['next'])
+        self.assertEqual([role['name'] for role in response.data['results']], ['list_role2', 'list_role3'])
+
+    def test_sparse_fieldsets(self):
+        """测试 ?fields= 只返回并只查询请求的字段"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/rbac/roles/', {'fields': 'id,name'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        response = self.client.get('/api/rbac/permissions/', {'fields': 'codename'})
+        self.assertEqual(response.data['results'][0], {'codename': 'get:/api/list0/'})
+
+    def test_parents_cycle_validation(self):
+        """测试通过角色接口修改父角色时拒绝循环继承"""
+        parent, child = Role.objects.filter(name__in=['list_role0', 'list_role1']).order_by('id')
+        child.parents.add(parent)
+        response = self.client.patch(f'/api/rbac/roles/{parent.id}/', {'parents': [child.id]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parents', response.data)
+
+
+class RoleHierarchyTest(TestCase):
+    def setUp(self):
+        # 继承链：staff 继承 employee，manager 继承 staff
+        self.employee = Role.objects.create(name='employee')
+        self.staff = Role.objects.create(name='staff')
+        self.manager = Role.objects.create(name='manager')
+        self.employee.permissions.add(Permission.objects.create(codename='get:/api/notice/'))
+        self.manager.permissions.add(Permission.objects.create(codename='post:/api/notice/'))
+        self.staff.parents.add(self.employee)
+        self.manager.parents.add(self.staff)
+        self.user = User.objects.create_user(username='manager_user', password='test123456', mobile='13800000061')
+        self.user.roles.add(self.manager)
+
+    def _closure(self):
+        from .models import RoleClosure
+        return set(RoleClosure.objects.values_list('ancestor__name', 'descendant__name', 'depth'))
+
+    def test_closure_and_inheritance(self):
+        """测试闭包表维护，以及缓存和数据库两条路径都包含继承的权限"""
+        self.assertEqual(self._closure(), {
+            ('employee', 'staff', 1), ('staff', 'manager', 1), ('employee', 'manager', 2),
+        })
+        expected = ['get:/api/notice/', 'post:/api/notice/']
+        self.assertEqual(PermissionCache.get_user_permissions(self.user.id), expected)
+        self.assertEqual(PermissionCache._get_permissions_from_db(self.user.id), expected)
+        self.assertEqual(PermissionCache._get_permissions_for_users_from_db([self.user.id]), {self.user.id: expected})
+
+        # 祖先角色的权限变更只需重新编译快照，用户缓存保持有效
+        self.employee.permissions.add(Permission.objects.create(codename='get:/api/report/'))
+        self.assertTrue(PermissionCache.has_permission(self.user.id, 'get:/api/report/'))
+
+        # 断开继承后，后代角色不再拥有祖先角色的权限
+        self.staff.parents.remove(self.employee)
+        self.assertEqual(self._closure(), {('staff', 'manager', 1)})
+        self.assertEqual(PermissionCache.get_user_permissions(self.user.id), ['post:/api/notice/'])
+
+        self.staff.parents.add(self.employee)
+        self.staff.delete()
+        self.assertEqual(self._closure(), set())
+        self.assertEqual(PermissionCache.get_user_permissions(self.user.id), ['post:/api/notice/'])
+
+    def test_cycle_detection(self):
+        """测试写入时拒绝循环继承"""
+        from django.core.exceptions import ValidationError
+        from django.db import transaction
+        # 与 IntegrityError 一样，需在事务保存点内捕获
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.employee.parents.add(self.manager)
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.manager.children.add(self.employee)
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.staff.parents.add(self.staff)
+
+        admin = User.objects.create_user(username='hierarchy_admin', password='test123456', mobile='13800000062', is_superuser=True)
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        response = client.post(f'/api/rbac/roles/{self.employee.id}/assign_parents/', {'parent_ids': [self.manager.id]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.employee.parents.exists())
+
+        response = client.post(f'/api/rbac/roles/{self.manager.id}/assign_permissions/', {'permission_ids': []}, format='json')
+        self.assertEqual(response.data['inherited_permissions'], ['get:/api/notice/'])
+
+
+class DataScopeTest(TestCase):
+    def setUp(self):
+        from .models import DataScope
+        self.roles = [Role.objects.create(name=f'scope_role{i}') for i in range(3)]
+        self.viewer = Role.objects.create(name='scope_viewer')
+        self.viewer.permissions.add(
+            Permission.objects.create(codename='get:/api/rbac/roles/'),
+            Permission.objects.create(codename='get:/api/rbac/roles/{pk}/'),
+        )
+        self.scope = DataScope.objects.create(
+            role=self.viewer, resource='rbac.role', scope=DataScope.SCOPE_IDS, ids=[self.roles[0].id],
+        )
+        self.user = User.objects.create_user(username='scope_user', password='test123456', mobile='13800000091')
+        self.user.roles.add(self.viewer)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _role_names(self):
+        response = self.client.get('/api/rbac/roles/', {'fields': 'name'})
+        self.assertEqual(response.status_code, 200)
+        return {item['name'] for item in response.data['results']}
+
+    def test_queryset_filter(self):
+        """测试数据权限在查询中过滤，范围外的详情返回404，规则变更后重新编译"""
+        from .models import DataScope
+        self.assertEqual(self._role_names(), {'scope_role0'})
+        self.assertEqual(self.client.get(f'/api/rbac/roles/{self.roles[1].id}/').status_code, 404)
+        # 未配置数据权限的资源不受限制
+        self.assertIsNone(PermissionCache.get_snapshot().scope_rules('rbac.permission', [self.viewer.id]))
+
+        # 继承父角色的规则，多个规则取并集
+        parent = Role.objects.create(name='scope_parent')
+        DataScope.objects.create(role=parent, resource='rbac.role', scope=DataScope.SCOPE_IDS, ids=[self.roles[1].id])
+        self.viewer.parents.add(parent)
+        self.assertEqual(self._role_names(), {'scope_role0', 'scope_role1'})
+
+        DataScope.objects.create(role=parent, resource='rbac.role', scope=DataScope.SCOPE_ALL)
+        self.assertEqual(len(self._role_names()), Role.objects.count())
+
+        DataScope.objects.filter(resource='rbac.role').delete()
+        self.assertEqual(len(self._role_names()), Role.objects.count())
+
+    def test_reuses_request_permissions(self):
+        """测试数据权限过滤复用鉴权时得到的用户权限，未配置数据权限的资源不再读取权限缓存"""
+        from unittest import mock
+        from django.core.cache import caches
+        from .datascope import get_scope_rules
+        self.assertEqual(self._role_names(), {'scope_role0'})
+        backend = caches['default']
+        with mock.patch.object(backend, 'get_many', wraps=backend.get_many) as get_many:
+            self.assertEqual(self._role_names(), {'scope_role0'})
+        self.assertEqual(get_many.call_count, 1)
+
+        # 不经过请求直接调用时，按进程内快照和版本号判断，版本号缓存期内不读取缓存
+        with self.settings(PERMISSION_VERSION_CHECK_INTERVAL=60):
+            PermissionCache.get_versions()
+            with mock.patch.object(backend, 'get_many', wraps=backend.get_many) as get_many:
+                self.assertIsNone(get_scope_rules(self.user.id, 'rbac.permission'))
+            get_many.assert_not_called()
+
+    def test_compile_rules(self):
+        """测试本人数据、与本人同属的数据编译为过滤条件，没有规则时无可访问记录"""
+        from .datascope import filter_queryset
+        from .models import DataScope
+        other = User.objects.create_user(username='scope_other', password='test123456', mobile='13800000092', is_staff=True)
+        DataScope.objects.create(role=self.viewer, resource='users.user', scope=DataScope.SCOPE_SELF)
+        self.assertEqual(list(filter_queryset(User.objects.all(), self.user)), [self.user])
+
+        DataScope.objects.create(
+            role=self.viewer, resource='users.user', scope=DataScope.SCOPE_FIELD,
+            field='is_staff', user_field='is_staff',
+        )
+        self.assertEqual(set(filter_queryset(User.objects.all(), other)), set())
+        other.roles.add(self.viewer)
+        self.assertEqual(set(filter_queryset(User.objects.all(), other)), {other})
+        self.user.roles.clear()
+        self.assertFalse(filter_queryset(User.objects.all(), self.user).exists())
+
+    def test_data_scope_api(self):
+        """测试数据权限接口校验资源和字段"""
+        admin = User.objects.create_user(username='scope_admin', password='test123456', mobile='13800000093', is_superuser=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.post('/api/rbac/data-scopes/', {
+            'role': self.viewer.id, 'resource': 'rbac.missing', 'scope': 'all',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/rbac/data-scopes/', {
+            'role': self.viewer.id, 'resource': 'users.user', 'scope': 'field', 'field': 'nothing', 'user_field': 'id',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/rbac/data-scopes/', {
+            'role': self.viewer.id, 'resource': 'rbac.role', 'scope': 'ids', 'ids': [self.roles[2].id],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self._role_names(), {'scope_role0', 'scope_role2'})
+
+
+class MenuTreeTest(TestCase):
+    def setUp(self):
+        self.users_menu = Permission.objects.create(codename='get:/api/menu/users/', desc='用户列表', menu='系统管理/用户管理')
+        self.roles_menu = Permission.objects.create(codename='get:/api/menu/roles/', desc='角色列表', menu='系统管理/角色管理')
+        self.report_menu = Permission.objects.create(codename='get:/api/menu/report/', desc='报表', menu='报表')
+        self.role = Role.objects.create(name='menu_role')
+        self.role.permissions.add(self.users_menu, self.roles_menu, Permission.objects.create(codename='get:/api/menu/none/'))
+        self.user = User.objects.create_user(username='menu_user', password='test123456', mobile='13800000101')
+        self.user.roles.add(self.role)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_menu_tree(self):
+        """测试按菜单字段组织菜单树，相同角色组合的用户共享缓存，未变化时返回304"""
+        response = self.client.get('/api/rbac/menus/')
+        self.assertEqual(response.status_code, 200)
+        tree = response.data['data']
+        self.assertEqual([node['name'] for node in tree], ['系统管理'])
+        self.assertEqual([child['name'] for child in tree[0]['children']], ['用户管理', '角色管理'])
+        self.assertEqual(tree[0]['children'][0]['permissions'], [
+            {'id': self.users_menu.id, 'codename': 'get:/api/menu/users/', 'desc': '用户列表'},
+        ])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/rbac/menus/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        other = User.objects.create_user(username='menu_other', password='test123456', mobile='13800000102')
+        other.roles.add(self.role)
+        self.client.force_authenticate(user=other)
+        PermissionCache.get_permission_set(other.id)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/rbac/menus/')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.data['data'], tree)
+
+        # 角色权限变更后 ETag 变化，菜单随之更新
+        self.role.permissions.add(self.report_menu)
+        response = self.client.get('/api/rbac/menus/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([node['name'] for node in response.data['data']], ['系统管理', '报表'])
+
+    def test_superuser_and_anonymous(self):
+        """测试超级管理员获得全部菜单，新建带菜单的权限后立即可见，未登录时返回401"""
+        admin = User.objects.create_user(username='menu_admin', password='test123456', mobile='13800000103', is_superuser=True)
+        self.client.force_authenticate(user=admin)
+        self.assertEqual([node['name'] for node in self.client.get('/api/rbac/menus/').data['data']], ['系统管理', '报表'])
+        Permission.objects.create(codename='get:/api/menu/logs/', menu='日志')
+        self.assertEqual(
+            [node['name'] for node in self.client.get('/api/rbac/menus/').data['data']],
+            ['系统管理', '报表', '日志'],
+        )
+
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get('/api/rbac/menus/').status_code, 401)
+
+
+@override_settings(PERMISSION_MATERIALIZED=True)
+class MaterializedPermissionTest(TestCase):
+    def setUp(self):
+        # editor 继承 viewer
+        self.viewer = Role.objects.create(name='mat_viewer')
+        self.editor = Role.objects.create(name='mat_editor')
+        self.read = Permission.objects.create(codename='get:/api/article/')
+        self.write = Permission.objects.create(codename='post:/api/article/')
+        self.detail = Permission.objects.create(codename='get:/api/article/{id}/')
+        self.viewer.permissions.add(self.read, self.detail)
+        self.editor.permissions.add(self.write)
+        self.editor.parents.add(self.viewer)
+        self.user = User.objects.create_user(username='mat_user', password='test123456', mobile='13800000071')
+        self.user.roles.add(self.editor)
+
+    def _codenames(self):
+        from .models import UserPermission
+        return set(UserPermission.objects.filter(user=self.user).values_list('codename', flat=True))
+
+    def _assert_consistent(self):
+        from . import materialized
+        self.assertEqual(materialized.verify(), (0, 0))
+
+    def test_incremental_maintenance(self):
+        """测试用户角色、角色权限、继承关系和权限变更后物化表保持一致"""
+        self.assertEqual(self._codenames(), {'get:/api/article/', 'post:/api/article/', 'get:/api/article/{id}/'})
+        self._assert_consistent()
+
+        self.viewer.permissions.remove(self.detail)
+        self.assertNotIn('get:/api/article/{id}/', self._codenames())
+        self.read.role_set.clear()
+        self.assertEqual(self._codenames(), {'post:/api/article/'})
+        self.read.role_set.add(self.viewer)
+        self.read.codename = 'get:/api/articles/'
+        self.read.save()
+        self.assertEqual(self._codenames(), {'get:/api/articles/', 'post:/api/article/'})
+        self._assert_consistent()
+
+        self.editor.parents.clear()
+        self.assertEqual(self._codenames(), {'post:/api/article/'})
+        self.editor.parents.add(self.viewer)
+        self.viewer.delete()
+        self.assertEqual(self._codenames(), {'post:/api/article/'})
+        self.user.roles.clear()
+        self.assertEqual(self._codenames(), set())
+        self._assert_consistent()
+
+    def test_db_fallback(self):
+        """测试缓存不可用时按物化表检查权限，每次检查一条查询"""
+        from unittest import mock
+        from .utils import cache
+        with mock.patch.object(cache, 'get_many', side_effect=ConnectionError), \
+                override_settings(PERMISSION_CACHE_BREAKER_THRESHOLD=100):
+            permissions = PermissionCache.get_permission_set(self.user.id)
+            with self.assertNumQueries(1):
+                self.assertTrue(permissions.allows('post:/api/article/'))
+            with self.assertNumQueries(1):
+                self.assertTrue(permissions.allows('get:/api/article/5/'))
+            with self.assertNumQueries(1):
+                self.assertFalse(permissions.allows('delete:/api/article/5/'))
+        self.assertEqual(
+            PermissionCache._get_permissions_from_db(self.user.id),
+            ['get:/api/article/', 'get:/api/article/{id}/', 'post:/api/article/'],
+        )
+
+    def test_rebuild_command(self):
+        """测试校验命令发现不一致，重建后恢复一致"""
+        from io import StringIO
+        from django.core.management import call_command, CommandError
+        from .models import UserPermission
+        UserPermission.objects.filter(codename='post:/api/article/').delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_user_permissions', '--verify', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_user_permissions', stdout=out)
+        self.assertIn('3', out.getvalue())
+        call_command('rebuild_user_permissions', '--verify', stdout=StringIO())
+
+
+@override_settings(RBAC_TOKEN_CLAIMS=True, PERMISSION_VERSION_CHECK_INTERVAL=0)
+class TokenClaimsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='token_user', password='test123456', mobile='13800000061')
+        self.role = Role.objects.create(name='token_role')
+        self.role.permissions.add(Permission.objects.create(codename='get:/api/rbac/permissions/'))
+        self.user.roles.add(self.role)
+        self.client = APIClient()
+
+    def _login(self):
+        response = self.client.post('/api/auth/login/', {
+            'username': 'token_user',
+            'password': 'test123456'
+        })
+        return response.data['data']
+
+    def test_token_claims(self):
+        """
+        测试令牌内嵌RBAC声明：
+        1. 登录签发的令牌携带角色ID和RBAC代数
+        2. 代数未过期时根据令牌鉴权
+        3. 用户角色变更后令牌声明过期，回退到缓存路径
+        """
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .tokens import check_token_permission
+        tokens = self._login()
+        access = AccessToken(tokens['access'])
+        self.assertEqual(access['roles'], [self.role.id])
+        self.assertFalse(access['is_superuser'])
+        self.assertIs(check_token_permission(access, 'get:/api/rbac/permissions/'), True)
+        self.assertIs(check_token_permission(access, 'post:/api/rbac/permissions/'), False)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get('/api/rbac/permissions/').status_code, 200)
+
+        self.user.roles.remove(self.role)
+        self.assertIsNone(check_token_permission(access, 'get:/api/rbac/permissions/'))
+        self.assertEqual(self.client.get('/api/rbac/permissions/').status_code, 403)
+
+        # 刷新后的访问令牌携带最新的角色
+        response = self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']})
+        refreshed = AccessToken(response.data['access'])
+        self.assertEqual(refreshed['roles'], [])
+        self.assertIs(check_token_permission(refreshed, 'get:/api/rbac/permissions/'), False)
+
+    @override_settings(RBAC_ASSIGNMENT_VERSION_BUCKETS=4)
+    def test_assignment_version_buckets(self):
+        """测试其他分桶用户的角色变更不使令牌声明过期，同一分桶用户的变更使其过期"""
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .tokens import check_token_permission
+        access = AccessToken(self._login()['access'])
+        bucket = PermissionCache._assignment_bucket(self.user.id)
+        others = {}
+        for i in range(20):
+            other = User.objects.create_user(username=f'bucket_user{i}', password='test123456', mobile=f'138000006{i:02d}')
+            others.setdefault(PermissionCache._assignment_bucket(other.id) == bucket, other)
+        other_role = Role.objects.create(name='bucket_role')
+
+        others[False].roles.add(other_role)
+        self.assertIs(check_token_permission(access, 'get:/api/rbac/permissions/'), True)
+        others[True].roles.add(other_role)
+        self.assertIsNone(check_token_permission(access, 'get:/api/rbac/permissions/'))
+
+    def test_async_permission_with_claims(self):
+        """
+        测试开启令牌声明时异步鉴权不在事件循环中执行同步的缓存和数据库操作：
+        1. 进程内快照过期时通过异步接口读取版本号和快照
+        2. 令牌没有超级管理员标记时异步加载用户
+        """
+        from asgiref.sync import async_to_sync
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .authentication import RBACJWTAuthentication
+        from .permissions import RBACPermission
+        from .snapshot import set_local_snapshot
+
+        def build_request(method, token):
+            request = getattr(APIRequestFactory(), method)(
+                '/api/rbac/permissions/', HTTP_AUTHORIZATION=f'Bearer {token}'
+            )
+            request = Request(request, authenticators=[RBACJWTAuthentication()])
+            request.user  # 无状态认证，不查询数据库
+            return request
+
+        permission = RBACPermission()
+        access = self._login()['access']
+        PermissionCache.clear_snapshot()
+        set_local_snapshot(None)
+        self.assertTrue(async_to_sync(permission.ahas_permission)(build_request('get', access)))
+        self.assertFalse(async_to_sync(permission.ahas_permission)(build_request('post', access)))
+
+        plain = AccessToken.for_user(self.user)
+        self.assertTrue(async_to_sync(permission.ahas_permission)(build_request('get', plain)))
+        self.assertFalse(async_to_sync(permission.ahas_permission)(build_request('post', plain)))
+
+    def test_login_without_cache(self):
+        """测试缓存不可用时登录仍然成功，签发不带RBAC声明的令牌"""
+        from unittest import mock
+        from django.core.cache import caches
+        from rest_framework_simplejwt.tokens import AccessToken
+        with mock.patch.object(caches['default'], 'get_many', side_effect=ConnectionError):
+            response = self.client.post('/api/auth/login/', {
+                'username': 'token_user',
+                'password': 'test123456'
+            })
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(response.data['data']['access'])
+        self.assertNotIn('rbac_gen', access)
+        self.assertNotIn('roles', access)
+
+    def test_stateless_authentication(self):
+        """测试无状态认证：鉴权阶段不查询数据库，访问其他字段时才加载用户"""
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        from .authentication import RBACJWTAuthentication
+        from .permissions import RBACPermission
+        access = self._login()['access']
+
+        def build_request():
+            request = APIRequestFactory().get(
+                '/api/rbac/permissions/', HTTP_AUTHORIZATION=f'Bearer {access}'
+            )
+            return Request(request, authenticators=[RBACJWTAuthentication()])
+
+        RBACPermission().has_permission(build_request(), None)  # 预热快照
+        request = build_request()
+        with self.assertNumQueries(0):
+            self.assertTrue(RBACPermission().has_permission(request, None))
+            self.assertFalse(request.user.is_superuser)
+        with self.assertNumQueries(1):
+            self.assertEqual(request.user.mobile, '13800000061')
+            self.assertEqual(request.user.email, '')
+        # 令牌中的用户ID转换为主键类型，与缓存条目的键一致
+        self.assertEqual(request.user.id, self.user.id)
+
+    def test_deactivated_user(self):
+        """测试停用用户使其令牌声明过期，无状态认证的请求随之认证失败"""
+        from rest_framework.exceptions import AuthenticationFailed
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        from .authentication import RBACJWTAuthentication
+        from .permissions import RBACPermission
+        access = self._login()['access']
+        request = APIRequestFactory().get('/api/rbac/permissions/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertTrue(RBACPermission().has_permission(
+            Request(request, authenticators=[RBACJWTAuthentication()]), None,
+        ))
+
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        with self.assertRaises(AuthenticationFailed):
+            RBACPermission().has_permission(Request(request, authenticators=[RBACJWTAuthentication()]), None)
+
+
+class CodenameMatcherTest(TestCase):
+    def test_patterns(self):
+        """测试路由模板和通配符匹配"""
+        from .matcher import CodenameMatcher
+        matcher = CodenameMatcher([
+            'get:/api/rbac/permissions/{id}/',
+            '*:/api/rbac/roles/**',
+            'get:/api/*/users/',
+        ])
+        self.assertTrue(matcher.match('get:/api/rbac/permissions/42/'))
+        self.assertFalse(matcher.match('get:/api/rbac/permissions/'))
+        self.assertFalse(matcher.match('put:/api/rbac/permissions/42/'))
+        self.assertFalse(matcher.match('get:/api/rbac/permissions/42/extra/'))
+        self.assertTrue(matcher.match('delete:/api/rbac/roles/'))
+        self.assertTrue(matcher.match('post:/api/rbac/roles/3/assign_permissions/'))
+        self.assertTrue(matcher.match('get:/api/shop/users/'))
+        self.assertFalse(matcher.match('get:/api/shop/orders/'))
+
+    def test_template_permission(self):
+        """测试用户拥有模板权限时可访问任意对象的详情"""
+        user = User.objects.create_user(username='tpl_user', password='test123456', mobile='13800000071')
+        role = Role.objects.create(name='tpl_role')
+        role.permissions.add(Permission.objects.create(codename='get:/api/rbac/permissions/{id}/'))
+        user.roles.add(role)
+        self.assertTrue(PermissionCache.has_permission(user.id, 'get:/api/rbac/permissions/42/'))
+        self.assertFalse(PermissionCache.has_permission(user.id, 'get:/api/rbac/permissions/'))
+
+        client = APIClient()
+        token = client.post('/api/auth/login/', {
+            'username': 'tpl_user',
+            'password': 'test123456'
+        }).data['data']['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        permission_id = Permission.objects.get().id
+        self.assertEqual(client.get(f'/api/rbac/permissions/{permission_id}/').status_code, 200)
+        self.assertEqual(client.get('/api/rbac/permissions/').status_code, 403)
+
+
+class RoutePolicyTest(TestCase):
+    def test_route_policies(self):
+        """测试路由策略表：路由模板、白名单和所需权限"""
+        from django.urls import resolve
+        from .routes import get_route_policies
+        policies = get_route_policies()
+
+        login = policies[resolve('/api/auth/login/').route]
+        self.assertTrue(login.whitelisted)
+
+        detail = policies[resolve('/api/rbac/permissions/5/').route]
+        self.assertFalse(detail.whitelisted)
+        self.assertEqual(detail.view_name, 'rbac:permission-detail')
+        self.assertEqual(detail.codenames['GET'], 'get:/api/rbac/permissions/{pk}/')
+
+        # 格式后缀路由映射到同一权限
+        suffixed = policies[resolve('/api/rbac/permissions.json').route]
+        self.assertEqual(suffixed.codenames['GET'], 'get:/api/rbac/permissions/')
+
+    def test_sync_permissions(self):
+        """测试同步命令按路由创建权限，重复执行不会产生重复记录"""
+        from django.core.management import call_command
+        from io import StringIO
+        call_command('sync_permissions', stdout=StringIO())
+        call_command('sync_permissions', stdout=StringIO())
+        codenames = set(Permission.objects.values_list('codename', flat=True))
+        self.assertIn('get:/api/rbac/permissions/', codenames)
+        self.assertIn('delete:/api/rbac/roles/{pk}/', codenames)
+        self.assertIn('post:/api/rbac/roles/{pk}/assign_permissions/', codenames)
+        self.assertNotIn('post:/api/auth/login/', codenames)
+        self.assertEqual(len(codenames), Permission.objects.count())
+
+        # 同步的模板权限可直接用于鉴权
+        user = User.objects.create_user(username='route_user', password='test123456', mobile='13800000081')
+        role = Role.objects.create(name='route_role')
+        role.permissions.add(Permission.objects.get(codename='get:/api/rbac/permissions/{pk}/'))
+        user.roles.add(role)
+        client = APIClient()
+        token = client.post('/api/auth/login/', {
+            'username': 'route_user',
+            'password': 'test123456'
+        }).data['data']['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        permission_id = Permission.objects.first().id
+        self.assertEqual(client.get(f'/api/rbac/permissions/{permission_id}/').status_code, 200)
+        self.assertEqual(client.delete(f'/api/rbac/permissions/{permission_id}/').status_code, 403)
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_benchmark_command(self):
+        """测试压测命令离线运行、输出JSON结果并回滚生成的数据"""
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('rbac_benchmark', users=20, roles=5, permissions=30, checks=50, stdout=out)
+        report = json.loads(out.getvalue())
+        scenarios = {result['scenario']: result for result in report['results']}
+        self.assertEqual(scenarios['warm']['sql_queries_per_check'], 0)
+        self.assertIn('p99', scenarios['cold']['latency_us'])
+        self.assertEqual(User.objects.count(), 0)
+
+
+class WarmPermissionCacheTest(TestCase):
+    def test_warm_permission_cache(self):
+        """测试预热命令按最近登录时间筛选用户，预热后的权限检查不再查询数据库"""
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from .utils import warm_permission_cache
+
+        role = Role.objects.create(name='warm_role')
+        role.permissions.add(Permission.objects.create(codename='get:/api/warm/'))
+        users = []
+        for i in range(5):
+            user = User.objects.create_user(username=f'warm_user{i}', password='test123456', mobile=f'1380000008{i}')
+            user.roles.add(role)
+            users.append(user)
+        User.objects.filter(id=users[0].id).update(last_login=timezone.now())
+        User.objects.filter(id=users[1].id).update(last_login=timezone.now() - timedelta(days=30))
+        PermissionCache.clear_user_permissions()
+
+        self.assertEqual(warm_permission_cache(active_within=7)['users'], 1)
+        with self.assertNumQueries(0):
+            self.assertTrue(PermissionCache.has_permission(users[0].id, 'get:/api/warm/'))
+
+        out = StringIO()
+        call_command('warm_permission_cache', chunk_size=2, stdout=out)
+        self.assertIn('5 个用户，3 批', out.getvalue())
+        with self.assertNumQueries(0):
+            for user in users:
+                self.assertTrue(PermissionCache.has_permission(user.id, 'get:/api/warm/'))
+
+
+class MetricsTest(TestCase):
+    def test_metrics_endpoint(self):
+        """测试指标接口无需认证，并记录鉴权结果和缓存命中情况"""
+        from . import metrics
+        user = User.objects.create_user(username='metrics_user', password='test123456', mobile='13800000091')
+        denied = metrics.decision_seconds.count('denied')
+        lookups = metrics.cache_requests.value('hit') + metrics.cache_requests.value('miss')
+
+        client = APIClient()
+        token = client.post('/api/auth/login/', {
+            'username': 'metrics_user',
+            'password': 'test123456'
+        }).data['data']['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(client.get('/api/rbac/roles/').status_code, 403)
+        self.assertEqual(metrics.decision_seconds.count('denied'), denied + 1)
+        self.assertEqual(metrics.cache_requests.value('hit') + metrics.cache_requests.value('miss'), lookups + 1)
+
+        response = APIClient().get('/api/rbac/metrics/')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('rbac_decision_seconds_bucket{outcome="denied",le="+Inf"}', content)
+        self.assertIn('# TYPE rbac_permission_cache_requests_total counter', content)
 
+    @override_settings(PERMISSION_LOCAL_CACHE_SIZE=100)
+    def test_local_cache_metrics(self):
+        """测试开启一级缓存时输出其命中和未命中次数"""
+        from . import metrics
+        from .utils import get_local_cache
+        user = User.objects.create_user(username='l1_metrics_user', password='test123456', mobile='13800000092')
+        PermissionCache.has_permission(user.id, 'get:/api/rbac/roles/')
+        PermissionCache.has_permission(user.id, 'get:/api/rbac/roles/')
+        stats = get_local_cache().stats()
+        content = metrics.render()
+        self.assertIn('# TYPE rbac_local_cache_lookups gauge', content)
+        self.assertIn(f'rbac_local_cache_lookups{{result="hit"}} {stats["hits"]}', content)
+        self.assertIn(f'rbac_local_cache_lookups{{result="miss"}} {stats["misses"]}', content)
+        self.assertGreaterEqual(stats['hits'], 1)
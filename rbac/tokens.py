@@ -0,0 +1,103 @@
+import logging
+
+from django.conf import settings
+from rest_framework_simplejwt.settings import api_settings
+from .utils import PermissionCache
+
+logger = logging.getLogger(__name__)
+
+# 令牌中携带RBAC信息的声明名称
+ROLES_CLAIM = 'roles'
+SUPERUSER_CLAIM = 'is_superuser'
+GENERATION_CLAIM = 'rbac_gen'
+
+
+def rbac_claims_enabled():
+    """是否开启令牌内嵌RBAC声明（RBAC_TOKEN_CLAIMS）"""
+    return getattr(settings, 'RBAC_TOKEN_CLAIMS', False)
+
+
+def add_rbac_claims(token, user_id, is_superuser):
+    """
+    向令牌写入RBAC声明：角色ID、超级管理员标记和签发时的RBAC代数
+    （全局代数和用户所在分桶的角色分配版本，其他分桶用户的角色变更不影响该令牌）
+    先读取代数再查询角色，查询期间发生的变更会使令牌代数落后而被视为过期；
+    缓存不可用时签发不带RBAC声明的普通令牌，请求按缓存路径鉴权
+    """
+    try:
+        versions = PermissionCache.get_versions(refresh=True)
+    except Exception:
+        logger.warning('读取RBAC版本失败，签发不带RBAC声明的令牌', exc_info=True)
+        return token
+    token[ROLES_CLAIM] = list(PermissionCache._get_role_ids_from_db(user_id))
+    token[SUPERUSER_CLAIM] = bool(is_superuser)
+    token[GENERATION_CLAIM] = [versions.generation, versions.assignment_version(user_id)]
+    return token
+
+
+class _SuperuserPermissions:
+    """超级管理员的有效权限，允许访问所有资源"""
+
+    def allows(self, codename):
+        return True
+
+
+SUPERUSER_PERMISSIONS = _SuperuserPermissions()
+
+
+def get_token_permissions(token):
+    """
+    根据令牌中的RBAC声明得到用户的有效权限，不查询用户缓存和数据库
+    
+    Returns:
+        有效权限对象（支持 allows 判断）；令牌没有RBAC声明或声明已过期时返回 None，
+        需要回退到缓存路径
+    """
+    if token.get(GENERATION_CLAIM) is None:
+        return None
+    try:
+        versions = PermissionCache.get_versions()
+    except Exception:
+        return None
+    if not _claims_current(token, versions):
+        return None
+    if token.get(SUPERUSER_CLAIM):
+        return SUPERUSER_PERMISSIONS
+    snapshot = PermissionCache.get_snapshot(versions.policy_version)
+    return snapshot.permissions_for_roles(token.get(ROLES_CLAIM, ()))
+
+
+async def aget_token_permissions(token):
+    """get_token_permissions 的异步版本，版本号和快照通过异步接口读取"""
+    if token.get(GENERATION_CLAIM) is None:
+        return None
+    try:
+        versions = await PermissionCache.aget_versions()
+    except Exception:
+        return None
+    if not _claims_current(token, versions):
+        return None
+    if token.get(SUPERUSER_CLAIM):
+        return SUPERUSER_PERMISSIONS
+    snapshot = await PermissionCache.aget_snapshot(versions.policy_version)
+    return snapshot.permissions_for_roles(token.get(ROLES_CLAIM, ()))
+
+
+def _claims_current(token, versions):
+    """令牌中的代数是否与当前的全局代数、用户所在分桶的角色分配版本一致"""
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    return token[GENERATION_CLAIM] == [versions.generation, versions.assignment_version(user_id)]
+
+
+def check_token_permission(token, codename):
+    """
+    根据令牌中的RBAC声明鉴权
+    
+    Returns:
+        bool: 鉴权结果
+        None: 令牌没有RBAC声明或声明已过期，需要回退到缓存路径
+    """
+    permissions = get_token_permissions(token)
+    if permissions is None:
+        return None
+    return permissions.allows(codename)
@@ -6,10 +6,13 @@ from . import views
 router = DefaultRouter()
 router.register(r'permissions', views.PermissionViewSet, basename='permission')
 router.register(r'roles', views.RoleViewSet, basename='role')
+router.register(r'data-scopes', views.DataScopeViewSet, basename='data-scope')
 
 app_name = 'rbac'
 
 urlpatterns = [
+    path('rbac/metrics/', views.metrics_view, name='metrics'),
+    path('rbac/menus/', views.menu_view, name='menus'),
     path('rbac/', include(router.urls)),
 ] 
 
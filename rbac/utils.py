@@ -1,16 +1,257 @@
-from django.core.cache import cache
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict, namedtuple
+
+from asgiref.sync import sync_to_async
+
 from django.conf import settings
-from .models import Permission
+from . import metrics
+from .breaker import permission_cache as cache
+from . import materialized
+from django.db.models import Q
+from .models import Permission, RoleClosure, UserPermission
+from .snapshot import RBACSnapshot, PermissionSet, get_local_snapshot, set_local_snapshot
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
+UserRoles = User.roles.through
+
+logger = logging.getLogger(__name__)
+
+
+class LocalPermissionCache:
+    """
+    进程内一级权限缓存（L1）
+    以用户ID为键保存用户的有效权限，容量有上限（LRU 淘汰），
+    每个条目在 timeout 秒后过期，因此其他进程上的缓存清除最迟在 timeout 秒后生效
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """获取用户有效权限，不存在或已过期时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[user_id]
+                self.misses += 1
+                return None
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, permissions):
+        """写入用户有效权限，超出容量时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + self.timeout
+        with self._lock:
+            self._data[user_id] = (expires_at, permissions)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """返回命中统计：命中数、未命中数、当前条目数和命中率"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+_local_cache = None
+_local_cache_lock = threading.Lock()
+
+
+def get_local_cache():
+    """
+    获取当前进程的一级权限缓存
+    PERMISSION_LOCAL_CACHE_SIZE 为 0（默认）时关闭一级缓存，返回 None
+    """
+    global _local_cache
+    max_size = getattr(settings, 'PERMISSION_LOCAL_CACHE_SIZE', 0)
+    if not max_size:
+        return None
+    timeout = getattr(settings, 'PERMISSION_LOCAL_CACHE_TIMEOUT', 5)
+    local = _local_cache
+    if local is None or local.max_size != max_size or local.timeout != timeout:
+        with _local_cache_lock:
+            local = _local_cache
+            if local is None or local.max_size != max_size or local.timeout != timeout:
+                local = _local_cache = LocalPermissionCache(max_size, timeout)
+    return local
+
+
+def _local_cache_lookups():
+    local = _local_cache
+    if local is None:
+        return {}
+    stats = local.stats()
+    return {('hit',): stats['hits'], ('miss',): stats['misses']}
+
+
+# 一级缓存的累计命中和未命中次数，未开启一级缓存时不输出
+metrics.CallbackGauge(
+    'rbac_local_cache_lookups', 'Local (L1) permission cache lookups by result',
+    _local_cache_lookups, ['result'],
+)
+
+
+class SingleFlight:
+    """
+    进程内的单飞执行
+    同一键的计算同时只执行一次，并发的其他线程等待并共享这次的结果
+    """
+
+    class _Call:
+        __slots__ = ('event', 'result', 'error')
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+_single_flight = SingleFlight()
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的异步版本：同一事件循环内相同键的协程共享一个任务"""
+
+    def __init__(self):
+        self._tasks = weakref.WeakKeyDictionary()  # 事件循环 -> {键: 任务}
+
+    async def do(self, key, coroutine_fn):
+        tasks = self._tasks.setdefault(asyncio.get_running_loop(), {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(coroutine_fn())
+            task.add_done_callback(lambda _: tasks.pop(key, None))
+        # 某个等待方被取消时不影响其他等待方
+        return await asyncio.shield(task)
+
+
+_async_single_flight = AsyncSingleFlight()
+
+class RBACVersions(namedtuple('RBACVersions', ['generation', 'policy_version', 'assignment_versions'])):
+    """RBAC版本号：全局代数、快照版本、各分桶的用户角色分配版本"""
+    __slots__ = ()
+
+    def assignment_version(self, user_id):
+        """用户所在分桶的角色分配版本"""
+        return self.assignment_versions[PermissionCache._assignment_bucket(user_id)]
+
+
+_local_versions = None
+
 
 class PermissionCache:
     """
     权限缓存工具类
     用于管理用户权限的缓存操作，包括获取和清除缓存
+    缓存分两部分：每个用户只缓存其角色ID，角色到权限的映射编译为
+    所有用户共享的RBAC快照（见 rbac.snapshot），因此缓存占用不随用户数×权限数增长
     """
 
+    # 全局权限代数的缓存键，每次全局失效时加一
+    GENERATION_KEY = "rbac_generation"
+    # 快照版本的缓存键，角色或权限变更时加一
+    POLICY_VERSION_KEY = "rbac_policy_version"
+    # RBAC快照的缓存键
+    SNAPSHOT_KEY = "rbac_snapshot"
+    # 用户角色分配版本的缓存键前缀，用户按ID分桶，桶内任一用户的角色变更时该桶版本加一
+    # （令牌内嵌声明据此判断是否过期）
+    ASSIGNMENT_VERSION_KEY = "rbac_assignment_version"
+    # 批量清除缓存时每批删除的键数量
+    DELETE_BATCH_SIZE = 1000
+    # 编译RBAC快照时跨进程互斥锁的缓存键
+    SNAPSHOT_LOCK_KEY = "rbac_snapshot_lock"
+
+    @staticmethod
+    def _user_key(user_id):
+        return f"user_roles_{user_id}"
+
+    @staticmethod
+    def _assignment_bucket(user_id):
+        """
+        用户所在的角色分配版本分桶
+        按ID字符串计算，令牌中字符串形式的用户ID与整数主键落在同一个桶
+        """
+        buckets = getattr(settings, 'RBAC_ASSIGNMENT_VERSION_BUCKETS', 64)
+        return zlib.crc32(str(user_id).encode()) % buckets
+
+    @staticmethod
+    def _assignment_version_key(bucket):
+        return f"{PermissionCache.ASSIGNMENT_VERSION_KEY}_{bucket}"
+
+    @staticmethod
+    def _version_keys():
+        """get_versions 读取的全部键：全局代数、快照版本和各分桶的角色分配版本"""
+        buckets = getattr(settings, 'RBAC_ASSIGNMENT_VERSION_BUCKETS', 64)
+        return [
+            PermissionCache.GENERATION_KEY,
+            PermissionCache.POLICY_VERSION_KEY,
+            *(PermissionCache._assignment_version_key(bucket) for bucket in range(buckets)),
+        ]
+
+    @staticmethod
+    def _user_version_key(user_id):
+        """
+        用户版本的缓存键，清除该用户的缓存时写入新值
+        用户缓存条目以 (全局代数, 用户版本) 作为标记，查询期间发生失效的回填条目标记落后，不会被采用
+        """
+        return f"user_roles_version_{user_id}"
+
     @staticmethod
     def get_user_permissions(user_id):
         """
@@ -23,42 +264,595 @@ class PermissionCache:
         Returns:
             list: 用户权限列表，包含权限的codename
         """
-        # 构建缓存键
-        cache_key = f"user_permissions_{user_id}"
+        return sorted(PermissionCache._resolve(user_id))
+
+    @staticmethod
+    def get_permission_set(user_id):
+        """
+        获取用户的有效权限（支持 in 判断和迭代）
+        开启一级缓存时优先读取进程内缓存，未命中再走 Redis/数据库
+        """
+        local = get_local_cache()
+        if local is not None:
+            permissions = local.get(user_id)
+            if permissions is not None:
+                return permissions
+        permissions = PermissionCache._resolve(user_id)
+        if local is not None:
+            local.set(user_id, permissions)
+        return permissions
+
+    @staticmethod
+    def has_permission(user_id, codename):
+        """
+        检查用户是否拥有指定权限
+        先精确匹配，再用用户角色组合编译出的匹配器匹配路由模板和通配符权限
+        """
+        return PermissionCache.get_permission_set(user_id).allows(codename)
+
+    @staticmethod
+    def has_permissions(user_id, codenames):
+        """
+        批量检查用户是否拥有多个权限，返回 {codename: 是否拥有}
+        只解析一次用户的有效权限（一次缓存往返），各codename的检查都在本地完成
+        """
+        permissions = PermissionCache.get_permission_set(user_id)
+        return {codename: permissions.allows(codename) for codename in codenames}
+
+    @staticmethod
+    def _resolve(user_id):
+        """
+        解析用户的有效权限
+        一次往返取回全局代数、快照版本和用户角色缓存，
+        用户的权限位图由其角色位图按位或得到
+        """
+        user_key = PermissionCache._user_key(user_id)
+        version_key = PermissionCache._user_version_key(user_id)
+        try:
+            values = cache.get_many([
+                PermissionCache.GENERATION_KEY,
+                PermissionCache.POLICY_VERSION_KEY,
+                user_key,
+                version_key,
+            ])
+            generation = values.get(PermissionCache.GENERATION_KEY)
+            if generation is None:
+                generation = PermissionCache._init_counter(PermissionCache.GENERATION_KEY)
+            policy_version = values.get(PermissionCache.POLICY_VERSION_KEY)
+            if policy_version is None:
+                policy_version = PermissionCache._init_counter(PermissionCache.POLICY_VERSION_KEY)
+        except Exception:
+            # 缓存不可用时直接从数据库查询
+            logger.warning('读取权限缓存失败，改为直接查询数据库', exc_info=True)
+            metrics.cache_requests.inc('error')
+            if materialized.is_enabled():
+                # 物化表按索引逐个检查权限，不加载全部权限
+                metrics.db_fallbacks.inc()
+                return materialized.MaterializedPermissions(user_id)
+            return PermissionSet(PermissionCache._get_permissions_from_db(user_id))
+
+        entry = values.get(user_key)
+        tag = (generation, values.get(version_key))
+        if not PermissionCache._needs_refresh(entry, tag):
+            metrics.cache_requests.inc('hit')
+            role_ids = entry[1]
+        else:
+            metrics.cache_requests.inc('miss')
+            # 同一进程内同一用户的并发未命中只查询一次数据库
+            role_ids = _single_flight.do(
+                (user_key, tag),
+                lambda: PermissionCache._fill_user_entry(user_id, user_key, tag),
+            )
+
+        return PermissionCache.get_snapshot(policy_version).permissions_for_roles(role_ids)
+
+    @staticmethod
+    async def aget_permission_set(user_id):
+        """
+        get_permission_set 的异步版本，供 ASGI 下的异步视图使用
+        缓存读写使用异步客户端，数据库查询使用异步ORM，不经过线程切换
+        """
+        local = get_local_cache()
+        if local is not None:
+            permissions = local.get(user_id)
+            if permissions is not None:
+                return permissions
+        permissions = await PermissionCache._aresolve(user_id)
+        if local is not None:
+            local.set(user_id, permissions)
+        return permissions
+
+    @staticmethod
+    async def ahas_permission(user_id, codename):
+        """has_permission 的异步版本"""
+        return (await PermissionCache.aget_permission_set(user_id)).allows(codename)
+
+    @staticmethod
+    async def ahas_permissions(user_id, codenames):
+        """has_permissions 的异步版本"""
+        permissions = await PermissionCache.aget_permission_set(user_id)
+        return {codename: permissions.allows(codename) for codename in codenames}
+
+    @staticmethod
+    async def _aresolve(user_id):
+        """_resolve 的异步版本"""
+        user_key = PermissionCache._user_key(user_id)
+        version_key = PermissionCache._user_version_key(user_id)
+        client = cache.async_client()
+        try:
+            values = await client.get_many([
+                PermissionCache.GENERATION_KEY,
+                PermissionCache.POLICY_VERSION_KEY,
+                user_key,
+                version_key,
+            ])
+            generation = values.get(PermissionCache.GENERATION_KEY)
+            if generation is None:
+                generation = await PermissionCache._ainit_counter(PermissionCache.GENERATION_KEY)
+            policy_version = values.get(PermissionCache.POLICY_VERSION_KEY)
+            if policy_version is None:
+                policy_version = await PermissionCache._ainit_counter(PermissionCache.POLICY_VERSION_KEY)
+        except Exception:
+            # 缓存不可用时直接从数据库查询
+            logger.warning('读取权限缓存失败，改为直接查询数据库', exc_info=True)
+            metrics.cache_requests.inc('error')
+            return PermissionSet(await PermissionCache._aget_permissions_from_db(user_id))
+
+        entry = values.get(user_key)
+        tag = (generation, values.get(version_key))
+        if not PermissionCache._needs_refresh(entry, tag):
+            metrics.cache_requests.inc('hit')
+            role_ids = entry[1]
+        else:
+            metrics.cache_requests.inc('miss')
+            role_ids = await _async_single_flight.do(
+                (user_key, tag),
+                lambda: PermissionCache._afill_user_entry(user_id, user_key, tag),
+            )
+
+        return (await PermissionCache.aget_snapshot(policy_version)).permissions_for_roles(role_ids)
+
+    @staticmethod
+    async def _afill_user_entry(user_id, user_key, tag):
+        """_fill_user_entry 的异步版本"""
+        start = time.time()
+        role_ids = await PermissionCache._aget_role_ids_from_db(user_id)
+        now = time.time()
+        timeout = PermissionCache._cache_timeout()
+        try:
+            await cache.async_client().set(user_key, (tag, role_ids, now + timeout, now - start), timeout)
+        except Exception:
+            # 如果缓存操作失败，记录后继续执行
+            logger.warning('写入权限缓存失败', exc_info=True)
+        return role_ids
+
+    @staticmethod
+    async def aget_snapshot(policy_version):
+        """
+        get_snapshot 的异步版本
+        进程内快照版本匹配时直接返回；快照只在版本变化后加载一次，其余情况转到同步实现
+        """
+        snapshot = get_local_snapshot()
+        if snapshot is not None and snapshot.version == policy_version:
+            metrics.snapshot_loads.inc('local')
+            return snapshot
+        return await sync_to_async(PermissionCache.get_snapshot)(policy_version)
+
+    @staticmethod
+    async def _ainit_counter(key):
+        """_init_counter 的异步版本"""
+        client = cache.async_client()
+        await client.add(key, int(time.time() * 1000), None)
+        return await client.get(key)
+
+    @staticmethod
+    async def _aget_role_ids_from_db(user_id):
+        """_get_role_ids_from_db 的异步版本"""
+        queryset = (
+            UserRoles.objects.filter(user_id=user_id)
+            .values_list('role_id', flat=True)
+            .order_by('role_id')
+        )
+        return tuple([role_id async for role_id in queryset])
+
+    @staticmethod
+    async def _aget_permissions_from_db(user_id):
+        """_get_permissions_from_db 的异步版本"""
+        metrics.db_fallbacks.inc()
+        if materialized.is_enabled():
+            queryset = UserPermission.objects.filter(user_id=user_id).values_list('codename', flat=True).order_by('codename')
+            return [codename async for codename in queryset]
+        role_ids = UserRoles.objects.filter(user_id=user_id).values('role_id')
+        ancestor_ids = RoleClosure.objects.filter(descendant_id__in=role_ids).values('ancestor_id')
+        queryset = (
+            Permission.objects.filter(Q(role__in=role_ids) | Q(role__in=ancestor_ids))
+            .values_list('codename', flat=True)
+            .distinct()
+            .order_by('codename')
+        )
+        return [codename async for codename in queryset]
+
+    @staticmethod
+    def _fill_user_entry(user_id, user_key, tag):
+        """
+        从数据库查询用户角色并写入缓存，条目中记录过期时间和查询耗时，用于提前刷新
+        tag 为查询前读到的 (全局代数, 用户版本)
+        """
+        start = time.time()
+        role_ids = PermissionCache._get_role_ids_from_db(user_id)
+        now = time.time()
+        timeout = PermissionCache._cache_timeout()
+        # 以查询前读到的标记写入缓存：若查询期间发生了全局失效或该用户的失效，
+        # 这条旧数据的标记落后，不会被后续请求采用
+        try:
+            cache.set(user_key, (tag, role_ids, now + timeout, now - start), timeout)
+        except Exception:
+            # 如果缓存操作失败，记录后继续执行
+            logger.warning('写入权限缓存失败', exc_info=True)
+        return role_ids
+
+    @staticmethod
+    def _needs_refresh(entry, tag):
+        """
+        判断用户缓存条目是否需要重新查询
+        标记（全局代数和用户版本）不一致时必须刷新；临近过期时按概率提前刷新（越接近过期、查询越慢，概率越高），
+        使热点用户的条目在过期前由个别请求续期，而不是过期后由大量请求同时回源
+        """
+        if entry is None or entry[0] != tag:
+            return True
+        if len(entry) < 4:
+            return False
+        beta = getattr(settings, 'PERMISSION_CACHE_EARLY_REFRESH_BETA', 1.0)
+        if not beta:
+            return False
+        expires_at, delta = entry[2], entry[3]
+        return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+    @staticmethod
+    def _cache_timeout():
+        """
+        用户缓存的过期时间
+        在 PERMISSION_CACHE_TIMEOUT 基础上随机缩短最多 PERMISSION_CACHE_TIMEOUT_JITTER 比例，
+        避免同一批写入的条目同时过期
+        """
+        timeout = settings.PERMISSION_CACHE_TIMEOUT
+        jitter = getattr(settings, 'PERMISSION_CACHE_TIMEOUT_JITTER', 0.1)
+        return max(1, int(timeout * (1 - random.random() * jitter)))
+
+    @staticmethod
+    def get_permissions_for_users(user_ids):
+        """
+        批量获取多个用户的权限列表
+        一次 get_many 读取缓存，未命中的用户用一条查询解析，再用一次 set_many 写回
         
+        Args:
+            user_ids: 用户ID集合
+            
+        Returns:
+            dict: {用户ID: 权限codename列表}
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {}
+        user_keys = {user_id: PermissionCache._user_key(user_id) for user_id in user_ids}
+        version_keys = {user_id: PermissionCache._user_version_key(user_id) for user_id in user_ids}
+
         try:
-            # 尝试从缓存获取权限
-            permissions = cache.get(cache_key)
+            values = cache.get_many([
+                PermissionCache.GENERATION_KEY,
+                PermissionCache.POLICY_VERSION_KEY,
+                *user_keys.values(),
+                *version_keys.values(),
+            ])
+            generation = values.get(PermissionCache.GENERATION_KEY)
+            if generation is None:
+                generation = PermissionCache._init_counter(PermissionCache.GENERATION_KEY)
+            policy_version = values.get(PermissionCache.POLICY_VERSION_KEY)
+            if policy_version is None:
+                policy_version = PermissionCache._init_counter(PermissionCache.POLICY_VERSION_KEY)
+        except Exception:
+            # 缓存不可用时直接从数据库查询
+            logger.warning('批量读取权限缓存失败，改为直接查询数据库', exc_info=True)
+            metrics.cache_requests.inc('error', amount=len(user_ids))
+            return PermissionCache._get_permissions_for_users_from_db(user_ids)
+
+        role_ids_by_user = {}
+        missing = []
+        tags = {user_id: (generation, values.get(version_keys[user_id])) for user_id in user_ids}
+        for user_id, user_key in user_keys.items():
+            entry = values.get(user_key)
+            if not PermissionCache._needs_refresh(entry, tags[user_id]):
+                role_ids_by_user[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+        metrics.cache_requests.inc('hit', amount=len(role_ids_by_user))
+        metrics.cache_requests.inc('miss', amount=len(missing))
+
+        if missing:
+            start = time.time()
+            resolved = PermissionCache._get_role_ids_for_users_from_db(missing)
+            now = time.time()
+            timeout = PermissionCache._cache_timeout()
+            try:
+                cache.set_many(
+                    {user_keys[user_id]: (tags[user_id], role_ids, now + timeout, now - start)
+                     for user_id, role_ids in resolved.items()},
+                    timeout,
+                )
+            except Exception:
+                # 如果缓存操作失败，记录后继续执行
+                logger.warning('批量写入权限缓存失败', exc_info=True)
+            role_ids_by_user.update(resolved)
+
+        snapshot = PermissionCache.get_snapshot(policy_version)
+        return {
+            user_id: sorted(snapshot.codenames(snapshot.mask_for_roles(role_ids)))
+            for user_id, role_ids in role_ids_by_user.items()
+        }
+
+    @staticmethod
+    def warm_users(user_ids):
+        """
+        预热指定用户的权限缓存
+        不读取已有条目，直接用一条查询解析所有用户的角色，再用一次 set_many 写入
+        
+        Args:
+            user_ids: 用户ID集合
             
-            # 如果缓存中没有，从数据库查询
-            if permissions is None:
-                permissions = PermissionCache._get_permissions_from_db(user_id)
-                # 将查询结果存入缓存
-                try:
-                    cache.set(cache_key, list(permissions), 
-                             settings.PERMISSION_CACHE_TIMEOUT)
-                except Exception:
-                    # 如果缓存操作失败，忽略错误继续执行
-                    pass
-                
-            return permissions
+        Returns:
+            int: 写入缓存的用户数
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return 0
+        version_keys = {user_id: PermissionCache._user_version_key(user_id) for user_id in user_ids}
+        values = cache.get_many([PermissionCache.GENERATION_KEY, *version_keys.values()])
+        generation = values.get(PermissionCache.GENERATION_KEY)
+        if generation is None:
+            generation = PermissionCache._init_counter(PermissionCache.GENERATION_KEY)
+        start = time.time()
+        resolved = PermissionCache._get_role_ids_for_users_from_db(user_ids)
+        now = time.time()
+        timeout = PermissionCache._cache_timeout()
+        cache.set_many(
+            {PermissionCache._user_key(user_id): (
+                (generation, values.get(version_keys[user_id])), role_ids, now + timeout, now - start,
+            ) for user_id, role_ids in resolved.items()},
+            timeout,
+        )
+        return len(resolved)
+
+    @staticmethod
+    def get_snapshot(policy_version=None):
+        """
+        获取指定版本的RBAC快照
+        依次查找进程内快照、缓存中的快照，都不匹配时从数据库编译并写回缓存
+        
+        Args:
+            policy_version: 快照版本，不传时从缓存读取当前版本
+        """
+        if policy_version is None:
+            try:
+                policy_version = cache.get(PermissionCache.POLICY_VERSION_KEY)
+                if policy_version is None:
+                    policy_version = PermissionCache._init_counter(PermissionCache.POLICY_VERSION_KEY)
+            except Exception:
+                logger.warning('读取快照版本失败，直接从数据库编译快照', exc_info=True)
+                metrics.snapshot_loads.inc('db')
+                return RBACSnapshot.build(None)
+
+        snapshot = get_local_snapshot()
+        if snapshot is not None and snapshot.version == policy_version:
+            metrics.snapshot_loads.inc('local')
+            return snapshot
+
+        try:
+            snapshot = RBACSnapshot.from_cache(cache.get(PermissionCache.SNAPSHOT_KEY), policy_version)
         except Exception:
-            # 发生异常时从数据库查询
-            return PermissionCache._get_permissions_from_db(user_id)
-    
+            logger.warning('读取RBAC快照缓存失败', exc_info=True)
+            snapshot = None
+        if snapshot is not None:
+            metrics.snapshot_loads.inc('cache')
+        else:
+            # 同一进程内并发的请求共享一次编译
+            snapshot = _single_flight.do(
+                ('snapshot', policy_version),
+                lambda: PermissionCache._build_snapshot(policy_version),
+            )
+        set_local_snapshot(snapshot)
+        return snapshot
+
     @staticmethod
-    def _get_permissions_from_db(user_id):
-        """从数据库直接查询用户权限"""
+    def _build_snapshot(policy_version):
+        """
+        编译并写入RBAC快照
+        通过短时的缓存锁保证同一时刻只有一个进程编译，其他进程在
+        PERMISSION_SNAPSHOT_LOCK_WAIT 秒内轮询等待其结果，超时后再自行编译
+        """
+        lock_timeout = getattr(settings, 'PERMISSION_SNAPSHOT_LOCK_TIMEOUT', 5)
+        wait = getattr(settings, 'PERMISSION_SNAPSHOT_LOCK_WAIT', 1)
         try:
-            # 方式一：使用查询集
-            user = User.objects.get(id=user_id)
-            role_ids = user.roles.values_list('id', flat=True)
-            permissions = Permission.objects.filter(
-                role__in=role_ids
-            ).distinct().values_list('codename', flat=True)
-            return list(permissions)
+            acquired = cache.add(PermissionCache.SNAPSHOT_LOCK_KEY, policy_version, lock_timeout)
         except Exception:
-            return []
+            logger.warning('获取RBAC快照锁失败', exc_info=True)
+            acquired = False
+            wait = 0
+
+        deadline = time.monotonic() + wait
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.02)
+            try:
+                snapshot = RBACSnapshot.from_cache(cache.get(PermissionCache.SNAPSHOT_KEY), policy_version)
+            except Exception:
+                break
+            if snapshot is not None:
+                metrics.snapshot_loads.inc('cache')
+                return snapshot
+
+        # 以编译前读到的版本写入：编译期间发生的变更会使该版本落后，不会被采用
+        metrics.snapshot_loads.inc('db')
+        snapshot = RBACSnapshot.build(policy_version)
+        try:
+            cache.set(PermissionCache.SNAPSHOT_KEY, snapshot.to_cache(),
+                      settings.PERMISSION_CACHE_TIMEOUT)
+            if acquired:
+                cache.delete(PermissionCache.SNAPSHOT_LOCK_KEY)
+        except Exception:
+            # 如果缓存操作失败，记录后继续执行
+            logger.warning('写入RBAC快照缓存失败', exc_info=True)
+        return snapshot
+
+    @staticmethod
+    def get_versions(refresh=False):
+        """
+        获取当前的RBAC版本号
+        结果在进程内缓存 PERMISSION_VERSION_CHECK_INTERVAL 秒，期间不访问 Redis；
+        本进程发起的失效操作会立即丢弃进程内的版本号
+        
+        Args:
+            refresh: 是否忽略进程内缓存，直接从 Redis 读取
+            
+        Returns:
+            RBACVersions: 全局代数、快照版本、各分桶的用户角色分配版本
+        """
+        global _local_versions
+        now = time.monotonic()
+        interval = getattr(settings, 'PERMISSION_VERSION_CHECK_INTERVAL', 1)
+        cached = _local_versions
+        if not refresh and cached is not None and now - cached[0] < interval:
+            return cached[1]
+        keys = PermissionCache._version_keys()
+        values = cache.get_many(keys)
+        for key in keys:
+            if values.get(key) is None:
+                values[key] = PermissionCache._init_counter(key)
+        versions = PermissionCache._versions_from_values(keys, values)
+        _local_versions = (now, versions)
+        return versions
+
+    @staticmethod
+    async def aget_versions():
+        """get_versions 的异步版本，通过异步客户端读取，与同步版本共用进程内缓存"""
+        global _local_versions
+        now = time.monotonic()
+        interval = getattr(settings, 'PERMISSION_VERSION_CHECK_INTERVAL', 1)
+        cached = _local_versions
+        if cached is not None and now - cached[0] < interval:
+            return cached[1]
+        keys = PermissionCache._version_keys()
+        values = await cache.async_client().get_many(keys)
+        for key in keys:
+            if values.get(key) is None:
+                values[key] = await PermissionCache._ainit_counter(key)
+        versions = PermissionCache._versions_from_values(keys, values)
+        _local_versions = (now, versions)
+        return versions
+
+    @staticmethod
+    def _versions_from_values(keys, values):
+        counters = [values[key] for key in keys]
+        return RBACVersions(counters[0], counters[1], tuple(counters[2:]))
+
+    @staticmethod
+    def _incr_assignment_versions(user_ids):
+        """用户所在分桶的角色分配版本加一，只有同一分桶用户的令牌声明随之过期"""
+        for bucket in sorted({PermissionCache._assignment_bucket(user_id) for user_id in user_ids}):
+            PermissionCache._incr_counter(PermissionCache._assignment_version_key(bucket))
+
+    @staticmethod
+    def _reset_local_versions():
+        global _local_versions
+        _local_versions = None
+
+    @staticmethod
+    def _init_counter(key):
+        """
+        初始化版本计数器（全局代数、快照版本）
+        计数键丢失（如 Redis 重启或被淘汰）时以毫秒时间戳作为新起点，
+        保证不会与残留条目中的旧版本重合
+        """
+        cache.add(key, int(time.time() * 1000), None)
+        return cache.get(key)
+
+    @staticmethod
+    def _incr_counter(key):
+        """版本计数器加一，计数键不存在时重新初始化"""
+        try:
+            cache.incr(key)
+        except ValueError:
+            PermissionCache._init_counter(key)
+
+    @staticmethod
+    def _get_role_ids_from_db(user_id):
+        """从数据库查询用户的角色ID"""
+        return tuple(
+            UserRoles.objects.filter(user_id=user_id)
+            .values_list('role_id', flat=True)
+            .order_by('role_id')
+        )
+
+    @staticmethod
+    def _get_role_ids_for_users_from_db(user_ids):
+        """用一条查询获取多个用户的角色ID，返回 {用户ID: 角色ID元组}"""
+        result = {user_id: [] for user_id in user_ids}
+        rows = (
+            UserRoles.objects.filter(user_id__in=user_ids)
+            .values_list('user_id', 'role_id')
+            .order_by('user_id', 'role_id')
+        )
+        for user_id, role_id in rows:
+            result[user_id].append(role_id)
+        return {user_id: tuple(role_ids) for user_id, role_ids in result.items()}
+
+    @staticmethod
+    def _get_permissions_from_db(user_id):
+        """
+        从数据库直接查询用户权限（缓存不可用时使用）
+        用户的角色及经闭包表得到的祖先角色作为子查询，一次连接查询完成，用户不存在时结果为空；
+        开启物化表时改为按索引读取物化表
+        """
+        metrics.db_fallbacks.inc()
+        if materialized.is_enabled():
+            return list(
+                UserPermission.objects.filter(user_id=user_id)
+                .values_list('codename', flat=True)
+                .order_by('codename')
+            )
+        role_ids = UserRoles.objects.filter(user_id=user_id).values('role_id')
+        ancestor_ids = RoleClosure.objects.filter(descendant_id__in=role_ids).values('ancestor_id')
+        return list(
+            Permission.objects.filter(Q(role__in=role_ids) | Q(role__in=ancestor_ids))
+            .values_list('codename', flat=True)
+            .distinct()
+            .order_by('codename')
+        )
+
+    @staticmethod
+    def _get_permissions_for_users_from_db(user_ids):
+        """
+        解析多个用户的权限，返回 {用户ID: 权限codename列表}
+        直接分配的角色和继承的祖先角色各一条连接查询
+        """
+        metrics.db_fallbacks.inc()
+        result = {user_id: set() for user_id in user_ids}
+        if materialized.is_enabled():
+            rows = UserPermission.objects.filter(user_id__in=user_ids).values_list('user_id', 'codename')
+            for user_id, codename in rows:
+                result[user_id].add(codename)
+            return {user_id: sorted(codenames) for user_id, codenames in result.items()}
+        rows = (
+            Permission.objects.filter(role__user__in=user_ids)
+            .values_list('role__user', 'codename')
+            .distinct()
+        )
+        inherited = (
+            RoleClosure.objects.filter(descendant__user__in=user_ids, ancestor__permissions__isnull=False)
+            .values_list('descendant__user', 'ancestor__permissions__codename')
+            .distinct()
+        )
+        for user_id, codename in [*rows, *inherited]:
+            result[user_id].add(codename)
+        return {user_id: sorted(codenames) for user_id, codenames in result.items()}
 
     @staticmethod
     def clear_user_permissions(user_id=None):
@@ -70,13 +864,191 @@ class PermissionCache:
             user_id: 可选参数，指定要清除缓存的用户ID
                     如果不传，则清除所有用户的缓存
         """
+        start = time.perf_counter()
+        scope = 'user' if user_id else 'global'
+        local = get_local_cache()
+        if local is not None:
+            # 本进程的一级缓存立即清除，其他进程在一级缓存过期后生效
+            if user_id:
+                local.delete(user_id)
+            else:
+                local.clear()
+        PermissionCache._reset_local_versions()
         try:
             if user_id:
-                # 清除指定用户的缓存
-                cache.delete(f"user_permissions_{user_id}")
+                # 写入新的用户版本并删除该用户的缓存，使已签发令牌中的角色声明失效
+                PermissionCache._bump_user_versions([user_id])
+                cache.delete(PermissionCache._user_key(user_id))
+                PermissionCache._incr_assignment_versions([user_id])
             else:
-                # 清除所有用户的缓存（使用通配符）
-                cache.delete_pattern("user_permissions_*")
+                # 全局代数和快照版本加一，所有旧缓存随即失效并自然过期，无需扫描键空间
+                PermissionCache._incr_counter(PermissionCache.GENERATION_KEY)
+                PermissionCache._incr_counter(PermissionCache.POLICY_VERSION_KEY)
+        except Exception:
+            # 如果清除缓存失败，记录后继续执行
+            logger.warning('清除权限缓存失败', exc_info=True)
+        PermissionCache._record_invalidation(scope, start)
+
+    @staticmethod
+    def _bump_user_versions(user_ids):
+        """
+        为用户写入新的用户版本
+        只删除条目不足以阻止失效前开始的回填把旧角色写回，新版本使这些回填条目的标记落后；
+        用户版本的保留时间是缓存过期时间的两倍，长于任何可能被写回的旧条目
+        """
+        version = time.time_ns()
+        cache.set_many(
+            {PermissionCache._user_version_key(user_id): version for user_id in user_ids},
+            settings.PERMISSION_CACHE_TIMEOUT * 2,
+        )
+
+    @staticmethod
+    def clear_users_permissions(user_ids):
+        """
+        批量清除指定用户的权限缓存
+        按 DELETE_BATCH_SIZE 分批调用 delete_many，避免单次命令过大
+        
+        Args:
+            user_ids: 需要清除缓存的用户ID集合
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        start = time.perf_counter()
+        local = get_local_cache()
+        if local is not None:
+            for user_id in user_ids:
+                local.delete(user_id)
+        PermissionCache._reset_local_versions()
+        batch_size = PermissionCache.DELETE_BATCH_SIZE
+        try:
+            for offset in range(0, len(user_ids), batch_size):
+                batch = user_ids[offset:offset + batch_size]
+                PermissionCache._bump_user_versions(batch)
+                cache.delete_many([PermissionCache._user_key(user_id) for user_id in batch])
+            # 使这些用户已签发令牌中的角色声明失效
+            PermissionCache._incr_assignment_versions(user_ids)
         except Exception:
-            # 如果清除缓存失败，忽略错误
-            pass
\ No newline at end of file
+            # 如果清除缓存失败，记录后继续执行
+            logger.warning('批量清除权限缓存失败', exc_info=True)
+        PermissionCache._record_invalidation('users', start)
+
+    @staticmethod
+    def clear_snapshot():
+        """
+        使RBAC快照失效
+        角色或权限变更后调用，快照版本加一即可，用户的角色缓存不受影响；
+        开启一级缓存时本进程立即清空，其他进程在一级缓存过期后生效
+        """
+        start = time.perf_counter()
+        local = get_local_cache()
+        if local is not None:
+            local.clear()
+        PermissionCache._reset_local_versions()
+        try:
+            PermissionCache._incr_counter(PermissionCache.POLICY_VERSION_KEY)
+        except Exception:
+            # 如果清除缓存失败，记录后继续执行
+            logger.warning('清除RBAC快照失败', exc_info=True)
+        PermissionCache._record_invalidation('snapshot', start)
+
+    @staticmethod
+    def _record_invalidation(scope, start):
+        metrics.invalidations.inc(scope)
+        metrics.invalidation_seconds.observe(time.perf_counter() - start, scope)
+
+
+def _invalidate_after_outage():
+    """
+    缓存熔断恢复后调用
+    熔断期间本进程的失效操作只写入了本地降级缓存，Redis 中可能残留变更前的数据，
+    因此全局代数和快照版本各加一（令牌声明中包含全局代数，随之全部过期）
+    """
+    for key in (
+        PermissionCache.GENERATION_KEY,
+        PermissionCache.POLICY_VERSION_KEY,
+    ):
+        PermissionCache._incr_counter(key)
+    PermissionCache._reset_local_versions()
+    metrics.invalidations.inc('global')
+
+
+cache.on_recover = _invalidate_after_outage
+
+
+def warm_permission_cache(active_within=None, chunk_size=1000, workers=1, progress=None):
+    """
+    预热活跃用户的权限缓存（部署、Redis 重启或全局失效后调用）
+    按主键分块流式读取活跃用户，每块用 PermissionCache.warm_users 批量写入，并预先编译RBAC快照
+    
+    Args:
+        active_within: 只预热最近多少天内登录过的用户，None 表示全部活跃用户
+        chunk_size: 每块的用户数
+        workers: 并发写入的线程数
+        progress: 每完成一块时调用的回调，参数为 (已预热用户数, 已用秒数)
+        
+    Returns:
+        dict: 预热的用户数、块数、耗时（秒）和每秒用户数
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import timedelta
+    from django.db import connection
+    from django.utils import timezone
+
+    start = time.perf_counter()
+    PermissionCache.get_snapshot()
+
+    queryset = User.objects.filter(is_active=True)
+    if active_within is not None:
+        queryset = queryset.filter(last_login__gte=timezone.now() - timedelta(days=active_within))
+    user_ids = queryset.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+
+    def chunks():
+        chunk = []
+        for user_id in user_ids:
+            chunk.append(user_id)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def warm(chunk):
+        try:
+            return PermissionCache.warm_users(chunk)
+        finally:
+            # 工作线程各自持有数据库连接，用完即关闭
+            if workers > 1:
+                connection.close()
+
+    warmed = 0
+    chunk_count = 0
+
+    def done(count):
+        nonlocal warmed, chunk_count
+        warmed += count
+        chunk_count += 1
+        if progress is not None:
+            progress(warmed, time.perf_counter() - start)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            for chunk in chunks():
+                pending.append(executor.submit(warm, chunk))
+                # 限制排队的块数，避免一次性读入所有用户ID
+                if len(pending) >= workers * 2:
+                    done(pending.pop(0).result())
+            for future in pending:
+                done(future.result())
+    else:
+        for chunk in chunks():
+            done(warm(chunk))
+
+    elapsed = time.perf_counter() - start
+    return {
+        'users': warmed,
+        'chunks': chunk_count,
+        'seconds': round(elapsed, 3),
+        'users_per_second': round(warmed / elapsed, 1) if elapsed else 0.0,
+    }
@@ -1,57 +1,75 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import HttpResponse
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from .models import Permission, Role
-from .utils import PermissionCache
-from .serializers import PermissionSerializer, RoleSerializer
+from . import datascope, menus, metrics
+from .assignments import bulk_assign_role_permissions, bulk_assign_user_roles
+from .hierarchy import ancestors_of
+from .models import DataScope, Permission, Role
+from .pagination import IdCursorPagination
+from .serializers import (
+    DataScopeSerializer, PermissionSerializer, RoleSerializer,
+    RolePermissionAssignmentSerializer, UserRoleAssignmentSerializer,
+    get_requested_fields,
+)
 
 
-class PermissionViewSet(viewsets.ModelViewSet):
+class SparseFieldsetQuerysetMixin:
     """
-    权限管理视图集
-    提供权限的增删改查，并在权限变更时自动清除缓存
+    按 ?fields= 参数裁剪查询
+    只查询请求的字段，只预取请求的多对多字段，列表序列化不会逐行查询关联表
+    """
+    prefetch_fields = ()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        requested = get_requested_fields(self.request)
+        if requested is None:
+            return queryset.prefetch_related(*self.prefetch_fields)
+        concrete = {field.name for field in queryset.model._meta.concrete_fields}
+        return (
+            queryset.only(*(requested & concrete) or ['pk'])
+            .prefetch_related(*(requested & set(self.prefetch_fields)))
+        )
+
+
+class DataScopeQuerysetMixin:
+    """
+    按当前用户的数据权限过滤查询
+    数据权限编译为 Q 条件由数据库过滤，列表分页仍按索引进行，详情接口对范围外的记录返回404；
+    复用 RBACPermission 鉴权时得到的用户有效权限，不再查询一次权限缓存
     """
-    queryset = Permission.objects.all()
-    serializer_class = PermissionSerializer
 
-    def perform_create(self, serializer):
-        """创建权限后清除所有用户的权限缓存"""
-        serializer.save()
-        PermissionCache.clear_user_permissions()
+    def get_queryset(self):
+        return datascope.filter_queryset(
+            super().get_queryset(), self.request.user, getattr(self.request, '_rbac_permissions', None),
+        )
 
-    def perform_update(self, serializer):
-        """更新权限后清除所有用户的权限缓存"""
-        serializer.save()
-        PermissionCache.clear_user_permissions()
 
-    def perform_destroy(self, instance):
-        """删除权限后清除所有用户的权限缓存"""
-        instance.delete()
-        PermissionCache.clear_user_permissions()
+class PermissionViewSet(DataScopeQuerysetMixin, SparseFieldsetQuerysetMixin, viewsets.ModelViewSet):
+    """
+    权限管理视图集
+    提供权限的增删改查，权限变更时由 rbac.signals 清除受影响用户的缓存
+    列表按主键游标分页，支持 ?fields=codename 只返回部分字段，只返回数据权限范围内的记录
+    """
+    queryset = Permission.objects.all()
+    serializer_class = PermissionSerializer
+    pagination_class = IdCursorPagination
 
-class RoleViewSet(viewsets.ModelViewSet):
+class RoleViewSet(DataScopeQuerysetMixin, SparseFieldsetQuerysetMixin, viewsets.ModelViewSet):
     """
     角色管理视图集
-    提供角色的增删改查，并在角色变更时自动清除缓存
+    提供角色的增删改查，角色变更时由 rbac.signals 清除受影响用户的缓存
+    列表按主键游标分页，支持 ?fields=id,name 只返回部分字段，只返回数据权限范围内的记录
     """
     queryset = Role.objects.all()
     serializer_class = RoleSerializer
+    pagination_class = IdCursorPagination
+    prefetch_fields = ('permissions', 'parents')
 
-    def perform_create(self, serializer):
-        """创建角色后清除所有用户的权限缓存"""
-        serializer.save()
-        PermissionCache.clear_user_permissions()
-
-    def perform_update(self, serializer):
-        """更新角色后清除所有用户的权限缓存"""
-        serializer.save()
-        PermissionCache.clear_user_permissions()
-
-    def perform_destroy(self, instance):
-        """删除角色后清除所有用户的权限缓存"""
-        instance.delete()
-        PermissionCache.clear_user_permissions()
-        
     @action(detail=True, methods=['post'])
     def assign_permissions(self, request, pk=None):
         """
@@ -63,14 +81,104 @@ class RoleViewSet(viewsets.ModelViewSet):
         # 获取权限对象
         permissions = Permission.objects.filter(id__in=permission_ids)
         
-        # 更新角色的权限
+        # 更新角色的权限（m2m_changed 信号会重新编译快照，子角色继承的权限随之更新）
         role.permissions.set(permissions)
         
-        PermissionCache.clear_user_permissions()
-        
         return Response({
             "message": "权限分配成功",
+            "role": RoleSerializer(role).data,
+            # 从父角色继承、无需重复分配的权限
+            "inherited_permissions": sorted(
+                Permission.objects.filter(role__in=ancestors_of([role.pk]))
+                .values_list('codename', flat=True)
+                .distinct()
+            ),
+        })
+
+    @action(detail=True, methods=['post'])
+    def assign_parents(self, request, pk=None):
+        """
+        设置角色的父角色，角色继承父角色的所有权限
+        """
+        role = self.get_object()
+        parent_ids = request.data.get('parent_ids', [])
+        parents = Role.objects.filter(id__in=parent_ids)
+
+        # m2m_changed 信号会检查循环继承，并刷新闭包表和快照
+        try:
+            with transaction.atomic():
+                role.parents.set(parents)
+        except ValidationError as e:
+            return Response({"parent_ids": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "message": "父角色设置成功",
             "role": RoleSerializer(role).data
         })
-        
-        
+
+    @action(detail=False, methods=['post'])
+    def bulk_assign_users(self, request):
+        """
+        批量分配用户角色
+        请求体：{"mode": "add|remove|replace", "pairs": [[用户ID, 角色ID], ...]}
+        """
+        serializer = UserRoleAssignmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added, removed = bulk_assign_user_roles(
+            serializer.validated_data['pairs'], serializer.validated_data['mode'],
+        )
+        return Response({"message": "用户角色分配成功", "added": added, "removed": removed})
+
+    @action(detail=False, methods=['post'])
+    def bulk_assign_permissions(self, request):
+        """
+        批量分配角色权限
+        请求体：{"mode": "add|remove|replace", "pairs": [[角色ID, 权限ID], ...]}
+        """
+        serializer = RolePermissionAssignmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added, removed = bulk_assign_role_permissions(
+            serializer.validated_data['pairs'], serializer.validated_data['mode'],
+        )
+        return Response({"message": "角色权限分配成功", "added": added, "removed": removed})
+
+
+
+class DataScopeViewSet(viewsets.ModelViewSet):
+    """
+    数据权限管理视图集
+    数据权限变更时由 rbac.signals 重新编译RBAC快照，可按 ?role= 过滤
+    """
+    queryset = DataScope.objects.all()
+    serializer_class = DataScopeSerializer
+    pagination_class = IdCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        role = self.request.query_params.get('role')
+        if role and role.isdigit():
+            queryset = queryset.filter(role_id=role)
+        return queryset
+
+
+def metrics_view(request):
+    """
+    指标接口
+    以 Prometheus 文本格式输出鉴权相关指标，只在被抓取时生成内容
+    """
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def menu_view(request):
+    """
+    当前用户的菜单树
+    由有效权限的 menu 字段组织而成，角色组合相同的用户共享缓存；
+    支持 If-None-Match，菜单未变化时返回304，不生成菜单树
+    """
+    etag, load = menus.get_user_menu(request.user)
+    quoted = f'"{etag}"'
+    if quoted in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': quoted})
+    return Response({"data": load()}, headers={'ETag': quoted})
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# 本模块会在密码哈希的子进程中导入，不能在模块级导入模型
+
+
+def init_worker(settings_module):
+    """子进程初始化：加载 Django 配置（spawn 方式启动的子进程不会继承父进程的状态）"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def hash_password(password):
+    """计算密码哈希，password 为空时生成不可用的密码"""
+    from django.contrib.auth.hashers import make_password
+    return make_password(password or None)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hash_executor():
+    """
+    获取计算密码哈希的线程池，大小由 AUTH_HASH_POOL_SIZE 决定
+    PBKDF2 等哈希计算期间会释放 GIL，多个线程可以并行计算；
+    池的大小限制了同时进行的哈希数量，登录高峰时不会占满所有 CPU
+    """
+    global _executor
+    if _executor is None:
+        from django.conf import settings
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'AUTH_HASH_POOL_SIZE', 4),
+                    thread_name_prefix='password-hash',
+                )
+    return _executor
+
+
+async def run_hasher(func, *args):
+    """在密码哈希线程池中执行 func，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), partial(func, *args))
+
+
+def verify_password(password, encoded):
+    """
+    校验密码
+    返回 (是否正确, 新的密码哈希)，哈希算法或迭代次数需要升级时才有新哈希，否则为 None
+    """
+    from django.contrib.auth.hashers import check_password, make_password
+    upgraded = []
+    valid = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return valid, upgraded[0] if upgraded else None
@@ -0,0 +1,197 @@
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from rbac import materialized
+from rbac.models import Role
+from rbac.utils import UserRoles
+from users.hashing import hash_password, init_worker
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        '从 CSV 或 JSONL 文件流式批量导入用户，字段：username、mobile、password、email（可选）、'
+        'roles（可选，角色名称，CSV 中用 | 分隔）'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='导入文件路径，- 表示从标准输入读取')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='文件格式，默认按扩展名判断')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每批校验和写入的行数')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='计算密码哈希的进程数，0 表示在当前进程中计算',
+        )
+        parser.add_argument('--role', action='append', default=[], help='为所有导入的用户分配的角色名称，可重复指定')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.json')) else 'csv')
+        self.role_ids = dict(Role.objects.values_list('name', 'id'))
+        missing = set(options['role']) - set(self.role_ids)
+        if missing:
+            raise CommandError(f"角色不存在：{', '.join(sorted(missing))}")
+        self.default_roles = options['role']
+        # 文件内已出现的用户名和手机号，用于检查文件内部的重复
+        self.seen_usernames = set()
+        self.seen_mobiles = set()
+
+        executor = None
+        if options['workers']:
+            executor = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                initializer=init_worker,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'django_rbac.settings'),),
+            )
+        self.executor = executor
+        self.workers = options['workers']
+
+        start = time.perf_counter()
+        total = imported = skipped = 0
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8-sig', newline='')
+        try:
+            rows = self._read_jsonl(stream) if fmt == 'jsonl' else self._read_csv(stream)
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= options['chunk_size']:
+                    created, errors = self._import_chunk(chunk)
+                    total, imported, skipped = total + len(chunk), imported + created, skipped + errors
+                    self._progress(total, imported, skipped, start)
+                    chunk = []
+            if chunk:
+                created, errors = self._import_chunk(chunk)
+                total, imported, skipped = total + len(chunk), imported + created, skipped + errors
+                self._progress(total, imported, skipped, start)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"导入完成：共 {total} 行，导入 {imported} 个用户，跳过 {skipped} 行，"
+            f"耗时 {time.perf_counter() - start:.1f} 秒"
+        ))
+
+    def _read_csv(self, stream):
+        for line_no, row in enumerate(csv.DictReader(stream), start=2):
+            roles = row.get('roles') or ''
+            row['roles'] = [name for name in roles.split('|') if name]
+            yield line_no, row
+
+    def _read_jsonl(self, stream):
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                row = {}
+            roles = row.get('roles') or []
+            row['roles'] = roles.split('|') if isinstance(roles, str) else roles
+            yield line_no, row
+
+    def _progress(self, total, imported, skipped, start):
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(f"已处理 {total} 行，导入 {imported}，跳过 {skipped}，{rate:.0f} 行/秒")
+        self.stdout.flush()
+
+    def _error(self, line_no, message):
+        self.stderr.write(f"第 {line_no} 行：{message}")
+
+    def _validate(self, chunk):
+        """
+        校验一批数据
+        必填字段和角色逐行检查，用户名和手机号的唯一性对整批各用一条查询检查；
+        用户名和手机号先统一规范化，唯一性查询和逐行检查使用相同的值
+        """
+        rows = [
+            (line_no, row, User.normalize_username(str(row.get('username') or '').strip()),
+             str(row.get('mobile') or '').strip())
+            for line_no, row in chunk
+        ]
+        usernames = {username for _, _, username, _ in rows}
+        mobiles = {mobile for _, _, _, mobile in rows}
+        existing_usernames = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        existing_mobiles = set(User.objects.filter(mobile__in=mobiles).values_list('mobile', flat=True))
+
+        valid = []
+        for line_no, row, username, mobile in rows:
+            roles = list(dict.fromkeys([*self.default_roles, *row.get('roles', [])]))
+            if not username or not mobile:
+                self._error(line_no, '缺少用户名或手机号')
+            elif len(username) > 150 or len(mobile) > 11:
+                self._error(line_no, '用户名或手机号过长')
+            elif username in existing_usernames or username in self.seen_usernames:
+                self._error(line_no, f'用户名 {username} 已存在')
+            elif mobile in existing_mobiles or mobile in self.seen_mobiles:
+                self._error(line_no, f'手机号 {mobile} 已存在')
+            elif any(name not in self.role_ids for name in roles):
+                self._error(line_no, f"角色不存在：{', '.join(name for name in roles if name not in self.role_ids)}")
+            else:
+                self.seen_usernames.add(username)
+                self.seen_mobiles.add(mobile)
+                valid.append((line_no, username, mobile, row.get('email') or '', row.get('password'), roles))
+        return valid
+
+    def _import_chunk(self, chunk):
+        """导入一批数据，返回 (导入的用户数, 跳过的行数)"""
+        valid = self._validate(chunk)
+        if not valid:
+            return 0, len(chunk)
+
+        passwords = [password for _, _, _, _, password, _ in valid]
+        if self.executor is not None:
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            hashed = list(self.executor.map(hash_password, passwords, chunksize=chunksize))
+        else:
+            hashed = [hash_password(password) for password in passwords]
+        rows = list(zip(valid, hashed))
+
+        try:
+            self._write(rows)
+            created = len(rows)
+        except IntegrityError:
+            # 校验之后写入之前数据可能已被其他请求修改（如同时注册的用户），逐行重试并报告失败的行
+            created = 0
+            for row in rows:
+                try:
+                    self._write([row])
+                    created += 1
+                except IntegrityError as exc:
+                    self._error(row[0][0], f'写入失败：{exc}')
+        return created, len(chunk) - created
+
+    def _write(self, rows):
+        """
+        在一个事务中写入用户和角色关联，rows 为 [(校验后的数据, 密码哈希)]
+        关联表直接批量写入，不触发信号，提交后再更新这些用户的物化权限
+        """
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(username=username, mobile=mobile, email=email, password=password)
+                for (_, username, mobile, email, _, _), password in rows
+            ])
+            # 部分数据库的 bulk_create 不回填主键，重新查询
+            user_ids = dict(
+                User.objects.filter(username__in=[username for (_, username, *_), _ in rows])
+                .values_list('username', 'id')
+            )
+            # 新用户没有权限缓存，直接写关联表即可
+            UserRoles.objects.bulk_create([
+                UserRoles(user_id=user_ids[username], role_id=self.role_ids[name])
+                for (_, username, _, _, _, roles), _ in rows
+                for name in roles
+            ])
+        materialized.refresh_users(user_ids.values())
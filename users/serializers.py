@@ -1,12 +1,21 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from django.contrib.auth.password_validation import validate_password
 from rest_framework.validators import UniqueValidator
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from rbac.tokens import add_rbac_claims, rbac_claims_enabled
 
 User = get_user_model()
 
 class UserRegisterSerializer(serializers.ModelSerializer):
     """用户注册序列化器，用于处理用户注册时的数据验证和用户创建"""
+
+    # 有唯一约束的字段
+    UNIQUE_FIELDS = ('username', 'mobile')
     
     # 定义password字段的序列化规则
     password = serializers.CharField(
@@ -33,6 +42,59 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         model = User  # 指定这个序列化器关联的模型
         fields = ('username', 'password', 'password2', 'mobile')  # 指定要序列化/反序列化的字段
 
+    def get_fields(self):
+        """
+        开启 AUTH_REGISTER_FAST_PATH 时去掉唯一性校验，不再在插入前逐个字段 SELECT，
+        改由数据库唯一约束保证，冲突时在 create 中转换为相同的字段错误
+        """
+        fields = super().get_fields()
+        # 记录各字段唯一性校验的错误信息，用于转换唯一约束冲突
+        self.unique_messages = {}
+        fast_path = getattr(settings, 'AUTH_REGISTER_FAST_PATH', False)
+        for name in self.UNIQUE_FIELDS:
+            validators = []
+            for validator in fields[name].validators:
+                if isinstance(validator, UniqueValidator):
+                    self.unique_messages[name] = validator.message
+                    if fast_path:
+                        continue
+                validators.append(validator)
+            fields[name].validators = validators
+        return fields
+
+    @staticmethod
+    def _constraint_identifiers(name):
+        """
+        唯一约束冲突的错误信息中标识字段的片段：
+        SQLite 为 "表.列"，PostgreSQL 为约束名 "表_列_key" 和 "(列)="，MySQL 为 "表.列" 或 "for key '列'"
+        """
+        table = User._meta.db_table
+        column = User._meta.get_field(name).column
+        return (f"{table}.{column}", f'"{table}_{column}_', f"({column})=", f"for key '{column}'")
+
+    def unique_violation(self, exc, data):
+        """
+        把唯一约束冲突（IntegrityError）转换为与 UniqueValidator 相同的字段错误
+        先根据数据库的错误信息判断冲突字段，无法判断时再查询确认；不是唯一约束冲突时返回 None
+        """
+        self.fields  # 确保已记录错误信息
+        message = str(exc)
+        # 错误信息中可能包含冲突的值（如用户名 mobile_fan），只按约束名或列名判断
+        names = [
+            name for name in self.UNIQUE_FIELDS
+            if any(identifier in message for identifier in self._constraint_identifiers(name))
+        ]
+        if not names:
+            names = [
+                name for name in self.UNIQUE_FIELDS
+                if User.objects.filter(**{name: data[name]}).exists()
+            ]
+        if not names:
+            return None
+        return serializers.ValidationError(
+            {name: [self.unique_messages[name]] for name in names}, code='unique',
+        )
+
     def validate(self, attrs):
         """
         全局验证方法，用于验证多个字段之间的关系
@@ -51,7 +113,15 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         # 删除validated_data中的password2字段，因为User模型中没有这个字段
         validated_data.pop('password2')
         # 使用create_user方法创建用户，这个方法会自动加密密码
-        user = User.objects.create_user(**validated_data)
+        # 在保存点内插入，唯一约束冲突不会中断外层事务，并转换为字段错误
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(**validated_data)
+        except IntegrityError as exc:
+            error = self.unique_violation(exc, validated_data)
+            if error is None:
+                raise
+            raise error from exc
         return user
 
 class UserDetailSerializer(serializers.ModelSerializer):
@@ -61,3 +131,27 @@ class UserDetailSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'mobile', 'roles')
         read_only_fields = ('roles',) # 角色字段设为只读，防止通过API直接修改用户角色
 
+
+class RBACTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """登录令牌序列化器，开启 RBAC_TOKEN_CLAIMS 时在令牌中写入角色等RBAC声明"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        if rbac_claims_enabled():
+            add_rbac_claims(token, user.pk, user.is_superuser)
+        return token
+
+
+class RBACTokenRefreshSerializer(TokenRefreshSerializer):
+    """刷新令牌序列化器，开启 RBAC_TOKEN_CLAIMS 时为新的访问令牌重新读取RBAC声明"""
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        if rbac_claims_enabled():
+            access = AccessToken(data['access'])
+            user_id = access[api_settings.USER_ID_CLAIM]
+            is_superuser = User.objects.filter(pk=user_id).values_list('is_superuser', flat=True).first()
+            add_rbac_claims(access, user_id, is_superuser)
+            data['access'] = str(access)
+        return data
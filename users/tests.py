@@ -1,3 +1,221 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+from rbac.models import Role
+from users import views
+
+User = get_user_model()
+
+
+class ImportUsersTest(TestCase):
+    def setUp(self):
+        self.role = Role.objects.create(name='import_role')
+        User.objects.create_user(username='existing', password='test123456', mobile='13900000000')
+
+    def _import(self, content, suffix, **options):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.unlink, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_users', f.name, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_csv(self):
+        """测试CSV导入：跳过库中和文件内重复的用户名、手机号，批量分配角色并输出进度"""
+        content = (
+            'username,mobile,password,roles\n'
+            'alice,13900000001,alice123456,import_role\n'
+            'existing,13900000002,x,\n'
+            'bob,13900000000,x,\n'
+            'alice,13900000003,x,\n'
+            'carol,13900000004,carol123456,missing_role\n'
+            'dave,13900000005,,\n'
+        )
+        out, err = self._import(content, '.csv', chunk_size=2, workers=2)
+        self.assertIn('已处理 6 行，导入 2，跳过 4', out)
+        self.assertEqual(err.count('第 '), 4)
+
+        alice = User.objects.get(username='alice')
+        self.assertTrue(alice.check_password('alice123456'))
+        self.assertEqual(list(alice.roles.all()), [self.role])
+        self.assertFalse(User.objects.get(username='dave').has_usable_password())
+
+    def test_import_jsonl(self):
+        """测试JSONL导入，并为所有用户分配 --role 指定的角色"""
+        content = (
+            '{"username": "erin", "mobile": "13900000011", "password": "erin123456"}\n'
+            'not json\n'
+            '{"username": "frank", "mobile": "13900000012", "password": "frank123456"}\n'
+        )
+        out, err = self._import(content, '.jsonl', workers=0, role=['import_role'])
+        self.assertIn('导入 2 个用户', out)
+        self.assertIn('第 2 行', err)
+        self.assertEqual(self.role.user_set.count(), 2)
+
+    def test_import_refreshes_materialized_permissions(self):
+        """测试开启物化表时导入的用户立即拥有角色的物化权限"""
+        from django.test import override_settings
+        from rbac import materialized
+        from rbac.models import Permission, UserPermission
+        self.role.permissions.add(Permission.objects.create(codename='get:/api/import/'))
+        content = '{"username": "ivan", "mobile": "13900000041", "password": "ivan123456"}\n'
+        with override_settings(PERMISSION_MATERIALIZED=True):
+            self._import(content, '.jsonl', workers=0, role=['import_role'])
+            self.assertEqual(
+                list(UserPermission.objects.filter(user__username='ivan').values_list('codename', flat=True)),
+                ['get:/api/import/'],
+            )
+            self.assertEqual(materialized.verify(), (0, 0))
+
+    def test_import_conflicts(self):
+        """
+        测试导入时的唯一性冲突：
+        1. 带空白的用户名规范化后与已有用户重复，按重复跳过
+        2. 校验之后其他请求注册了同名用户，该批逐行重试，只跳过冲突的行
+        """
+        from unittest import mock
+        from users.hashing import hash_password
+
+        def hash_and_signup(password):
+            if not User.objects.filter(username='grace').exists():
+                User.objects.create_user(username='grace', password='x', mobile='13900000039')
+            return hash_password(password)
+
+        content = (
+            'username,mobile,password\n'
+            ' existing,13900000031,x\n'
+            'grace,13900000032,x\n'
+            'heidi,13900000033,heidi123456\n'
+        )
+        with mock.patch('users.management.commands.import_users.hash_password', hash_and_signup):
+            out, err = self._import(content, '.csv', workers=0)
+        self.assertIn('导入 1 个用户，跳过 2 行', out)
+        self.assertIn('第 2 行：用户名 existing 已存在', err)
+        self.assertIn('第 3 行：写入失败', err)
+        self.assertTrue(User.objects.get(username='heidi').check_password('heidi123456'))
+        self.assertEqual(User.objects.get(username='grace').mobile, '13900000039')
+
+
+class AsyncAuthViewsTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        User.objects.create_user(username='async_user', password='async123456', mobile='13900000021')
+
+    def _call(self, view, data, content_type='application/json'):
+        """分别调用同步和异步视图，返回两者的 (状态码, 响应内容)"""
+        sync_view, async_view = {
+            'login': (views.LoginView.as_view(), views.async_login),
+            'register': (views.register, views.async_register),
+            'refresh': (views.RefreshView.as_view(), views.async_refresh),
+        }[view]
+        body = json.dumps(data)
+        results = []
+        for func in (sync_view, async_to_sync(async_view)):
+            response = func(self.factory.post(f'/api/auth/{view}/', body, content_type=content_type))
+            if hasattr(response, 'render'):
+                response.render()
+            results.append((response.status_code, json.loads(response.content)))
+        return results
+
+    def test_login(self):
+        """测试异步登录与同步登录的响应一致"""
+        (sync_status, sync_data), (async_status, async_data) = self._call(
+            'login', {'username': 'async_user', 'password': 'async123456'},
+        )
+        self.assertEqual((sync_status, async_status), (200, 200))
+        self.assertEqual(async_data['message'], sync_data['message'])
+        self.assertEqual(set(async_data['data']), {'refresh', 'access'})
+        self.assertIsNotNone(User.objects.get(username='async_user').last_login)
+
+        for data in (
+            {'username': 'async_user', 'password': 'wrong'},
+            {'username': 'nobody', 'password': 'async123456'},
+            {'username': 'async_user'},
+        ):
+            sync_result, async_result = self._call('login', data)
+            self.assertEqual(async_result, sync_result)
+
+        # 刷新令牌
+        refresh = async_data['data']['refresh']
+        (sync_status, _), (async_status, async_data) = self._call('refresh', {'refresh': refresh})
+        self.assertEqual((sync_status, async_status), (200, 200))
+        self.assertIn('access', async_data)
+        sync_result, async_result = self._call('refresh', {'refresh': 'invalid'})
+        self.assertEqual(async_result, sync_result)
+
+    def test_register(self):
+        """测试异步注册创建的用户可以登录，校验错误与同步注册一致"""
+        request = self.factory.post('/api/auth/register/', json.dumps({
+            'username': 'async_new', 'password': 'Async!123456', 'password2': 'Async!123456', 'mobile': '13900000022',
+        }), content_type='application/json')
+        response = async_to_sync(views.async_register)(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['data']['username'], 'async_new')
+        self.assertTrue(User.objects.get(username='async_new').check_password('Async!123456'))
+
+        sync_result, async_result = self._call('register', {
+            'username': 'async_user', 'password': 'Async!123456', 'password2': 'x', 'mobile': '13900000021',
+        })
+        self.assertEqual(sync_result[0], 400)
+        self.assertEqual(async_result, sync_result)
+
+
+class RegisterFastPathTest(TestCase):
+    def setUp(self):
+        User.objects.create_user(username='taken', password='test123456', mobile='13900000031')
+
+    def _register(self, username, mobile):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework.test import APIClient
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post('/api/auth/register/', {
+                'username': username, 'password': 'Fast!123456', 'password2': 'Fast!123456', 'mobile': mobile,
+            }, format='json')
+        selects = [q for q in queries if q['sql'].startswith('SELECT')]
+        return response.status_code, response.data, len(selects)
+
+    def test_fast_path(self):
+        """测试快速路径不做唯一性预查询，唯一约束冲突返回与原来相同的字段错误"""
+        status_code, _, normal_selects = self._register('normal', '13900000032')
+        self.assertEqual(status_code, 201)
+        expected = [self._register('taken', '13900000033'), self._register('other', '13900000031')]
+
+        with self.settings(AUTH_REGISTER_FAST_PATH=True):
+            status_code, _, selects = self._register('fast', '13900000034')
+            self.assertEqual(status_code, 201)
+            # 少了用户名和手机号两次唯一性查询
+            self.assertEqual(selects, normal_selects - 2)
+            for (status_code, data, _), (username, mobile) in zip(expected, [('taken', '13900000035'), ('other', '13900000031')]):
+                self.assertEqual(status_code, 400)
+                self.assertEqual(self._register(username, mobile)[:2], (400, data))
+            # 异步注册视图同样转换唯一约束冲突
+            request = RequestFactory().post('/api/auth/register/', json.dumps({
+                'username': 'taken', 'password': 'Fast!123456', 'password2': 'Fast!123456', 'mobile': '13900000036',
+            }), content_type='application/json')
+            response = async_to_sync(views.async_register)(request)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content), {'username': [str(expected[0][1]['username'][0])]})
+        self.assertFalse(User.objects.filter(username='other').exists())
+
+    def test_unique_violation_message(self):
+        """测试按约束名或列名判断冲突字段，错误信息中的冲突值不影响判断"""
+        from django.db import IntegrityError
+        from users.serializers import UserRegisterSerializer
+        serializer = UserRegisterSerializer()
+        data = {'username': 'mobile_fan', 'mobile': '13900000037'}
+        messages = {
+            'UNIQUE constraint failed: users_user.mobile': ['mobile'],
+            'duplicate key value violates unique constraint "users_user_username_key"\n'
+            'DETAIL:  Key (username)=(mobile_fan) already exists.': ['username'],
+            "(1062, \"Duplicate entry 'mobile_fan' for key 'users_user.username'\")": ['username'],
+        }
+        for message, names in messages.items():
+            error = serializer.unique_violation(IntegrityError(message), data)
+            self.assertEqual(sorted(error.detail), names, message)
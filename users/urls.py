@@ -1,16 +1,21 @@
+from django.conf import settings
 from django.urls import path, include
-from rest_framework_simplejwt.views import (
-    TokenRefreshView,
-    TokenVerifyView,
-)
 from . import views
 
 # 认证相关的URL模式
-auth_patterns = [
-    path('register/', views.register, name='register'),
-    path('login/', views.LoginView.as_view(), name='login'),
-    path('refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-]
+if getattr(settings, 'AUTH_ASYNC_VIEWS', False):
+    # ASGI 部署时使用异步视图，密码哈希不阻塞事件循环
+    auth_patterns = [
+        path('register/', views.async_register, name='register'),
+        path('login/', views.async_login, name='login'),
+        path('refresh/', views.async_refresh, name='token_refresh'),
+    ]
+else:
+    auth_patterns = [
+        path('register/', views.register, name='register'),
+        path('login/', views.LoginView.as_view(), name='login'),
+        path('refresh/', views.RefreshView.as_view(), name='token_refresh'),
+    ]
 
 app_name = 'users'
 
@@ -1,10 +1,28 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException, AuthenticationFailed, MethodNotAllowed
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework_simplejwt.views import TokenObtainPairView
-from .serializers import UserRegisterSerializer, UserDetailSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .hashing import hash_password, run_hasher, verify_password
+from .serializers import (
+    UserRegisterSerializer,
+    UserDetailSerializer,
+    RBACTokenObtainPairSerializer,
+    RBACTokenRefreshSerializer,
+)
 
+User = get_user_model()
 
 
 @api_view(['POST'])
@@ -23,6 +41,8 @@ def register(request):
 
 class LoginView(TokenObtainPairView):
     """用户登录视图"""
+    serializer_class = RBACTokenObtainPairSerializer
+
     def post(self, request, *args, **kwargs):
         response = super().post(request, *args, **kwargs)
         if response.status_code == 200:
@@ -30,4 +50,123 @@ class LoginView(TokenObtainPairView):
                 "message": "登录成功",
                 "data": response.data
             })
-        return response
\ No newline at end of file
+        return response
+
+
+class RefreshView(TokenRefreshView):
+    """刷新令牌视图"""
+    serializer_class = RBACTokenRefreshSerializer
+
+
+# 以下为异步版本的认证视图，响应格式与上面的同步视图一致，
+# 在 ASGI 下部署并开启 AUTH_ASYNC_VIEWS 时使用
+
+def _json_response(data, status=status.HTTP_200_OK, headers=None):
+    """按 DRF 的 JSON 格式输出响应"""
+    return HttpResponse(
+        JSONRenderer().render(data), status=status,
+        content_type='application/json', headers=headers,
+    )
+
+
+def _exception_response(exc):
+    """按 DRF 默认异常处理的格式输出异常"""
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    headers = None
+    if isinstance(exc, AuthenticationFailed):
+        headers = {'WWW-Authenticate': 'Bearer realm="api"'}
+    return _json_response(data, exc.status_code, headers)
+
+
+def _parse_request(request):
+    """用 DRF 的解析器解析请求体（JSON、表单或 multipart）"""
+    if request.method != 'POST':
+        raise MethodNotAllowed(request.method)
+    return Request(request, parsers=[JSONParser(), FormParser(), MultiPartParser()]).data
+
+
+@csrf_exempt
+async def async_register(request):
+    """
+    异步用户注册视图
+    字段校验和唯一性查询在线程中执行，密码哈希在哈希线程池中计算；
+    开启 AUTH_REGISTER_FAST_PATH 时不做唯一性查询，唯一约束冲突转换为相同的字段错误
+    """
+    try:
+        data = _parse_request(request)
+    except APIException as exc:
+        return _exception_response(exc)
+    serializer = UserRegisterSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return _json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+    validated_data = dict(serializer.validated_data)
+    validated_data.pop('password2')
+    password = await run_hasher(hash_password, validated_data.pop('password'))
+    validated_data['username'] = User.normalize_username(validated_data['username'])
+
+    def create_user():
+        # 与 acreate 一样在线程中执行，但放在保存点内，唯一约束冲突不会中断外层事务
+        with transaction.atomic():
+            return User._default_manager.create(password=password, **validated_data)
+
+    try:
+        user = await sync_to_async(create_user)()
+    except IntegrityError as exc:
+        error = await sync_to_async(serializer.unique_violation)(exc, validated_data)
+        if error is None:
+            raise
+        return _exception_response(error)
+    return _json_response({
+        "message": "注册成功",
+        "data": await sync_to_async(lambda: UserDetailSerializer(user).data)()
+    }, status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+async def async_login(request):
+    """
+    异步用户登录视图
+    用户查询使用异步ORM，密码校验在哈希线程池中执行，不阻塞事件循环
+    """
+    try:
+        data = _parse_request(request)
+        serializer = RBACTokenObtainPairSerializer(data=data)
+        # 只做字段校验，认证在下面异步完成
+        attrs = serializer.to_internal_value(data)
+    except APIException as exc:
+        return _exception_response(exc)
+
+    user = await User._default_manager.filter(
+        **{User.USERNAME_FIELD: attrs[User.USERNAME_FIELD]}
+    ).afirst()
+    if user is None:
+        # 与 ModelBackend 一致：用户不存在时同样计算一次哈希，避免通过耗时判断用户是否存在
+        await run_hasher(hash_password, attrs['password'])
+        valid = False
+    else:
+        valid, upgraded = await run_hasher(verify_password, attrs['password'], user.password)
+        if valid and upgraded:
+            await User._default_manager.filter(pk=user.pk).aupdate(password=upgraded)
+    if not valid or not api_settings.USER_AUTHENTICATION_RULE(user):
+        return _exception_response(AuthenticationFailed(
+            serializer.error_messages['no_active_account'], 'no_active_account',
+        ))
+
+    # 写入RBAC声明需要读取缓存和角色
+    refresh = await sync_to_async(RBACTokenObtainPairSerializer.get_token)(user)
+    if api_settings.UPDATE_LAST_LOGIN:
+        await User._default_manager.filter(pk=user.pk).aupdate(last_login=timezone.now())
+    return _json_response({
+        "message": "登录成功",
+        "data": {"refresh": str(refresh), "access": str(refresh.access_token)}
+    })
+
+
+@csrf_exempt
+async def async_refresh(request):
+    """
+    异步刷新令牌视图
+    刷新不涉及密码哈希，只有一次用户查询，直接在线程中执行同步视图以保持行为一致
+    """
+    return await sync_to_async(RefreshView.as_view())(request)